@@ -1,4 +1,6 @@
 from DataService import Mongo
+from movieRecommend import MovieRecommend
+from userMatrix import HistoryNeighbours
 import pymongo
 
 class User(object):
@@ -7,7 +9,9 @@ class User(object):
     def __init__(self, user_name, exist=False):
         self.name = user_name
         self.mongo = Mongo("movieRecommend")
-        self.recommend = MovieRecommend(mongo)
+        self.recommend = MovieRecommend(self.mongo)
+        # similar users of the movies, updated one movie at a time (built on first use)
+        self.neighbours = None
         if not exist:
             # tag ids
             self.tags = set()
@@ -32,11 +36,21 @@ class User(object):
     @classmethod
     def add_movie(self, movie):
         self.movies.add(movie)
+        if self.neighbours is not None:
+            self.neighbours.add(movie)
 
     @classmethod
     def remove_movie(self, movie):
         if movie in self.movies:
             self.movies.remove(movie)
+            if self.neighbours is not None:
+                self.neighbours.remove(movie)
+
+    @classmethod
+    def get_neighbours(self):
+        if self.neighbours is None:
+            self.neighbours = HistoryNeighbours(self.recommend.get_user_matrix(), self.movies)
+        return self.neighbours
 
     # store user into database
     @classmethod
@@ -54,4 +68,4 @@ class User(object):
 
     @classmethod
     def get_recommend_by_history(self):
-        return self.recommend.get_similar_users_by_history(self.movies)
+        return self.recommend.get_similar_users_by_neighbours(self.get_neighbours())
@@ -4,8 +4,10 @@ import time
 # Parsing of IMDB aka-titles.list file.
 # Appends to following movie database field:
 #		-All Titles (title)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 100000  # How often should we print a progress report to the console?
 	progressTotal = 1000000     # Approximate number of total lines in the file.	  
 	count = 0
@@ -17,8 +19,9 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of aka-titles.list ===")
 	startTime = time.time()
-	f = open("imdbdata/aka-titles.list", encoding="latin1")
+	f = imdbUtil.ListFile("imdbdata/aka-titles.list", imdbUtil.startOffset(checkpoint))
 	title = -1
+	titleOffset = f.offset # Byte offset of the line of the current title
 	isEpisode = False
 	akatitles = []
 
@@ -44,12 +47,15 @@ def parse(mongo, collectionName):
 
 				isEpisode = False
 				title = line
+				titleOffset = f.lineOffset
 				akatitles = []		
 
 		if bulkCount >= bulkSize:
 			bulkPayload.execute()
 			bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 			bulkCount = 0
+			if checkpoint is not None:
+				checkpoint.save(titleOffset) # every title before the current one is in the database
 	f.close()
 
 	if bulkCount > 0:
@@ -1,13 +1,14 @@
 import imdbUtil
 import time
-import csv
 import re
 
 # Parsing of IMDB production-companies.list file.
 # Adds fields to movie database:
 #		-Production Company (companies)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 100000  # How often should we print a progress report to the console?
 	progressTotal = 2400000     # Approximate number of total lines in the file.	  
 	count = 0
@@ -19,11 +20,12 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of production-companies.list ===")
 	startTime = time.time()
-	with open("imdbdata/production-companies.list", encoding="latin1") as tsv:
+	with imdbUtil.ListFile("imdbdata/production-companies.list", imdbUtil.startOffset(checkpoint)) as tsv:
 		companies = []
 		title = -1
 		lastTitle = -1
-		for line in csv.reader(tsv, delimiter="\t"):			
+		titleOffset = tsv.offset # Byte offset of the first row of the current title
+		for rowOffset, line in imdbUtil.readRows(tsv):			
 			valueInd = 0 #Which column in the TSV file are we reading?
 			count += 1
 			if count % progressInterval == 0:
@@ -37,6 +39,8 @@ def parse(mongo, collectionName):
 						break
 					lastTitle = title
 					title = value
+					if title != lastTitle:
+						titleOffset = rowOffset
 
 					# We moved onto the next movie; update the the database with the company info of the previous movie first.
 					if title != lastTitle and len(companies) > 0:
@@ -54,6 +58,8 @@ def parse(mongo, collectionName):
 				bulkPayload.execute()
 				bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 				bulkCount = 0
+				if checkpoint is not None:
+					checkpoint.save(titleOffset) # every title before the current one is in the database
 
 	if len(companies) > 0:
 		bulkPayload.find( {"imdbtitle":imdbUtil.formatTitle(lastTitle)} ).update( {
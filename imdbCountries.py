@@ -1,12 +1,13 @@
 import imdbUtil
 import time
-import csv
 
 # Parsing of IMDB countries.list file.
 # Adds fields to movie database:
 #		-Country of Origin (country)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 100000 # How often should we print a progress report to the console?
 	progressTotal = 1800000   # Approximate number of total lines in the file.	  
 	count = 0
@@ -18,8 +19,8 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of countries.list ===")
 	startTime = time.time()
-	with open("imdbdata/countries.list", encoding="latin1") as tsv:
-		for line in csv.reader(tsv, delimiter="\t"):			
+	with imdbUtil.ListFile("imdbdata/countries.list", imdbUtil.startOffset(checkpoint)) as tsv:
+		for rowOffset, line in imdbUtil.readRows(tsv):			
 			title = -1
 			country = -1
 			valueInd = 0 #Which column in the TSV file are we reading?
@@ -50,6 +51,8 @@ def parse(mongo, collectionName):
 					bulkPayload.execute()
 					bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 					bulkCount = 0
+					if checkpoint is not None:
+						checkpoint.save(tsv.offset)
 
 	if bulkCount > 0:
 		bulkPayload.execute()
@@ -1,6 +1,5 @@
 import imdbUtil
 import time
-import csv
 
 # Parsing of IMDB genres.list file.
 # Adds fields to movie database:
@@ -8,15 +7,16 @@ import csv
 #
 # Also excludes all movies from the database tagged under the genre "Adult", because I don't
 # want to take the chance of one of those popping up during a live demo.....
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 100000 # How often should we print a progress report to the console?
 	progressTotal = 2200000   # Approximate number of total lines in the file.	  
 	count = 0
 	updateCount = 0
 	removeCount = 0
 	ignoreUntil = "8: THE GENRES LIST" #Ignore parsing of lines until one matching this string is found
-	ignoring = True
 
 	bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 	bulkSize = 5000 		  # How many queries should we store in memory before sending them to the database in bulk?
@@ -24,11 +24,14 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of genres.list ===")
 	startTime = time.time()
-	with open("imdbdata/genres.list", encoding="latin1") as tsv:
+	offset = imdbUtil.startOffset(checkpoint)
+	ignoring = offset == 0 # a checkpoint is always past the header
+	with imdbUtil.ListFile("imdbdata/genres.list", offset) as tsv:
 		genres = []
 		title = -1
 		lastTitle = -1
-		for line in csv.reader(tsv, delimiter="\t"):			
+		titleOffset = tsv.offset # Byte offset of the first row of the current title
+		for rowOffset, line in imdbUtil.readRows(tsv):			
 			valueInd = 0 #Which column in the TSV file are we reading?
 			count += 1
 			if count % progressInterval == 0:
@@ -46,6 +49,8 @@ def parse(mongo, collectionName):
 						break
 					lastTitle = title
 					title = value
+					if title != lastTitle:
+						titleOffset = rowOffset
 
 					# We moved onto the next movie; update the the database with the genre info of the previous movie first.
 					if title != lastTitle and len(genres) > 0:
@@ -67,6 +72,8 @@ def parse(mongo, collectionName):
 				bulkPayload.execute()
 				bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 				bulkCount = 0
+				if checkpoint is not None:
+					checkpoint.save(titleOffset) # every title before the current one is in the database
 
 	if len(genres) > 0:
 		if "Adult" in genres:
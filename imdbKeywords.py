@@ -7,15 +7,16 @@ import imdbMovieLensTags
 # Parsing of IMDB keywords.list file.
 # Adds fields to movie database:
 #		-List of keywords (keywords)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 250000 # How often should we print a progress report to the console?
 	progressTotal = 6400000   # Approximate number of total lines in the file.	  
 	count = 0
 	updateCount = 0
 	removeCount = 0
 	ignoreUntil = "8: THE KEYWORDS LIST" #Ignore parsing of lines until one matching this string is found
-	ignoring = True
 
 	bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 	bulkSize = 5000 		  # How many queries should we store in memory before sending them to the database in bulk?
@@ -23,11 +24,14 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of keywords.list ===")
 	startTime = time.time()
-	with open("imdbdata/keywords.list", encoding="latin1") as tsv:
+	offset = imdbUtil.startOffset(checkpoint)
+	ignoring = offset == 0 # a checkpoint is always past the header
+	with imdbUtil.ListFile("imdbdata/keywords.list", offset) as tsv:
 		keywords = []
 		title = -1
 		lastTitle = -1
-		for line in csv.reader(tsv, delimiter="\t"):			
+		titleOffset = tsv.offset # Byte offset of the first row of the current title
+		for rowOffset, line in imdbUtil.readRows(tsv):			
 			valueInd = 0 #Which column in the TSV file are we reading?
 			count += 1
 			if count % progressInterval == 0:
@@ -45,6 +49,8 @@ def parse(mongo, collectionName):
 						break
 					lastTitle = title
 					title = value
+					if title != lastTitle:
+						titleOffset = rowOffset
 
 					# We moved onto the next movie; update the the database with the keyword info of the previous movie first.
 					if title != lastTitle and len(keywords) > 0:
@@ -62,6 +68,8 @@ def parse(mongo, collectionName):
 				bulkPayload.execute()
 				bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 				bulkCount = 0
+				if checkpoint is not None:
+					checkpoint.save(titleOffset) # every title before the current one is in the database
 
 	if len(keywords) > 0:
 		bulkPayload.find( {"imdbtitle":imdbUtil.formatTitle(title)} ).update( {
@@ -86,7 +94,7 @@ def collectKeywords(mongo):
 	bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["keywords"], ordered=False)	
 	bulkSize = 5000 		  # How many queries should we store in memory before sending them to the database in bulk?
 	bulkCount = 0
-	skipCount
+	skipCount = 0
 
 	print("=== Collecting List and Frequency of all Keywords ===")
 	startTime = time.time()
@@ -1,12 +1,13 @@
 import imdbUtil
 import time
-import csv
 
 # Parsing of IMDB language.list file.
 # Adds fields to movie database:
 #		-Language (languages)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 100000  # How often should we print a progress report to the console?
 	progressTotal = 1800000     # Approximate number of total lines in the file.	  
 	count = 0
@@ -18,11 +19,12 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of language.list ===")
 	startTime = time.time()
-	with open("imdbdata/language.list", encoding="latin1") as tsv:
+	with imdbUtil.ListFile("imdbdata/language.list", imdbUtil.startOffset(checkpoint)) as tsv:
 		languages = []
 		title = -1
 		lastTitle = -1
-		for line in csv.reader(tsv, delimiter="\t"):			
+		titleOffset = tsv.offset # Byte offset of the first row of the current title
+		for rowOffset, line in imdbUtil.readRows(tsv):			
 			valueInd = 0 #Which column in the TSV file are we reading?
 			count += 1
 			if count % progressInterval == 0:
@@ -36,6 +38,8 @@ def parse(mongo, collectionName):
 						break
 					lastTitle = title
 					title = value
+					if title != lastTitle:
+						titleOffset = rowOffset
 
 					# We moved onto the next movie; update the the database with the language info of the previous movie first.
 					if title != lastTitle and len(languages) > 0:
@@ -53,6 +57,8 @@ def parse(mongo, collectionName):
 				bulkPayload.execute()
 				bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 				bulkCount = 0
+				if checkpoint is not None:
+					checkpoint.save(titleOffset) # every title before the current one is in the database
 
 	if len(languages) > 0:
 		bulkPayload.find( {"imdbtitle":imdbUtil.formatTitle(lastTitle)} ).update( {
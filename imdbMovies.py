@@ -1,15 +1,16 @@
 import pymongo
 import imdbUtil
 import time
-import csv
 
 # Parsing of IMDB movies.list file.
 # Adds fields to database:
 #		-Movie Title 	(imdbtitle/title)
 #		-Release Year 	(year)
 #		-Is TV Show?	(tv)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 100000 # How often should we print a progress report to the console?
 	progressTotal = 3700000   # Approximate number of total lines in the file.
 	bulkSize = 5000 		  # How many documents should we store in memory before inserting them into the database in bulk?
@@ -24,8 +25,8 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of movies.list ===")
 	startTime = time.time()
-	with open("imdbdata/movies.list", encoding="latin1") as tsv:
-		for line in csv.reader(tsv, delimiter="\t"):			
+	with imdbUtil.ListFile("imdbdata/movies.list", imdbUtil.startOffset(checkpoint)) as tsv:
+		for rowOffset, line in imdbUtil.readRows(tsv):			
 			title = -1
 			year = -1
 			valueInd = 0 #Which column in the TSV file are we reading?
@@ -66,6 +67,8 @@ def parse(mongo, collectionName):
 						skipCount += len(e.details["writeErrors"])
 					bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db[collectionName], ordered=False)	
 					bulkCount = 0
+					if checkpoint is not None:
+						checkpoint.save(rowOffset) # everything before this title is in the database
 
 				pendingDoc["imdbtitle"] = title
 				pendingDoc["title"] = [imdbUtil.simpleTitle(title)]
@@ -1,4 +1,5 @@
 import DataService
+import imdbUtil
 import imdbMovies
 import imdbAkaTitles
 import imdbCountries
@@ -9,78 +10,178 @@ import imdbLanguages
 import imdbRelatedFilms
 import imdbKeywords
 import imdbPeople
+import multiprocessing
+import argparse
+import time
+import sys
 
-# Approximate total run time: ~1 hour
+# Parsing of all IMDB lists into the imdb database.
+# Usage: python imdbParser.py [stage or group ...] [--workers N] [--restart] [--list]
+#		(no stage: run everything)
+#
+# Stages run in three phases:
+#		1. movies: creates the movie documents every other stage updates
+#		2. every other list file, in parallel in a process pool (longest first); the people lists are
+#		   parsed one after another, each split into chunks over its own pool of workers
+#		3. keywordsintegrate: needs the keywords of phase 2
+# Each stage checkpoints its byte offset (people lists: the chunks written) in imdbdata/checkpoints/<stage>.json after every bulk write.
+# A crashed run is resumed by running the same command again: finished stages are skipped and
+# interrupted stages continue from their checkpoint. --restart parses the selected stages from the start.
+#
+# Sequential run time was ~1 hour, dominated by the people lists (actors.list alone took ~29m).
+# Up to twice --workers processes run at the same time during phase 2.
 
 collectionName = "movies"
-mongo = DataService.Mongo("imdb")
-mongo.db[collectionName].create_index("imdbtitle", unique=True)
-mongo.db["keywords"].create_index("keyword", unique=True)
-
-runType = "keywordsintegrate" #Leave this as an empty string to run all the below operations. Set to appropriate string to run just one of the below operations.
-
-# Add all movie titles and release years into database.
-# --- Most recent tested runtime (1m45s)
-if runType == "" or runType == "movies":
-	imdbMovies.parse(mongo, collectionName)    
-
-# Update all movies with genre lists.
-# --- Most recent tested runtime (3m10s)
-if runType == "" or runType == "genres":
-	imdbGenres.parse(mongo, collectionName) 
-
-# Update all movies with lists of alternate titles.
-# --- Most recent tested runtime (50s)
-if runType == "" or runType == "akatitles":
-	imdbAkaTitles.parse(mongo, collectionName)
-
-# Update all movies with country information.
-# --- Most recent tested runtime (3m10s)
-if runType == "" or runType == "countries":
-	imdbCountries.parse(mongo, collectionName) 
-
-# Update all movies with age rating information.
-# --- Most recent tested runtime (3s)
-# (!!) Can we find a better MPAA list than the mpaa-ratings-reasons.list that IMDB provides?
-# (!!) The IMDB list only contains ratings for ~15,000 movies, compared to the 1,000,000 something
-# (!!) movies in our database.
-if runType == "" or runType == "mpaa":
-	imdbRatings.parse(mongo, collectionName)  
-
-# Update all movies with production company information.
-# --- Most recent tested runtime (2m30s)
-if runType == "" or runType == "companies":
-	imdbCompanies.parse(mongo, collectionName) 
-
-# Update all movies with language information.
-# --- Most recent tested runtime (3m10s)
-if runType == "" or runType == "languages":
-	imdbLanguages.parse(mongo, collectionName) 
-
-# Update all movies with taxonomic information.
-# --- Most recent tested runtime (31s)
-if runType == "" or runType == "related":
-	imdbRelatedFilms.parse(mongo, collectionName) 
-
-# Update all movies with cast and crew information.
-if runType == "" or runType == "people":
-	imdbPeople.parse(mongo, collectionName, "crew", "composers.list", 1300000)  # --- Most recent tested runtime (5m05s)
-	imdbPeople.parse(mongo, collectionName, "crew", "directors.list", 2900000)  # --- Most recent tested runtime (4m10s)
-	imdbPeople.parse(mongo, collectionName, "crew", "producers.list", 7000000)  # --- Most recent tested runtime (9m)
-	imdbPeople.parse(mongo, collectionName, "cast", "actresses.list", 11400000) # --- Most recent tested runtime (13m05s)
-	imdbPeople.parse(mongo, collectionName, "cast", "actors.list", 19000000)    # --- Most recent tested runtime (28m45s)
-
-# Collect all IMDB keywords and their respective frequencies, add it to the "keywords" collection.
-# --- Most recent tested runtime (8s)
-if runType == "" or runType == "keywordscollect" or runType == "keywordsfull":
-	imdbKeywords.collectKeywords(mongo)
-
-# Update all movies with keyword information.
-# --- Most recent tested runtime (3m)
-if runType == "" or runType == "keywords" or runType == "keywordsfull":
-	imdbKeywords.parse(mongo, collectionName)
-
-# Update all movies and keywords with MovieLens integration data
-# --- Most recent tested runtime ()
-if runType == "" or runType == "keywordsintegrate" or runType == "keywordsfull":
-	imdbKeywords.processMovieLensLinks(mongo)
\ No newline at end of file
+
+# Stage name: (parse function, extra arguments, resumable from a checkpoint?, most recent tested runtime in seconds)
+STAGES = {
+	"movies": (imdbMovies.parse, (), True, 105),
+	"genres": (imdbGenres.parse, (), True, 190),
+	"akatitles": (imdbAkaTitles.parse, (), True, 50),
+	"countries": (imdbCountries.parse, (), True, 190),
+	# (!!) The IMDB list only contains ratings for ~15,000 movies, compared to the 1,000,000 something movies in our database.
+	"mpaa": (imdbRatings.parse, (), True, 3),
+	"companies": (imdbCompanies.parse, (), True, 150),
+	"languages": (imdbLanguages.parse, (), True, 190),
+	"related": (imdbRelatedFilms.parse, (), True, 31),
+	"composers": (imdbPeople.parse, ("crew", "composers.list", 1300000), True, 305),
+	"directors": (imdbPeople.parse, ("crew", "directors.list", 2900000), True, 250),
+	"producers": (imdbPeople.parse, ("crew", "producers.list", 7000000), True, 540),
+	"actresses": (imdbPeople.parse, ("cast", "actresses.list", 11400000), True, 785),
+	"actors": (imdbPeople.parse, ("cast", "actors.list", 19000000), True, 1725),
+	"keywordscollect": (imdbKeywords.collectKeywords, None, False, 8),
+	"keywords": (imdbKeywords.parse, (), True, 180),
+	"keywordsintegrate": (imdbKeywords.processMovieLensLinks, None, False, 0)
+	}
+
+PHASES = [
+	["movies"],
+	["genres", "akatitles", "countries", "mpaa", "companies", "languages", "related",
+		"composers", "directors", "producers", "actresses", "actors", "keywordscollect", "keywords"],
+	["keywordsintegrate"]
+	]
+
+GROUPS = {
+	"people": ["composers", "directors", "producers", "actresses", "actors"],
+	"keywordsfull": ["keywordscollect", "keywords", "keywordsintegrate"]
+	}
+
+# Runs one stage with its own database connection (in a stage pool worker, or in this process for the people lists).
+def runStage(stage, workers=1):
+	function, args, resumable, runtime = STAGES[stage]
+	mongo = DataService.Mongo("imdb")
+	checkpoint = imdbUtil.Checkpoint(stage)
+	startTime = time.time()
+	if args is None:
+		function(mongo)
+	elif stage in GROUPS["people"]:
+		function(mongo, collectionName, *args, checkpoint=checkpoint, workers=workers)
+	elif resumable:
+		function(mongo, collectionName, *args, checkpoint=checkpoint)
+	else:
+		function(mongo, collectionName, *args)
+	checkpoint.finish()
+	return stage, time.time()-startTime
+
+def expandStages(names):
+	stages = set()
+	for name in names:
+		if name in GROUPS:
+			stages.update(GROUPS[name])
+		elif name in STAGES:
+			stages.add(name)
+		else:
+			raise ValueError("unknown stage: "+name)
+	return stages
+
+def runPhase(stages, workers):
+	# People lists are split into chunks parsed by their own process pool, so they run one after another
+	# from this process while the other list files are parsed in the stage pool.
+	pooled = []
+	if workers > 1 and len(stages) > 1:
+		pooled = [stage for stage in stages if stage not in GROUPS["people"]]
+	inline = [stage for stage in stages if stage not in pooled]
+
+	results = []
+	if len(pooled) > 0:
+		# spawn, so that no worker inherits the MongoClient of the parent process
+		pool = multiprocessing.get_context("spawn").Pool(min(workers, len(pooled)))
+		results = [(stage, pool.apply_async(runStage, (stage,))) for stage in pooled]
+		pool.close()
+
+	failed = []
+	for stage in inline:
+		try:
+			stage, runtime = runStage(stage, workers)
+			print("[*] Stage", stage, "complete (%0.2fs)" % runtime)
+		except Exception as e:
+			print("[!] Stage", stage, "failed:", repr(e))
+			failed.append(stage)
+	for stage, result in results:
+		try:
+			stage, runtime = result.get()
+			print("[*] Stage", stage, "complete (%0.2fs)" % runtime)
+		except Exception as e:
+			print("[!] Stage", stage, "failed:", repr(e))
+			failed.append(stage)
+	if len(pooled) > 0:
+		pool.join()
+	return failed
+
+def run(names=None, workers=4, restart=False):
+	selected = set(STAGES.keys()) if not names else expandStages(names)
+
+	mongo = DataService.Mongo("imdb")
+	mongo.db[collectionName].create_index("imdbtitle", unique=True)
+	mongo.db["keywords"].create_index("keyword", unique=True)
+
+	startTime = time.time()
+	for phase in PHASES:
+		stages = []
+		for stage in phase:
+			if stage not in selected:
+				continue
+			checkpoint = imdbUtil.Checkpoint(stage)
+			if restart:
+				checkpoint.clear()
+			elif checkpoint.done:
+				print("[*] Stage", stage, "already complete, skipping. (use --restart to parse it again)")
+				continue
+			stages.append(stage)
+		if len(stages) == 0:
+			continue
+
+		stages.sort(key=lambda stage: STAGES[stage][3], reverse=True)
+		print("=== Running stages:", ", ".join(stages), "===")
+		failed = runPhase(stages, workers)
+		if len(failed) > 0:
+			# later phases depend on this one
+			print("[!] Stopping, failed stages:", ", ".join(failed), "(run again to resume them)")
+			return False
+
+	print("[*] IMDB Parse Complete (%0.2fs)" % (time.time()-startTime))
+	return True
+
+def main():
+	parser = argparse.ArgumentParser(description="Parse the IMDB list files into the imdb database.")
+	parser.add_argument("stages", nargs="*", help="stages or groups to run (default: all)")
+	parser.add_argument("-w", "--workers", type=int, default=4, help="number of list files (and of people list chunks) parsed at the same time (default: 4)")
+	parser.add_argument("--restart", action="store_true", help="ignore checkpoints and parse the selected stages from the start")
+	parser.add_argument("--list", action="store_true", help="list the stages and groups, then exit")
+	args = parser.parse_args()
+
+	if args.list:
+		for phase in PHASES:
+			print(" ".join(phase))
+		for group in GROUPS:
+			print(group+":", " ".join(GROUPS[group]))
+		return
+	for name in args.stages:
+		if name not in STAGES and name not in GROUPS:
+			parser.error("unknown stage: "+name+" (see --list)")
+
+	if not run(args.stages, args.workers, args.restart):
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
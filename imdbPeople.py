@@ -1,4 +1,6 @@
+import DataService
 import imdbUtil
+import multiprocessing
 import time
 import csv
 
@@ -6,74 +8,163 @@ import csv
 # 		field: The field in the database to add entries to (ie: cast, crew)
 #		listfile: The IMDB list to parse (actors.list, directors.list, etc)
 #		progressTotal: approximate number of lines in the file (for progress reporting)
+#		checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
+#		workers: number of processes parsing the file
+#
+# The list of people is split into chunks of ~chunkSize bytes, cut on the blank lines that end each person's block.
+# Every chunk is parsed by a worker process, which collects the people of each title and sends one
+# $addToSet/$each update per title, instead of one update per (person, title) pair.
+# A checkpoint records the chunks that were written, a resumed parse only parses the others.
 
-def parse(mongo, collectionName, field, listfile, progressTotal):
-	progressInterval = 250000 # How often should we print a progress report to the console?  
-	if progressTotal > 10000000:
-		progressInterval = 500000
+chunkSize = 32*1024*1024 # Bytes of the list file per chunk.
+workerMongo = None		 # Database connection of the current worker process.
+
+def parse(mongo, collectionName, field, listfile, progressTotal, checkpoint=None, workers=4):
+	path = "imdbdata/"+listfile
 	count = 0
 	updateCount = 0
+	peopleCount = 0
 
-	bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
-	bulkSize = 5000 		  # How many queries should we store in memory before sending them to the database in bulk?
-	bulkCount = 0
+	print("=== Starting Parse of "+listfile+" ===")
+	startTime = time.time()
+	chunks = findChunks(path, chunkSize)
+	if checkpoint is not None and len(checkpoint.chunks) > 0:
+		chunks = [chunk for chunk in chunks if chunk[0] not in checkpoint.chunks]
+		print("Resuming,", str(len(chunks)), "chunks left to parse.")
+	tasks = [(collectionName, field, path, start, end) for start, end in chunks]
+
+	if workers <= 1:
+		results = (parseChunk(task, mongo) for task in tasks)
+	else:
+		# spawn, so that no worker inherits the MongoClient of the parent process
+		pool = multiprocessing.get_context("spawn").Pool(workers, initializer=initWorker)
+		results = pool.imap_unordered(parseChunk, tasks)
+
+	chunkCount = 0
+	for start, lineCount, chunkPeople, chunkUpdates in results:
+		count += lineCount
+		peopleCount += chunkPeople
+		updateCount += chunkUpdates
+		chunkCount += 1
+		if checkpoint is not None:
+			checkpoint.finishChunk(start)
+		print(str(count), "lines processed so far. ("+str(int((count/progressTotal)*100))+"%%) (%d/%d chunks) (%0.2fs)" % (chunkCount, len(tasks), time.time()-startTime))
 
+	if workers > 1:
+		pool.close()
+		pool.join()
+
+	print("[*] Parse Complete (%0.2fs)" % (time.time()-startTime))
+	print("[*] Attemped updating", str(updateCount), "movies with information about", str(peopleCount), "people.")
+
+# Splits the list of people into (start, end) byte ranges, each starting at the beginning of a person's block.
+def findChunks(path, chunkSize):
 	#Conditions that must be found in the file before names will start being parsed
 	startFlag = False
-	startFlag2 = False
+	with imdbUtil.ListFile(path) as f:
+		for line in f:
+			value = line.split("\t")[0].strip()
+			if value[:4] == "Name":
+				startFlag = True
+			elif value[:4] == "----" and startFlag:
+				break
+		dataStart = f.offset
+
+	dataEnd = findEnd(path, dataStart)
+	chunks = []
+	start = dataStart
+	with open(path, "rb") as f:
+		while start < dataEnd:
+			f.seek(start+chunkSize)
+			f.readline() # We most likely landed in the middle of a line
+			line = f.readline()
+			while line and line.strip() != b"":
+				line = f.readline()
+			end = min(f.tell(), dataEnd)
+			chunks.append((start, end))
+			start = end
+	return chunks
+
+# Byte offset of the "-----------------" line that ends the list of people (or of the end of the file).
+def findEnd(path, start):
+	marker = b"\n-----------------"
+	offset = start
+	tail = b""
+	with open(path, "rb") as f:
+		f.seek(start)
+		while True:
+			block = f.read(chunkSize)
+			if not block:
+				return offset
+			data = tail+block
+			pos = data.find(marker)
+			if pos >= 0:
+				return offset-len(tail)+pos+1
+			tail = data[-len(marker):]
+			offset += len(block)
+
+def initWorker():
+	global workerMongo
+	workerMongo = DataService.Mongo("imdb")
+
+# Parses one chunk of people and updates every title found in it. Returns (start, lines, people, title updates).
+def parseChunk(task, mongo=None):
+	collectionName, field, path, start, end = task
+	if mongo is None:
+		mongo = workerMongo
+	count = 0
+	peopleCount = 0
+	titles = {}		  # Formatted title -> {name: None}, keeps the order people were found in
+	formatted = {}	  # Raw title -> formatted title, most titles appear many times
 	endFlag = False
 
-	print("=== Starting Parse of "+listfile+" ===")
-	startTime = time.time()
-	with open("imdbdata/"+listfile, encoding="latin1") as tsv:
+	with imdbUtil.ListFile(path, start, end) as tsv:
 		name = -1
-		for line in csv.reader(tsv, delimiter="\t"):			
+		for line in csv.reader(tsv, delimiter="\t"):
 			foundOnLine = False #Did we find any content on this line? Lines with no content reset and set-up for the next name.
 			count += 1
-			if count % progressInterval == 0:
-				print(str(count), "lines processed so far. ("+str(int((count/progressTotal)*100))+"%%) (%0.2fs)" % (time.time()-startTime))
 
 			for value in line:
-				if endFlag:
-					break
-				if value.strip()[:4] == "Name":
-					startFlag = True
-					break
-				if value.strip()[:4] == "----" and startFlag:
-					startFlag2 = True
-					break
-				if not startFlag or not startFlag2:
-					break
-				if "-----------------" in value and startFlag and startFlag2:
+				if "-----------------" in value:
 					endFlag = True
 					break
-
 				if value == "":
 					continue
-				else:
-					foundOnLine = True
-					if name == -1:
-						name = imdbUtil.formatName(value)
-						updateCount += 1
-
-					# Skipping logging people for TV episodes, because there's no easy way to tell if a person is a "main character", and I don't want to be logging
-					# every single minor/cameo person who appeared in some single episode of some series. Plus, we're more concered about movies, not TV shows.
-					elif not imdbUtil.isEpisode(value): 
-						bulkPayload.find( {"imdbtitle":imdbUtil.formatTitle(value)} ).update( {
-							"$addToSet": { field: name }
-						} )
-						bulkCount += 1
+				foundOnLine = True
+				if name == -1:
+					name = imdbUtil.formatName(value)
+					peopleCount += 1
+
+				# Skipping logging people for TV episodes, because there's no easy way to tell if a person is a "main character", and I don't want to be logging
+				# every single minor/cameo person who appeared in some single episode of some series. Plus, we're more concered about movies, not TV shows.
+				elif not imdbUtil.isEpisode(value):
+					if value not in formatted:
+						formatted[value] = imdbUtil.formatTitle(value)
+					title = formatted[value]
+					if title not in titles:
+						titles[title] = {}
+					titles[title][name] = None
 
+			if endFlag:
+				break
 			if not foundOnLine:
 				name = -1
 
-			if bulkCount >= bulkSize:
-				bulkPayload.execute()
-				bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
-				bulkCount = 0
+	bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
+	bulkSize = 5000 		  # How many queries should we store in memory before sending them to the database in bulk?
+	bulkCount = 0
+	for title in titles:
+		bulkPayload.find( {"imdbtitle":title} ).update( {
+			"$addToSet": { field: {"$each": list(titles[title])} }
+		} )
+		bulkCount += 1
+
+		if bulkCount >= bulkSize:
+			bulkPayload.execute()
+			bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
+			bulkCount = 0
 
 	if bulkCount > 0:
 		bulkPayload.execute()
 
-	print("[*] Parse Complete (%0.2fs)" % (time.time()-startTime))
-	print("[*] Attemped updating movies with information about", str(updateCount), "people.")
+	return start, count, peopleCount, len(titles)
@@ -1,12 +1,18 @@
 from DataService import Mongo
 import pymongo
 import time
+from movieIds import MovieIds
 
 # build people to movies index from imdb database
+# movies are stored as integration movie ids (see movieIds.py)
 # runtime: 3-5 minutes
 
-def build(mongo):
+def build(mongo, movie_ids=None):
     db_imdb = mongo.client["imdb"]
+    db_integration = mongo.client["integration"]
+    if movie_ids is None:
+        MovieIds.create_indexes(db_integration)
+        movie_ids = MovieIds(db_integration)
 
     progressInterval = 1000
     progressTotal = 1251126
@@ -25,22 +31,22 @@ def build(mongo):
         # skip the tv shows
         if "tv" in cur_movie:
             continue
-        cur_title_imdb = cur_movie["imdbtitle"]
+        cur_movie_id = movie_ids.get_id(cur_movie["imdbtitle"])
         if "crew" in cur_movie:
             for people in cur_movie["crew"]:
                 if people not in peoples_dict.keys():
-                    peoples_dict[people] = [cur_title_imdb]
+                    peoples_dict[people] = [cur_movie_id]
                 else:
-                    peoples_dict[people].append(cur_title_imdb)
+                    peoples_dict[people].append(cur_movie_id)
         if "cast" in cur_movie:
             for people in cur_movie["cast"]:
                 if people not in peoples_dict.keys():
-                    peoples_dict[people] = [cur_title_imdb]
+                    peoples_dict[people] = [cur_movie_id]
                 else:
-                    peoples_dict[people].append(cur_title_imdb)
+                    peoples_dict[people].append(cur_movie_id)
 
     # store people to movies index into integration database
-    db_integration = mongo.client["integration"]
+    movie_ids.save()
     bulkSize = 2000
     bulkPayload = pymongo.bulk.BulkOperationBuilder(db_integration["peoples"], ordered = False)
     skipCount = 0
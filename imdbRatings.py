@@ -5,8 +5,10 @@ import re
 # Parsing of IMDB mpaa-ratings-reasons.list file.
 # Adds fields to movie database:
 #		-Age Rating (rating)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 50000  # How often should we print a progress report to the console?
 	progressTotal = 71000     # Approximate number of total lines in the file.	  
 	count = 0
@@ -18,7 +20,7 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of mpaa-ratings-reasons.list ===")
 	startTime = time.time()
-	f = open("imdbdata/mpaa-ratings-reasons.list", encoding="latin1")
+	f = imdbUtil.ListFile("imdbdata/mpaa-ratings-reasons.list", imdbUtil.startOffset(checkpoint))
 	title = -1
 	rating = -1
 
@@ -46,6 +48,8 @@ def parse(mongo, collectionName):
 				bulkPayload.execute()
 				bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 				bulkCount = 0
+				if checkpoint is not None:
+					checkpoint.save(f.offset)
 	f.close()
 
 	if bulkCount > 0:
@@ -4,8 +4,10 @@ import time
 # Parsing of IMDB movie-links.list file.
 # Adds fields to movie database:
 #		-Related Films (related)
+#
+# checkpoint: optional imdbUtil.Checkpoint to save progress to and resume from
 
-def parse(mongo, collectionName):
+def parse(mongo, collectionName, checkpoint=None):
 	progressInterval = 100000 # How often should we print a progress report to the console?
 	progressTotal = 2700000   # Approximate number of total lines in the file.	  
 	count = 0
@@ -20,8 +22,9 @@ def parse(mongo, collectionName):
 
 	print("=== Starting Parse of movie-links.list ===")
 	startTime = time.time()
-	f = open("imdbdata/movie-links.list", encoding="latin1")
+	f = imdbUtil.ListFile("imdbdata/movie-links.list", imdbUtil.startOffset(checkpoint))
 	title = -1
+	titleOffset = f.offset # Byte offset of the first line of the current movie
 	links = []
 	nextReady = True #are we finished with the current movie's information and ready to move onto the next?
 
@@ -44,6 +47,7 @@ def parse(mongo, collectionName):
 				updateCount += 1
 			links = []
 			nextReady = True
+			titleOffset = f.offset
 
 		for relation in relations:
 			if relation in line:
@@ -55,6 +59,8 @@ def parse(mongo, collectionName):
 			bulkPayload.execute()
 			bulkPayload = mongo.db[collectionName].initialize_unordered_bulk_op()
 			bulkCount = 0
+			if checkpoint is not None:
+				checkpoint.save(titleOffset) # every movie before the current one is in the database
 	f.close()
 
 	if bulkCount > 0:
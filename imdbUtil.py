@@ -1,4 +1,7 @@
 from datetime import date
+import json
+import csv
+import os
 import re
 
 #Cases:
@@ -52,4 +55,102 @@ def formatName(name):
 		trimmedName = name[:name.index("(")-1]
 	if "," in trimmedName:
 		return trimmedName[trimmedName.index(",")+2:]+" "+trimmedName[:trimmedName.index(",")]
-	return formatTitle(trimmedName)
\ No newline at end of file
+	return formatTitle(trimmedName)
+
+#Line iterator over an IMDB list file that keeps track of byte offsets, so that a parse can be stopped and resumed.
+#	offset: byte offset of the end of the last line read
+#	lineOffset: byte offset of the start of the last line read
+#	end: optional byte offset to stop at (must be the start of a line), to read one chunk of the file
+class ListFile(object):
+	def __init__(self, path, offset=0, end=None):
+		self.f = open(path, "rb")
+		self.f.seek(offset)
+		self.offset = offset
+		self.lineOffset = offset
+		self.end = end
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		if self.end is not None and self.offset >= self.end:
+			raise StopIteration
+		line = self.f.readline()
+		if not line:
+			raise StopIteration
+		self.lineOffset = self.offset
+		self.offset += len(line)
+		return line.decode("latin1")
+
+	def close(self):
+		self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+#TSV rows of a ListFile as (byte offset of the start of the row, row) pairs. A quoted value can span several lines, so the start
+#of a row is the end of the previous one rather than the start of its last line.
+def readRows(listFile):
+	rowOffset = listFile.offset
+	for row in csv.reader(listFile, delimiter="\t"):
+		yield rowOffset, row
+		rowOffset = listFile.offset
+
+#Progress of one parse stage, stored in imdbdata/checkpoints/<stage>.json:
+#	offset: byte offset in the list file from which the parse can safely be restarted (start of a record whose updates were not all sent yet)
+#	chunks: start offsets of the chunks already written, for stages that parse their file in independent chunks
+#	done: the whole stage completed
+#Parsers save a checkpoint right after each successful bulk write. All their writes are $set/$addToSet updates or inserts on a unique index,
+#so records between the checkpoint and a crash are simply written again on resume.
+class Checkpoint(object):
+	directory = "imdbdata/checkpoints"
+
+	def __init__(self, stage):
+		self.stage = stage
+		self.path = os.path.join(Checkpoint.directory, stage+".json")
+		self.offset = 0
+		self.chunks = []
+		self.done = False
+		if os.path.isfile(self.path):
+			with open(self.path) as f:
+				state = json.load(f)
+			self.offset = state["offset"]
+			self.chunks = state.get("chunks", [])
+			self.done = state["done"]
+
+	def save(self, offset):
+		self.offset = offset
+		self.__write()
+
+	def finishChunk(self, start):
+		self.chunks.append(start)
+		self.__write()
+
+	def finish(self):
+		self.done = True
+		self.__write()
+
+	def clear(self):
+		self.offset = 0
+		self.chunks = []
+		self.done = False
+		if os.path.isfile(self.path):
+			os.remove(self.path)
+
+	def __write(self):
+		if not os.path.isdir(Checkpoint.directory):
+			os.makedirs(Checkpoint.directory)
+		with open(self.path+".tmp", "w") as f:
+			json.dump({"stage":self.stage, "offset":self.offset, "chunks":self.chunks, "done":self.done}, f)
+		os.replace(self.path+".tmp", self.path)
+
+#Byte offset a parse should start from (0 without a checkpoint)
+def startOffset(checkpoint):
+	if checkpoint is None:
+		return 0
+	if checkpoint.offset > 0:
+		print("Resuming from byte", str(checkpoint.offset), "of the list file.")
+	return checkpoint.offset
@@ -0,0 +1,389 @@
+from DataService import Mongo
+import os
+import time
+import array
+import pickle
+import numpy
+import topK
+import recommendCache
+import tagRelevance
+from movieIds import MovieIds
+
+# Resident inverted indexes for the tag-based recommenders.
+# Indexes (index name: field name: db.collection -> term field, postings):
+#       -integration:   tags:       integration.normalized_tags -> tag, movies/scores
+#                       peoples:    integration.peoples -> people, movies (every posting weighs 1)
+#       -genome:        tags:       movieRecommend.tag -> tid (or content), relevant movies/relevance
+# Integration postings are the movie ids of integration.movie_ids (see movieIds.py), genome postings
+# are MovieLens movie ids. Each field is stored CSR-style, the postings of a term sorted by movie id
+# (repeated movies merged by summing their weights):
+#       -<index>_<field>_ptr.npy         term -> [start, end) offsets into postings (int64)
+#       -<index>_<field>_postings.npy    movie ids (int32)
+#       -<index>_<field>_weights.npy     posting weights (float32)
+#       -<index>_<field>_impact.npy      offsets of every term's postings by descending weight (int32)
+#       -<index>_<field>_max.npy         term -> highest weight of its postings (float32)
+#       -<index>_<field>_popularity.npy  term -> popularity (int32)
+#       -<index>_strings.pickle          movie id -> title, and the terms of every field
+# A query is a list of (field, term, weight).
+# search() is a MaxScore evaluation: the exact scores of the highest-impact postings of every term
+# give a lower bound of the k-th best score, the terms whose bounds (weight * max) add up to less than
+# it cannot bring a movie into the top-k on their own, so their postings are only looked up (binary
+# search) for the movies of the other terms, never read in full. Broad terms have a low tf-idf weight,
+# so the longest posting lists are the ones skipped.
+# score() is the exhaustive evaluation: one scatter-add (bincount) of all the postings of all the terms.
+
+INDEX_DIR = "indexdata"
+SEED_DEPTH = 64         # Highest-impact postings of every term scored to find the first top-k bound.
+MIN_POSTINGS = 200000   # Smaller queries are cheaper to score exhaustively.
+
+INDEXES = {
+    "integration": {
+        "tags": ("integration", "normalized_tags", "tag", "scores"),
+        "peoples": ("integration", "peoples", "people", None)
+        },
+    "genome": {
+        "tags": ("movieRecommend", "tag", "tid", None)
+        }
+    }
+
+def index_path(name, index_dir=INDEX_DIR, ext=".npy"):
+    return os.path.join(index_dir, name + ext)
+
+# read the postings of one integration field
+def collect_integration_field(mongo, field):
+    db_name, collection, term_field, scores_field = INDEXES["integration"][field]
+    progressInterval = 200000 # How often should we print a progress report to the console?
+    count = 0
+    startTime = time.time()
+
+    terms = []
+    popularity = array.array("i")
+    lengths = array.array("q")
+    postings = array.array("i")
+    weights = array.array("f")
+    projection = {term_field: 1, "movies": 1, "popularity": 1}
+    if scores_field is not None:
+        projection[scores_field] = 1
+    cursor = mongo.client[db_name][collection].find({"movies": {"$exists": True}}, projection, no_cursor_timeout=True)
+    for cur_doc in cursor:
+        count += 1
+        if count % progressInterval == 0:
+            print("[invertedIndex] %7d %s processed so far. (%0.2fs)" % (count, field, time.time() - startTime))
+
+        postings.extend(cur_doc["movies"])
+        if scores_field is not None:
+            weights.extend(cur_doc[scores_field])
+        else:
+            weights.extend([1.0] * len(cur_doc["movies"]))
+        terms.append(cur_doc[term_field])
+        popularity.append(cur_doc.get("popularity", len(cur_doc["movies"])))
+        lengths.append(len(cur_doc["movies"]))
+    cursor.close()
+
+    print("[invertedIndex] Collected %d %s, %d postings (%0.2fs)" % (len(terms), field, len(postings), time.time() - startTime))
+    return terms, None, popularity, lengths, postings, weights
+
+# read the relevant movies of every genome tag, tags can be looked up by tid or by content
+def collect_genome_tags(mongo):
+    db_name, collection, term_field, scores_field = INDEXES["genome"]["tags"]
+    startTime = time.time()
+
+    terms = []
+    aliases = []
+    popularity = array.array("i")
+    lengths = array.array("q")
+    postings = []
+    weights = []
+    cursor = mongo.client[db_name][collection].find({})
+    for cur_doc in cursor:
+        cur_mids, cur_scores = tagRelevance.get_relevant_movies(cur_doc)
+        postings.append(cur_mids.astype(numpy.int32))
+        weights.append(cur_scores.astype(numpy.float32))
+        terms.append(cur_doc[term_field])
+        aliases.append(cur_doc["content"])
+        popularity.append(cur_doc.get("popular", len(cur_mids)))
+        lengths.append(len(cur_mids))
+    cursor.close()
+
+    postings = numpy.concatenate(postings) if len(postings) > 0 else numpy.empty(0, dtype=numpy.int32)
+    weights = numpy.concatenate(weights) if len(weights) > 0 else numpy.empty(0, dtype=numpy.float32)
+    print("[invertedIndex] Collected %d genome tags, %d postings (%0.2fs)" % (len(terms), len(postings), time.time() - startTime))
+    return terms, aliases, popularity, lengths, postings, weights
+
+# CSR arrays of one field: posting lists sorted by movie id with repeated movies merged,
+# the impact order of every list and its highest weight
+def pack_field(lengths, postings, weights):
+    ptr = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.asarray(lengths, dtype=numpy.int64), out=ptr[1:])
+    postings = numpy.asarray(postings, dtype=numpy.int32)
+    weights = numpy.asarray(weights, dtype=numpy.float32)
+    num_terms = len(lengths)
+
+    rows = numpy.repeat(numpy.arange(num_terms, dtype=numpy.int64), numpy.diff(ptr))
+    width = int(postings.max()) + 1 if len(postings) > 0 else 1
+    keys, inverse = numpy.unique(rows * width + postings, return_inverse=True)
+    weights = numpy.bincount(inverse.ravel(), weights=weights, minlength=len(keys)).astype(numpy.float32)
+    rows = keys // width
+    postings = (keys % width).astype(numpy.int32)
+    ptr = numpy.searchsorted(rows, numpy.arange(num_terms + 1)).astype(numpy.int64)
+
+    # stable, so equal weights stay in movie id order
+    order = numpy.lexsort((-weights, rows))
+    impact = (order - ptr[rows[order]]).astype(numpy.int32)
+    bounds = numpy.zeros(num_terms, dtype=numpy.float32)
+    nonempty = ptr[:-1] < ptr[1:]
+    bounds[nonempty] = weights[order[ptr[:-1][nonempty]]]
+    return ptr, postings, weights, impact, bounds
+
+def save_field(name, field, arrays, popularity, index_dir):
+    ptr, postings, weights, impact, bounds = arrays
+    prefix = name + "_" + field
+    numpy.save(index_path(prefix + "_ptr", index_dir), ptr)
+    numpy.save(index_path(prefix + "_postings", index_dir), postings)
+    numpy.save(index_path(prefix + "_weights", index_dir), weights)
+    numpy.save(index_path(prefix + "_impact", index_dir), impact)
+    numpy.save(index_path(prefix + "_max", index_dir), bounds)
+    numpy.save(index_path(prefix + "_popularity", index_dir), numpy.asarray(popularity, dtype=numpy.int32))
+
+# written last: InvertedIndex.load() checks for this file
+def save_strings(name, strings, index_dir):
+    with open(index_path(name + "_strings", index_dir, ".pickle"), "wb") as f:
+        pickle.dump(strings, f, pickle.HIGHEST_PROTOCOL)
+    recommendCache.bump_data_version()
+
+# build and store the integration index
+def build_integration(mongo, index_dir=INDEX_DIR):
+    print("[invertedIndex] Starting build of integration inverted index...")
+    startTime = time.time()
+
+    titles = MovieIds(mongo.client["integration"]).titles
+    strings = {"titles": titles, "size": len(titles), "terms": {}, "aliases": {}}
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    for field in INDEXES["integration"]:
+        terms, aliases, popularity, lengths, postings, weights = collect_integration_field(mongo, field)
+        strings["terms"][field] = terms
+        save_field("integration", field, pack_field(lengths, postings, weights), popularity, index_dir)
+    save_strings("integration", strings, index_dir)
+    print("[invertedIndex] Build Complete: %d movies (%0.2fs)" % (len(titles), time.time() - startTime))
+
+# build and store the genome tags index
+def build_genome(mongo, index_dir=INDEX_DIR):
+    print("[invertedIndex] Starting build of genome inverted index...")
+    startTime = time.time()
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    terms, aliases, popularity, lengths, postings, weights = collect_genome_tags(mongo)
+    arrays = pack_field(lengths, postings, weights)
+    save_field("genome", "tags", arrays, popularity, index_dir)
+    size = int(arrays[1].max()) + 1 if len(arrays[1]) > 0 else 0
+    save_strings("genome", {"titles": None, "size": size, "terms": {"tags": terms}, "aliases": {"tags": aliases}}, index_dir)
+    print("[invertedIndex] Build Complete: %d tags (%0.2fs)" % (len(terms), time.time() - startTime))
+
+# memory-mapped, as a plain ndarray: slicing a numpy.memmap costs more than the lookups of small lists
+def load_array(path):
+    return numpy.load(path, mmap_mode="r").view(numpy.ndarray)
+
+class InvertedIndex(object):
+
+    def __init__(self, name, index_dir=INDEX_DIR):
+        print("[invertedIndex] Loading " + name + " inverted index...")
+        startTime = time.time()
+        with open(index_path(name + "_strings", index_dir, ".pickle"), "rb") as f:
+            strings = pickle.load(f)
+        self.name = name
+        self.titles = strings["titles"]
+        self.size = strings["size"]
+        self.terms = {}
+        self.ptr = {}
+        self.postings = {}
+        self.weights = {}
+        self.impact = {}
+        self.max = {}
+        self.popularity = {}
+        for field in INDEXES[name]:
+            prefix = name + "_" + field
+            terms = strings["terms"][field]
+            self.terms[field] = dict(zip(terms, range(len(terms))))
+            if field in strings["aliases"]:
+                self.terms[field].update(zip(strings["aliases"][field], range(len(terms))))
+            self.ptr[field] = load_array(index_path(prefix + "_ptr", index_dir))
+            self.postings[field] = load_array(index_path(prefix + "_postings", index_dir))
+            self.weights[field] = load_array(index_path(prefix + "_weights", index_dir))
+            self.impact[field] = load_array(index_path(prefix + "_impact", index_dir))
+            self.max[field] = load_array(index_path(prefix + "_max", index_dir))
+            self.popularity[field] = load_array(index_path(prefix + "_popularity", index_dir))
+        print("[invertedIndex] Loaded %d movies (%0.2fs)" % (self.size, time.time() - startTime))
+
+    # None if the index was never built
+    @classmethod
+    def load(cls, name, index_dir=INDEX_DIR):
+        if not os.path.isfile(index_path(name + "_strings", index_dir, ".pickle")):
+            return None
+        return cls(name, index_dir)
+
+    def get_term(self, field, term):
+        return self.terms[field].get(term, -1)
+
+    # imdb title of a movie id (integration), or the movie id itself (genome)
+    def get_key(self, movie):
+        if self.titles is None:
+            return movie
+        return self.titles[movie]
+
+    # popularity of a term, None if the term is not indexed
+    def get_popularity(self, field, term):
+        row = self.get_term(field, term)
+        if row < 0:
+            return None
+        return int(self.popularity[field][row])
+
+    # (movie ids, weights) of one posting list
+    def get_list(self, field, row):
+        start = self.ptr[field][row]
+        end = self.ptr[field][row + 1]
+        return self.postings[field][start:end], self.weights[field][start:end]
+
+    # (movie ids, weights) of the depth highest-weighted postings of one list
+    def get_best(self, field, row, depth):
+        start = self.ptr[field][row]
+        end = self.ptr[field][row + 1]
+        best = self.impact[field][start:min(start + depth, end)]
+        return self.postings[field][start:end][best], self.weights[field][start:end][best]
+
+    # weights of the given movies in one posting list, 0 where missing
+    def lookup(self, field, row, movies):
+        ids, weights = self.get_list(field, row)
+        pos = numpy.minimum(numpy.searchsorted(ids, movies), len(ids) - 1)
+        return numpy.where(ids[pos] == movies, weights[pos], 0)
+
+    # movie id -> summed weighted score for a list of (field, term, weight), and the touched ids
+    def score(self, query):
+        ids = []
+        values = []
+        for field, term, weight in query:
+            row = self.get_term(field, term)
+            if row < 0:
+                continue
+            cur_ids, cur_weights = self.get_list(field, row)
+            ids.append(cur_ids)
+            values.append(cur_weights * weight)
+        if len(ids) == 0:
+            return numpy.zeros(0), numpy.empty(0, dtype=numpy.int64)
+        ids = numpy.concatenate(ids)
+        scores = numpy.bincount(ids, weights=numpy.concatenate(values), minlength=self.size)
+        touched = numpy.zeros(len(scores), dtype=bool)
+        touched[ids] = True
+        return scores, numpy.flatnonzero(touched)
+
+    # exhaustive top-k, same results as search()
+    def search_exhaustive(self, query, k, exclude=None):
+        scores, candidates = self.score(query)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        total = 0
+        for field, term, weight in query:
+            row = self.get_term(field, term)
+            if row >= 0:
+                total += int(self.ptr[field][row + 1] - self.ptr[field][row])
+        top = candidates[topK.top_k_array(scores[candidates], k)] if len(candidates) > 0 else candidates
+        return top, scores[top], (len(candidates), total, total)
+
+    # up to k (movie ids, scores) best first, and (candidates scored, postings read, postings in the query lists)
+    def search(self, query, k, exclude=None):
+        lists = []      # (bound, field, row, weight) of the terms that can raise a score
+        negative = []   # terms that can only lower it (tf-idf of terms in more movies than the total)
+        total = 0
+        for field, term, weight in query:
+            row = self.get_term(field, term)
+            if row < 0 or weight == 0 or self.ptr[field][row] == self.ptr[field][row + 1]:
+                continue
+            total += int(self.ptr[field][row + 1] - self.ptr[field][row])
+            if weight > 0:
+                lists.append((weight * float(self.max[field][row]), field, row, weight))
+            else:
+                negative.append((0.0, field, row, weight))
+        if len(lists) == 0 or total < MIN_POSTINGS:
+            return self.search_exhaustive(query, k, exclude)
+        lists.sort(key=lambda cur_list: cur_list[0])
+
+        # lower bound of the k-th best score: the best postings of every list add up to a lower bound
+        # of the score of each of their movies
+        seeds = []
+        values = []
+        for bound, field, row, weight in lists:
+            cur_ids, cur_weights = self.get_best(field, row, SEED_DEPTH)
+            seeds.append(cur_ids)
+            values.append(cur_weights * weight)
+        seeds, inverse = numpy.unique(numpy.concatenate(seeds), return_inverse=True)
+        seed_scores = numpy.bincount(inverse.ravel(), weights=numpy.concatenate(values), minlength=len(seeds))
+        if exclude is not None:
+            seed_scores = seed_scores[seeds != exclude]
+            seeds = seeds[seeds != exclude]
+        if len(seeds) < k:
+            return self.search_exhaustive(query, k, exclude)
+        for bound, field, row, weight in negative:
+            seed_scores += weight * self.lookup(field, row, seeds)
+        threshold = numpy.partition(seed_scores, len(seeds) - k)[len(seeds) - k]
+        if threshold < 0:
+            return self.search_exhaustive(query, k, exclude)
+
+        # the lowest bounds adding up to no more than the threshold are the non-essential lists,
+        # the highest one is always essential
+        split = 0
+        remaining = 0.0
+        while split < len(lists) - 1 and remaining + lists[split][0] <= threshold:
+            remaining += lists[split][0]
+            split += 1
+
+        # every movie of the essential lists is a candidate
+        ids = []
+        values = []
+        for bound, field, row, weight in lists[split:]:
+            cur_ids, cur_weights = self.get_list(field, row)
+            ids.append(cur_ids)
+            values.append(cur_weights * weight)
+        ids = numpy.concatenate(ids)
+        read = len(ids)
+        scores = numpy.bincount(ids, weights=numpy.concatenate(values), minlength=self.size)
+        touched = numpy.zeros(len(scores), dtype=bool)
+        touched[ids] = True
+        candidates = numpy.flatnonzero(touched)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        scores = scores[candidates]
+        scored = len(candidates)
+        # without negative terms the partial scores of the candidates are lower bounds too, and usually higher ones
+        if len(scores) >= k and len(negative) == 0:
+            threshold = max(threshold, numpy.partition(scores, len(scores) - k)[len(scores) - k])
+
+        # complete them from the non-essential lists, highest bound first, dropping the
+        # candidates that cannot reach the threshold anymore
+        for bound, field, row, weight in reversed(lists[:split]):
+            keep = scores + remaining >= threshold
+            candidates = candidates[keep]
+            scores = scores[keep]
+            scores += weight * self.lookup(field, row, candidates)
+            remaining -= bound
+        for bound, field, row, weight in negative:
+            scores += weight * self.lookup(field, row, candidates)
+
+        top = topK.top_k_array(scores, k)
+        return candidates[top], scores[top], (scored, read, total)
+
+
+def main():
+    mongo = Mongo()
+    build_integration(mongo)
+    build_genome(mongo)
+    index = InvertedIndex.load("integration")
+    query = [("tags", "zombies", 1.0), ("tags", "comedy", 0.5), ("tags", "drama", 0.1), ("peoples", "Bill Murray", 2.0)]
+    for search in (index.search_exhaustive, index.search):
+        startTime = time.time()
+        movies, scores, stats = search(query, 20)
+        print([(index.get_key(movie), score) for movie, score in zip(movies.tolist(), scores.tolist())])
+        print("[invertedIndex] %s: %d candidates, read %d of %d postings (%0.4fs)" % ((search.__name__,) + stats + (time.time() - startTime,)))
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,13 @@ import pymongo
 import time
 from imdbMovieLensTags import imdbKeywords, imdbIgnore
 import imdbPeopleIndex
+import invertedIndex
+from movieIds import MovieIds
+import tagRelevance
+from movieCatalog import MovieCatalog
+import titleJoin
 
-def collect_from_keywords(client):
+def collect_from_keywords(client, movie_ids):
     db_imdb = client["imdb"]
     db_integration = client["integration"]
 
@@ -39,13 +44,14 @@ def collect_from_keywords(client):
                 for keyword in cur_movie["keywords"]:
                     all_keywords.add(keyword)
                 if tag not in tags_to_movies:
-                    tags_to_movies[tag] = [cur_movie["imdbtitle"]]
+                    tags_to_movies[tag] = [movie_ids.get_id(cur_movie["imdbtitle"])]
                 else:
-                    tags_to_movies[tag].append(cur_movie["imdbtitle"])
+                    tags_to_movies[tag].append(movie_ids.get_id(cur_movie["imdbtitle"]))
 
     # total 129034 keywords found
     print("[keywordsCombine] Total keywords: " + str(len(all_keywords)))
 
+    movie_ids.save()
     for tag in tags_to_movies.keys():
         db_integration["keywords"].update_one({"keyword": tag}, {"$set": {
             "relevant_movie": tags_to_movies[tag],
@@ -54,7 +60,7 @@ def collect_from_keywords(client):
 
     print("[keywordsCombine] Complete (%0.2fs)" % (time.time() - startTime))
 
-def collect_from_tags(client):
+def collect_from_tags(client, movie_ids):
     # store all original tags into integrated database
     db_recommend = client["movieRecommend"]
     db_integration = client["integration"]
@@ -66,6 +72,7 @@ def collect_from_tags(client):
     print("[keywordsCombine] Starting collection of tags...")
     startTime = time.time()
 
+    catalog = MovieCatalog(db_recommend)
     cursor = db_recommend["tag"].find({})
     for cur_tag in cursor:
         count += 1
@@ -75,24 +82,23 @@ def collect_from_tags(client):
         cur_content = cur_tag["content"]
         movies_list = []
         scores_list = []
-        if "relevant_movie" not in cur_tag:
+        if not tagRelevance.has_relevant_movies(cur_tag):
             continue
-        for relevance_pair in cur_tag["relevant_movie"]:
-            attrs = relevance_pair.split(",")
-            mid = int(attrs[0])
-            score = float(attrs[1])
+        cur_mids, cur_scores = tagRelevance.get_relevant_movies(cur_tag)
+        for mid, score in zip(cur_mids.tolist(), cur_scores.tolist()):
             # get the full imdb title
-            relevant_movie = db_recommend["movie"].find_one({"mid": mid})
+            relevant_movie = catalog.get_movie(mid)
             # some mids might not exist in movieLens database
             if relevant_movie is None:
                 continue
             # skip the movies with none-movie type or doesn't have full imdb title
-            if "title_full" not in relevant_movie or relevant_movie["type"] != "movie":
+            if relevant_movie["title_full"] is None or relevant_movie["type"] != "movie":
                 continue
             title = relevant_movie["title_full"]
-            movies_list.append(title)
+            movies_list.append(movie_ids.get_id(title))
             scores_list.append(score)
 
+        movie_ids.save()
         db_integration["tags"].update_one({"tag": cur_content}, {"$set": {
             "movies": movies_list,
             "scores": scores_list
@@ -291,19 +297,29 @@ def reconstruct_tags(client):
 
     print("[keywordsCombine] Complete (%0.2fs)" % (time.time() - startTime))
 
-def copy_movies(client):
+def copy_movies(client, movie_ids):
     print("[keywordsCombine] Starting copy out all valid movies...")
     startTime = time.time()
 
     db_movieRecommend = client["movieRecommend"]
     db_integration = client["integration"]
-    cursor = db_movieRecommend["movie"].find({})
-    for cur_movie in cursor:
-        if "title_full" not in cur_movie:
+    all_docs = []
+    movies = list(db_movieRecommend["movie"].find({}, {"_id": 0, "mid": 1, "title_imdb": 1, "title_full": 1, "year": 1}))
+    # movies retrieved after movieLensFullTitle.py ran are matched by the same title join, one pass over imdb
+    missing = [cur_movie for cur_movie in movies if "title_full" not in cur_movie]
+    matches = titleJoin.match_imdb(client["imdb"], missing, fuzzy=False)[0] if len(missing) > 0 else {}
+    for cur_movie in movies:
+        title_full = cur_movie.get("title_full", matches.get(cur_movie["mid"]))
+        if title_full is None or "title_imdb" not in cur_movie:
             continue
         cur_doc = {}
-        cur_doc["imdbtitle"] = cur_movie["title_full"]
+        cur_doc["imdbtitle"] = title_full
         cur_doc["title"] = cur_movie["title_imdb"]
+        cur_doc["id"] = movie_ids.get_id(title_full)
+        all_docs.append(cur_doc)
+
+    movie_ids.save()
+    for cur_doc in all_docs:
         db_integration["copy_movies"].insert(cur_doc)
 
     print("[keywordsCombine] Complete (%0.2fs)" % (time.time() - startTime))
@@ -316,9 +332,13 @@ def main():
     db_imdb["movies"].create_index([("keywords", pymongo.ASCENDING)])
     print("[keywordsCombine] Created index for keywords in movies")
 
-    collect_from_keywords(mongo.client) # 34 seconds
+    # every movie list of the integration database holds movie ids (see movieIds.py)
+    MovieIds.create_indexes(mongo.client["integration"])
+    movie_ids = MovieIds(mongo.client["integration"])
+
+    collect_from_keywords(mongo.client, movie_ids) # 34 seconds
 
-    collect_from_tags(mongo.client) # 5 minutes
+    collect_from_tags(mongo.client, movie_ids) # 5 minutes
 
     combine(mongo.client) # 8 seconds
     db_integration = mongo.client["integration"]
@@ -328,7 +348,7 @@ def main():
     # not used due to inaccurate
     # # fix_popularity(mongo.client) # 3 seconds
 
-    imdbPeopleIndex.build(mongo) # 3 minutes
+    imdbPeopleIndex.build(mongo, movie_ids) # 3 minutes
 
     store_people_name_only(mongo.client) # 36 seconds
 
@@ -339,10 +359,12 @@ def main():
 
     count_movies_with_tags(mongo.client) # 3 seconds
 
-    copy_movies(mongo.client) # 15 seconds
+    copy_movies(mongo.client, movie_ids) # 15 seconds
     db_integration = mongo.client["integration"]
     db_integration["copy_movies"].create_index([("imdbtitle", pymongo.ASCENDING)])
     print("[keywordsCombine] Created index for imdbtitle in copy_movies")
 
+    invertedIndex.build_integration(mongo) # resident index for the integrated recommenders
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -10,6 +10,7 @@ from PIL import Image, ImageTk
 from functools import partial
 from tkinter import filedialog
 from movieRecommend import MovieRecommend
+from recommendCache import RecommendCache
 
 BGCOLOR = 'white'
 TWICOLOR = '#4099FF'
@@ -28,6 +29,7 @@ class MovieApp:
 
 	def __init__(self, root):
 		self.mongo = DataService.Mongo("imdb")
+		RecommendCache.enable_disk() # recommendations of earlier sessions are reused until the data is rebuilt
 		self.mainframe = tk.Frame(root)
 		self.root = root
 		self.lastRecommend = [] # Last set of recommended titles, used for restoring the recommendation screen
@@ -35,6 +37,8 @@ class MovieApp:
 		self.historyList = [0,0]
 		self.historyList[MOVIE_MODE] = set()
 		self.historyList[TAG_MODE] = set()
+		self.historyNeighbours = None # Similar users of the movie history, updated on every edit once built
+		self.pendingNeighbours = None # Neighbours built by the startup thread, installed by update()
 		self.historyVar = tk.StringVar(value=tuple(self.historyList[self.searchMode]))
 		self.searchResults = set()
 		self.searchVar = tk.StringVar(value=tuple(self.searchResults))
@@ -44,6 +48,11 @@ class MovieApp:
 		self.backFunction = self.username_screen
 		self.username_screen()
 
+		# Loading the ratings matrix can scan all of user_rate, so it never runs in a UI callback
+		thr = threading.Thread(target=self.build_history_neighbours)
+		thr.daemon = True
+		thr.start()
+
 	def process_twitter_recommendation(self, usernameWidget):
 		username = usernameWidget.get()
 		print(username)
@@ -61,7 +70,7 @@ class MovieApp:
 
 		recommendations = []
 		recommender = MovieRecommend(self.mongo)
-		all_recommendations = recommender.recommend_movies_based_on_history(self.historyList[MOVIE_MODE])
+		all_recommendations = recommender.recommend_movies_based_on_history(self.historyList[MOVIE_MODE], self.historyNeighbours)
 		all_recommendations = recommender.get_titles_by_mids(all_recommendations)
 		total = min(5, len(all_recommendations))
 		for i in range(total):
@@ -309,15 +318,39 @@ class MovieApp:
 
 	def add_to_history(self):
 		selectedMovies = self.searchList.curselection()
+		added = []
 		for selectionIndex in selectedMovies:
-			self.historyList[self.searchMode].add(self.searchList.get(selectionIndex))
+			added.append(self.searchList.get(selectionIndex))
+			self.historyList[self.searchMode].add(added[-1])
 		self.historyVar.set(tuple(self.historyList[self.searchMode]))
+		self.update_history_neighbours(added=added)
 
 	def delete_from_history(self, event):
 		selectedMovies = self.historyBox.curselection()
+		removed = []
 		for selectionIndex in selectedMovies:
-			self.historyList[self.searchMode].remove(self.historyBox.get(selectionIndex))
+			removed.append(self.historyBox.get(selectionIndex))
+			self.historyList[self.searchMode].remove(removed[-1])
 		self.historyVar.set(tuple(self.historyList[self.searchMode]))
+		self.update_history_neighbours(removed=removed)
+
+	# Only the users who liked an added or removed movie are rescored, instead of the whole history.
+	# Edits made before the neighbours are built are picked up by install_history_neighbours().
+	def update_history_neighbours(self, added=(), removed=()):
+		if self.searchMode != MOVIE_MODE or self.historyNeighbours is None:
+			return
+		MovieRecommend(self.mongo).update_history_neighbours(self.historyNeighbours, added, removed)
+
+	# Runs in a background thread at startup: empty neighbours over the whole ratings matrix
+	def build_history_neighbours(self):
+		self.pendingNeighbours = MovieRecommend(self.mongo).get_history_neighbours()
+
+	# Runs on the UI thread: the movie history of the user so far is applied as one delta
+	def install_history_neighbours(self):
+		neighbours = self.pendingNeighbours
+		self.pendingNeighbours = None
+		MovieRecommend(self.mongo).update_history_neighbours(neighbours, added=list(self.historyList[MOVIE_MODE]))
+		self.historyNeighbours = neighbours
 
 	def save_history(self):
 		f = filedialog.asksaveasfile(mode='w', filetypes=[self.get_filetype()], defaultextension=self.get_filetype()[1])
@@ -331,11 +364,14 @@ class MovieApp:
 		f = filedialog.askopenfile(mode='r', filetypes=[self.get_filetype()], defaultextension=self.get_filetype()[1])
 		if f is None:
 			return
+		oldHistory = set(self.historyList[self.searchMode])
 		self.historyList[self.searchMode].clear()
 		for line in f:
 			self.historyList[self.searchMode].add(line)
 		self.historyVar.set(tuple(self.historyList[self.searchMode]))
 		f.close()
+		newHistory = self.historyList[self.searchMode]
+		self.update_history_neighbours(added=list(newHistory - oldHistory), removed=list(oldHistory - newHistory))
 
 	def get_filetype(self):
 		if self.searchMode == MOVIE_MODE:
@@ -406,6 +442,9 @@ class MovieApp:
 
 	# Main update loop for timing and such
 	def update(self):
+		if self.pendingNeighbours is not None:
+			self.install_history_neighbours()
+
 		# Handle auto-complete for the search form
 		if self.searchBar != None:
 			if self.searchBar.get() == self.lastSearchContent:
@@ -0,0 +1,154 @@
+from DataService import Mongo
+import time
+import numpy
+
+# Resident id -> title lookup for all MovieLens movies.
+# db name: movieRecommend
+# collection name: movie
+# Loads mid, imdbid, title, title_full and type of every movie once into compact arrays,
+# so that a recommendation screen resolves all its ids without a round trip per movie.
+# Ids missing from the catalog (movies added after loading) are fetched with one bulk $in query.
+# Full titles missing from the catalog are looked up the same way: a movie loaded before its title_full
+# was filled in (movieLensFullTitle.py) gets it then, and titles found in no movie are remembered as
+# unknown until the catalog is reloaded, so they cost a single query.
+
+class MovieCatalog(object):
+
+    def __init__(self, db):
+        self.db = db
+        self.load()
+
+    def load(self):
+        print("[MovieCatalog] Loading movie catalog...")
+        startTime = time.time()
+
+        mids = []
+        imdbids = []
+        self.titles = []
+        self.titles_full = []
+        self.types = []
+        cursor = self.db["movie"].find({}, {"mid": 1, "imdbid": 1, "title": 1, "title_full": 1, "type": 1})
+        for cur_movie in cursor:
+            mids.append(cur_movie["mid"])
+            imdbids.append(cur_movie.get("imdbid", 0))
+            self.titles.append(cur_movie.get("title"))
+            self.titles_full.append(cur_movie.get("title_full"))
+            self.types.append(cur_movie.get("type"))
+        self.mids = numpy.asarray(mids, dtype=numpy.int32)
+        self.imdbids = numpy.asarray(imdbids, dtype=numpy.int32)
+
+        # direct mid -> row table, -1 for unknown mids
+        self.rows = numpy.full(int(self.mids.max()) + 1 if len(mids) > 0 else 1, -1, dtype=numpy.int32)
+        self.rows[self.mids] = numpy.arange(len(mids), dtype=numpy.int32)
+        self.mids_by_title = {}
+        self.unknown_titles = set()
+        for row in range(len(mids)):
+            if self.titles_full[row] is not None:
+                self.mids_by_title[self.titles_full[row]] = mids[row]
+
+        print("[MovieCatalog] Loaded %d movies (%0.2fs)" % (len(mids), time.time() - startTime))
+
+    def get_row(self, mid):
+        if 0 <= mid < len(self.rows):
+            return int(self.rows[mid])
+        return -1
+
+    # append movies that are not in the catalog yet, in one query
+    def fetch_missing(self, mids):
+        missing = [mid for mid in set(mids) if self.get_row(mid) < 0]
+        if len(missing) == 0:
+            return
+        new_mids = []
+        new_imdbids = []
+        cursor = self.db["movie"].find({"mid": {"$in": missing}}, {"mid": 1, "imdbid": 1, "title": 1, "title_full": 1, "type": 1})
+        for cur_movie in cursor:
+            new_mids.append(cur_movie["mid"])
+            new_imdbids.append(cur_movie.get("imdbid", 0))
+            self.titles.append(cur_movie.get("title"))
+            self.titles_full.append(cur_movie.get("title_full"))
+            self.types.append(cur_movie.get("type"))
+            if cur_movie.get("title_full") is not None:
+                self.mids_by_title[cur_movie["title_full"]] = cur_movie["mid"]
+        if len(new_mids) == 0:
+            return
+
+        first_row = len(self.mids)
+        self.mids = numpy.append(self.mids, numpy.asarray(new_mids, dtype=numpy.int32))
+        self.imdbids = numpy.append(self.imdbids, numpy.asarray(new_imdbids, dtype=numpy.int32))
+        if max(new_mids) >= len(self.rows):
+            self.rows = numpy.append(self.rows, numpy.full(max(new_mids) + 1 - len(self.rows), -1, dtype=numpy.int32))
+        self.rows[numpy.asarray(new_mids)] = numpy.arange(first_row, len(self.mids), dtype=numpy.int32)
+
+    # catalog rows of the given mids (-1 for unknown ones), fetching misses first
+    def get_rows(self, mids):
+        mids = list(mids)
+        rows = [self.get_row(mid) for mid in mids]
+        if -1 in rows:
+            self.fetch_missing(mids)
+            rows = [self.get_row(mid) for mid in mids]
+        return rows
+
+    # full imdb titles, movies without one are skipped
+    def get_titles_full(self, mids):
+        titles = []
+        for row in self.get_rows(mids):
+            if row >= 0 and self.titles_full[row] is not None:
+                titles.append(self.titles_full[row])
+        return titles
+
+    # imdb ids in the "tt0000000" form
+    def get_imdbids(self, mids):
+        imdbids = []
+        for row in self.get_rows(mids):
+            if row >= 0:
+                imdbids.append("tt%07d" % self.imdbids[row])
+        return imdbids
+
+    # the catalog row of a movie as a small dict, None if unknown
+    def get_movie(self, mid):
+        row = self.get_rows([mid])[0]
+        if row < 0:
+            return None
+        return {
+            "mid": mid,
+            "imdbid": int(self.imdbids[row]),
+            "title": self.titles[row],
+            "title_full": self.titles_full[row],
+            "type": self.types[row]
+            }
+
+    # set the full title of a catalog row, the movie may have been loaded without it
+    def set_title_full(self, row, title_full):
+        old_title = self.titles_full[row]
+        if old_title is not None and self.mids_by_title.get(old_title) == self.mids[row]:
+            del self.mids_by_title[old_title]
+        self.titles_full[row] = title_full
+        self.mids_by_title[title_full] = int(self.mids[row])
+
+    # mids of the given full imdb titles, unknown titles are skipped
+    def get_mids_by_titles(self, titles):
+        missing = set([title for title in titles if title not in self.mids_by_title and title not in self.unknown_titles])
+        if len(missing) > 0:
+            cursor = self.db["movie"].find({"title_full": {"$in": list(missing)}}, {"mid": 1, "title_full": 1})
+            found = [(cur_movie["mid"], cur_movie["title_full"]) for cur_movie in cursor]
+            self.fetch_missing([mid for mid, title_full in found])
+            for mid, title_full in found:
+                row = self.get_row(mid)
+                if row >= 0 and self.titles_full[row] != title_full:
+                    self.set_title_full(row, title_full)
+            self.unknown_titles.update(missing - set([title_full for mid, title_full in found]))
+        mids = []
+        for title in titles:
+            if title in self.mids_by_title:
+                mids.append(self.mids_by_title[title])
+        return mids
+
+
+def main():
+    catalog = MovieCatalog(Mongo("movieRecommend").db)
+    print(catalog.get_titles_full([1, 2, 3]))
+    print(catalog.get_imdbids([1, 2, 3]))
+    print(catalog.get_mids_by_titles(["Toy Story (1995)", "Zombieland (2009)"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+from DataService import Mongo
+import os
+import time
+import numpy
+import topK
+import recommendCache
+from userMatrix import UserMatrix, LIKE_THRESHOLD
+
+# Offline item-item co-occurrence model over the MovieLens likes (ratings >= 3.5 in user_rate).
+# Two movies co-occur once for every user who liked both, and their similarity is the cosine
+# count / sqrt(likes of the first * likes of the second). The counts are the blocked sparse product
+# of the transposed likes matrix with itself: BLOCK_SIZE movies at a time are expanded through their
+# liking users into (movie, co-liked movie) pairs, counted in one bincount.
+# Only the top-N neighbours per movie are kept, in indexdata/ (same layout as movieSimilarity.py):
+#       -cooccurrence_mids.npy          liked movie ids, sorted (int32)
+#       -cooccurrence_rows.npy          mid -> row in the index, -1 if absent (int32)
+#       -cooccurrence_neighbours.npy    row -> top-N neighbour mids, most similar first, -1 padded (int32)
+#       -cooccurrence_scores.npy        row -> top-N cosine similarities, 0 padded (float32)
+# A history is scored by summing the neighbour lists of its movies, so the cost of a
+# recommendation depends on the length of the history and not on the number of users.
+
+INDEX_DIR = "indexdata"
+INDEX_NAME = "cooccurrence"
+NEIGHBOURS = 50
+MIN_COUNT = 2               # Co-occurrences below this are never neighbours.
+BLOCK_SIZE = 256            # Movies counted against all movies at once.
+MAX_PAIRS = 1 << 24         # Co-liked pairs expanded at once.
+
+def index_path(name, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, INDEX_NAME + "_" + name + ".npy")
+
+# top-n co-occurrence neighbours of every liked movie, as rows of matrix.like_movies
+def compute_neighbours(matrix, n=NEIGHBOURS, block_size=BLOCK_SIZE):
+    # likes in user order, movies as columns of like_movies (CSR view of the likes matrix)
+    row_of_entry = numpy.repeat(numpy.arange(len(matrix.uids), dtype=numpy.int64), numpy.diff(matrix.indptr))
+    liked = matrix.ratings >= LIKE_THRESHOLD
+    user_movies = numpy.searchsorted(matrix.like_movies, matrix.mids[liked]).astype(numpy.int32)
+    user_ptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(row_of_entry[liked], minlength=len(matrix.uids)))))
+
+    total = len(matrix.like_movies)
+    popularity = numpy.diff(matrix.like_ptr).astype(numpy.float64)
+    n = min(n, total - 1)
+    neighbours = numpy.full((total, max(n, 0)), -1, dtype=numpy.int32)
+    scores = numpy.zeros((total, max(n, 0)), dtype=numpy.float32)
+    if n <= 0:
+        return neighbours, scores
+
+    startTime = time.time()
+    for start in range(0, total, block_size):
+        end = min(start + block_size, total)
+        # liking users of the block movies, then the movies every one of them liked
+        users = matrix.like_users[matrix.like_ptr[start]:matrix.like_ptr[end]]
+        local = numpy.repeat(numpy.arange(end - start, dtype=numpy.int64), numpy.diff(matrix.like_ptr[start:end + 1]))
+        begin = user_ptr[users]
+        counts = user_ptr[users + 1] - begin
+        ends = numpy.cumsum(counts)
+
+        overlap = numpy.zeros((end - start) * total, dtype=numpy.int64)
+        first = 0
+        while first < len(counts):
+            done = ends[first - 1] if first > 0 else 0
+            last = max(first + 1, int(numpy.searchsorted(ends, done + MAX_PAIRS, "right")))
+            cur_counts = counts[first:last]
+            offsets = numpy.cumsum(cur_counts) - cur_counts
+            pairs = numpy.arange(cur_counts.sum()) + numpy.repeat(begin[first:last] - offsets, cur_counts)
+            overlap += numpy.bincount(numpy.repeat(local[first:last] * total, cur_counts) + user_movies[pairs], minlength=(end - start) * total)
+            first = last
+        overlap = overlap.reshape(end - start, total)
+        # a movie is never its own neighbour
+        overlap[numpy.arange(end - start), numpy.arange(start, end)] = 0
+
+        block = overlap / numpy.sqrt(popularity[start:end, None] * popularity[None, :])
+        block[overlap < MIN_COUNT] = 0
+        top = numpy.argpartition(-block, n - 1, axis=1)[:, :n]
+        top_scores = numpy.take_along_axis(block, top, axis=1)
+        order = numpy.argsort(-top_scores, axis=1, kind="stable")
+        top = numpy.take_along_axis(top, order, axis=1)
+        top_scores = numpy.take_along_axis(top_scores, order, axis=1)
+        neighbours[start:end] = numpy.where(top_scores > 0, top, -1)
+        scores[start:end] = top_scores
+        print("[movieCooccurrence] %5d movies processed so far. (%d%%) (%0.2fs)" % (end, int(end * 100 / total), time.time() - startTime))
+    return neighbours, scores
+
+# compute and store the whole co-occurrence model
+def build(matrix, index_dir=INDEX_DIR, n=NEIGHBOURS):
+    print("[movieCooccurrence] Starting build of item-item co-occurrence model...")
+    startTime = time.time()
+
+    neighbours, scores = compute_neighbours(matrix, n)
+    mids = matrix.like_movies.astype(numpy.int32)
+    rows = numpy.full(int(mids.max()) + 1 if len(mids) > 0 else 0, -1, dtype=numpy.int32)
+    rows[mids] = numpy.arange(len(mids), dtype=numpy.int32)
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    numpy.save(index_path("mids", index_dir), mids)
+    numpy.save(index_path("rows", index_dir), rows)
+    numpy.save(index_path("scores", index_dir), scores)
+    # written last: CooccurrenceIndex.load() checks for this file
+    numpy.save(index_path("neighbours", index_dir), numpy.where(neighbours >= 0, mids[neighbours], -1).astype(numpy.int32))
+    recommendCache.bump_data_version()
+    print("[movieCooccurrence] Build Complete: %d movies (%0.2fs)" % (len(mids), time.time() - startTime))
+
+class CooccurrenceIndex(object):
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.rows = numpy.load(index_path("rows", index_dir), mmap_mode="r")
+        self.neighbours = numpy.load(index_path("neighbours", index_dir), mmap_mode="r")
+        self.scores = numpy.load(index_path("scores", index_dir), mmap_mode="r")
+
+    # None if the model was never built
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        if not os.path.isfile(index_path("neighbours", index_dir)):
+            return None
+        return cls(index_dir)
+
+    def __contains__(self, mid):
+        return 0 <= mid < len(self.rows) and self.rows[mid] >= 0
+
+    # {mid: summed similarity} of the neighbours of the history, without the history itself
+    def score_history(self, history):
+        rows = [int(self.rows[mid]) for mid in history if mid in self]
+        if len(rows) == 0:
+            return {}
+        rows = numpy.asarray(sorted(rows))
+        mids = numpy.asarray(self.neighbours[rows]).ravel()
+        weights = numpy.asarray(self.scores[rows]).ravel()
+        keep = (mids >= 0) & ~numpy.isin(mids, numpy.asarray(list(history), dtype=numpy.int64))
+        candidates, inverse = numpy.unique(mids[keep], return_inverse=True)
+        sums = numpy.bincount(inverse, weights=weights[keep], minlength=len(candidates))
+        return dict(zip(candidates.tolist(), sums.tolist()))
+
+    # up to k movie ids recommended for the history, best first
+    def recommend(self, history, k):
+        return [mid for mid, score in topK.top_k_dict(self.score_history(history), k)]
+
+
+def main():
+    build(UserMatrix.load(Mongo("movieRecommend")))
+    index = CooccurrenceIndex.load()
+    # Toy Story (1995), Toy Story 2 (1999)
+    print(index.recommend({1, 3114}, 10))
+
+if __name__ == "__main__":
+    main()
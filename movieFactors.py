@@ -0,0 +1,248 @@
+from DataService import Mongo
+import multiprocessing
+import json
+import sys
+import os
+import time
+import numpy
+import topK
+import recommendCache
+import userMatrix
+from userMatrix import UserMatrix, LIKE_THRESHOLD
+
+# Matrix factorization of the MovieLens ratings by alternating least squares (ALS).
+# Users and movies get FACTORS-dimensional vectors. Every half iteration fixes one side and solves
+# the regularised least squares of all rows of the other side, blocks of rows at a time:
+# the normal equations of a block are built with one einsum and solved with one batched solve.
+# A row longer than a block (a popular movie) is solved alone, its equations summed block by block.
+#       -implicit (default): every rating is an observation with confidence 1 + ALPHA * rating,
+#        of a preference of 1 for liked movies (ratings >= 3.5) and 0 otherwise (Hu, Koren, Volinsky)
+#       -explicit: the ratings minus their mean are fitted on the rated entries only,
+#        with a regularisation of REG * number of ratings (weighted-lambda)
+# Rows are sharded over a pool of worker processes. The factor matrices are .npy files that every
+# worker memory-maps and writes its rows into, and serving memory-maps them as well, in indexdata/:
+#       -als_uids.npy               user factor row -> user id (int32)
+#       -als_user_factors.npy       user factors (float32, users x FACTORS)
+#       -als_mids.npy               movie factor row -> movie id (int32)
+#       -als_movie_factors.npy      movie factors (float32, movies x FACTORS)
+#       -als_params.json            training parameters, needed to fold in a history
+# A history that is not a MovieLens user is folded in with one solve against the fixed movie
+# factors, and then scored with one matrix-vector product.
+# Usage: python movieFactors.py [explicit] [--workers N]
+
+INDEX_DIR = "indexdata"
+INDEX_NAME = "als"
+FACTORS = 32
+ITERATIONS = 10
+REG = 0.1
+ALPHA = 2.0
+HISTORY_RATING = 5.0        # Rating given to the movies of a folded in history.
+BLOCK_ENTRIES = 4096        # Ratings in the normal equations built at once (einsum of ratings x factors x factors).
+SEED = 1
+workerData = None           # Ratings of the current worker process, by user and by movie.
+
+def index_path(name, index_dir=INDEX_DIR, extension=".npy"):
+    return os.path.join(index_dir, INDEX_NAME + "_" + name + extension)
+
+# ratings by user rows (CSR) and by movie rows (CSC) from the columnar ratings
+def load_ratings(index_dir=INDEX_DIR):
+    matrix = UserMatrix.load_columnar(index_dir)
+    mids, cols = numpy.unique(matrix.mids, return_inverse=True)
+    order = numpy.argsort(cols, kind="stable")
+    rows = numpy.repeat(numpy.arange(len(matrix.uids), dtype=numpy.int32), numpy.diff(matrix.indptr))
+    movie_ptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(cols, minlength=len(mids))))).astype(numpy.int64)
+    return {
+        "uids": matrix.uids,
+        "mids": mids.astype(numpy.int32),
+        "users": (matrix.indptr, cols.astype(numpy.int32), matrix.ratings),
+        "movies": (movie_ptr, rows[order], matrix.ratings[order]),
+        "mean": float(matrix.ratings.mean()) if len(matrix.ratings) > 0 else 0.0
+        }
+
+# normal equations (without regularisation) of the ratings [begin, end) of one long row, summed
+# BLOCK_ENTRIES ratings at a time, so that a popular movie never expands to ratings x factors x factors
+def long_row_system(indices, ratings, fixed, begin, end, params):
+    factors = fixed.shape[1]
+    A = numpy.zeros((factors, factors))
+    b = numpy.zeros(factors)
+    for first in range(begin, end, BLOCK_ENTRIES):
+        entries = slice(first, min(first + BLOCK_ENTRIES, end))
+        Y = numpy.asarray(fixed[indices[entries]], dtype=numpy.float64)
+        values = numpy.asarray(ratings[entries], dtype=numpy.float64)
+        if params["explicit"]:
+            A += Y.T.dot(Y)
+            b += Y.T.dot(values - params["mean"])
+        else:
+            confidence = 1 + params["alpha"] * values
+            A += (Y * (confidence - 1)[:, None]).T.dot(Y)
+            b += Y.T.dot(confidence * (values >= LIKE_THRESHOLD))
+    return A, b
+
+# least squares solution of rows [start, end) of one side against the fixed factors of the other
+def solve_rows(ptr, indices, ratings, fixed, gram, start, end, params):
+    factors = fixed.shape[1]
+    solved = numpy.zeros((end - start, factors), dtype=numpy.float32)
+    first = start
+    while first < end:
+        if ptr[first + 1] - ptr[first] > BLOCK_ENTRIES:
+            # a row longer than a block is solved alone
+            last = first + 1
+            lengths = numpy.diff(ptr[first:last + 1])
+            rated = numpy.zeros(1, dtype=numpy.int64)
+            A, b = long_row_system(indices, ratings, fixed, ptr[first], ptr[last], params)
+            A = A[None]
+            b = b[None]
+        else:
+            # as many short rows as fit in BLOCK_ENTRIES ratings, built with one einsum
+            last = min(int(numpy.searchsorted(ptr, ptr[first] + BLOCK_ENTRIES, "right")) - 1, end)
+            lengths = numpy.diff(ptr[first:last + 1])
+            rated = numpy.flatnonzero(lengths > 0)
+            if len(rated) == 0:
+                first = last
+                continue
+            entries = slice(ptr[first], ptr[last])
+            Y = numpy.asarray(fixed[indices[entries]], dtype=numpy.float64)
+            values = numpy.asarray(ratings[entries], dtype=numpy.float64)
+            starts = (ptr[first:last] - ptr[first])[rated]
+            if params["explicit"]:
+                A = numpy.add.reduceat(numpy.einsum("ni,nj->nij", Y, Y), starts)
+                b = numpy.add.reduceat(Y * (values - params["mean"])[:, None], starts)
+            else:
+                confidence = 1 + params["alpha"] * values
+                A = numpy.add.reduceat(numpy.einsum("ni,nj->nij", Y * (confidence - 1)[:, None], Y), starts)
+                b = numpy.add.reduceat(Y * (confidence * (values >= LIKE_THRESHOLD))[:, None], starts)
+        if params["explicit"]:
+            A += params["reg"] * lengths[rated][:, None, None] * numpy.eye(factors)
+        else:
+            A += gram + params["reg"] * numpy.eye(factors)
+        solved[first - start + rated] = numpy.linalg.solve(A, b[:, :, None])[:, :, 0]
+        first = last
+    return solved
+
+def init_worker(index_dir):
+    global workerData
+    workerData = load_ratings(index_dir)
+
+# solve one shard of rows and write it into the factors file of its side
+def solve_shard(task, data=None):
+    side, start, end, gram, params, index_dir = task
+    data = workerData if data is None else data
+    fixed_name = "movie_factors" if side == "users" else "user_factors"
+    target_name = "user_factors" if side == "users" else "movie_factors"
+    fixed = numpy.load(index_path(fixed_name + "_tmp", index_dir), mmap_mode="r")
+    target = numpy.load(index_path(target_name + "_tmp", index_dir), mmap_mode="r+")
+    ptr, indices, ratings = data[side]
+    target[start:end] = solve_rows(ptr, indices, ratings, fixed, gram, start, end, params)
+    target.flush()
+    return side, end - start
+
+# train the factors and store them, replacing the previous model only once done
+def train(mongo, index_dir=INDEX_DIR, factors=FACTORS, iterations=ITERATIONS, reg=REG, alpha=ALPHA, explicit=False, workers=4):
+    print("[movieFactors] Starting ALS training (%s, %d factors)..." % ("explicit" if explicit else "implicit", factors))
+    startTime = time.time()
+    if not os.path.isfile(userMatrix.index_path("stars", index_dir)):
+        # the workers load the ratings from the columnar files
+        UserMatrix.build(mongo).save_columnar(index_dir)
+    data = load_ratings(index_dir)
+    params = {"factors": factors, "reg": reg, "alpha": alpha, "explicit": explicit, "mean": data["mean"] if explicit else 0.0}
+
+    rng = numpy.random.RandomState(SEED)
+    sizes = {"users": len(data["uids"]), "movies": len(data["mids"])}
+    for side, name in (("users", "user_factors"), ("movies", "movie_factors")):
+        target = numpy.lib.format.open_memmap(index_path(name + "_tmp", index_dir), mode="w+", dtype=numpy.float32, shape=(sizes[side], factors))
+        target[:] = rng.normal(0, 0.01, (sizes[side], factors))
+        target.flush()
+        del target
+
+    if workers <= 1:
+        pool = None
+    else:
+        # spawn, so that no worker inherits the MongoClient of the parent process
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(index_dir,))
+    shards = max(1, workers * 4)
+    for iteration in range(iterations):
+        for side, fixed_name in (("users", "movie_factors"), ("movies", "user_factors")):
+            fixed = numpy.load(index_path(fixed_name + "_tmp", index_dir), mmap_mode="r")
+            gram = numpy.asarray(fixed, dtype=numpy.float64).T.dot(fixed)
+            del fixed
+            step = sizes[side] // shards + 1
+            tasks = [(side, start, min(start + step, sizes[side]), gram, params, index_dir) for start in range(0, sizes[side], step)]
+            if pool is None:
+                for task in tasks:
+                    solve_shard(task, data)
+            else:
+                pool.map(solve_shard, tasks)
+        print("[movieFactors] %2d/%d iterations done. (%0.2fs)" % (iteration + 1, iterations, time.time() - startTime))
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    numpy.save(index_path("uids", index_dir), data["uids"])
+    numpy.save(index_path("mids", index_dir), data["mids"])
+    os.replace(index_path("user_factors_tmp", index_dir), index_path("user_factors", index_dir))
+    os.replace(index_path("movie_factors_tmp", index_dir), index_path("movie_factors", index_dir))
+    # written last: FactorModel.load() checks for this file
+    with open(index_path("params", index_dir, ".json"), "w") as f:
+        json.dump(params, f)
+    recommendCache.bump_data_version()
+    print("[movieFactors] Training Complete: %d users x %d movies (%0.2fs)" % (sizes["users"], sizes["movies"], time.time() - startTime))
+
+class FactorModel(object):
+
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(index_path("params", index_dir, ".json"), "r") as f:
+            self.params = json.load(f)
+        self.mids = numpy.load(index_path("mids", index_dir))
+        self.movie_factors = numpy.load(index_path("movie_factors", index_dir), mmap_mode="r")
+        self.uids = numpy.load(index_path("uids", index_dir), mmap_mode="r")
+        self.user_factors = numpy.load(index_path("user_factors", index_dir), mmap_mode="r")
+        self.gram = numpy.asarray(self.movie_factors, dtype=numpy.float64).T.dot(self.movie_factors)
+
+    # None if the model was never trained
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        if not os.path.isfile(index_path("params", index_dir, ".json")):
+            return None
+        return cls(index_dir)
+
+    # factor rows of the known movies among mids
+    def get_rows(self, mids):
+        mids = numpy.asarray(list(mids), dtype=numpy.int64)
+        pos = numpy.searchsorted(self.mids, mids)
+        pos[pos >= len(self.mids)] = 0
+        known = self.mids[pos] == mids
+        return pos[known], known
+
+    # user vector of a history, one solve against the fixed movie factors
+    def fold_in(self, mids, ratings=None):
+        rows, known = self.get_rows(mids)
+        if ratings is None:
+            values = numpy.full(len(rows), HISTORY_RATING)
+        else:
+            values = numpy.asarray(ratings, dtype=numpy.float64)[known]
+        ptr = numpy.asarray([0, len(rows)], dtype=numpy.int64)
+        return solve_rows(ptr, rows, values, self.movie_factors, self.gram, 0, 1, self.params)[0]
+
+    # predicted score of every movie for a user vector
+    def score(self, vector):
+        return numpy.asarray(self.movie_factors).dot(vector)
+
+    # up to k movie ids recommended for the history, best first
+    def recommend(self, history, k):
+        if len(self.get_rows(history)[0]) == 0:
+            return []
+        scores = self.score(self.fold_in(history))
+        scores[self.get_rows(history)[0]] = -numpy.inf
+        top = topK.top_k_array(scores, k)
+        return [int(mid) for mid in self.mids[top[numpy.isfinite(scores[top])]]]
+
+
+def main():
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 4
+    train(Mongo("movieRecommend"), explicit="explicit" in sys.argv, workers=workers)
+    model = FactorModel.load()
+    # Toy Story (1995), Toy Story 2 (1999)
+    print(model.recommend({1, 3114}, 10))
+
+if __name__ == "__main__":
+    main()
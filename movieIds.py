@@ -0,0 +1,169 @@
+from DataService import Mongo
+import pymongo
+import time
+import recommendCache
+
+# Dense integer ids for the IMDB titles of the integration database.
+# db name: integration
+# collection name: movie_ids
+#       -movie id       (id, dense integer from 0)
+#       -imdb title     (imdbtitle, "Foo (1999)")
+# The movie lists of the integration collections hold these ids instead of titles:
+#       keywords.relevant_movie, tags.movies, integrated_tag.movies, normalized_tags.movies, peoples.movies
+# and copy_movies stores the id of its title. Titles are resolved only for the final recommendations.
+# A new title gets the next free id and ids are never reassigned, so the dictionary only grows.
+
+POSTINGS = [
+    ("keywords", "relevant_movie"),
+    ("tags", "movies"),
+    ("integrated_tag", "movies"),
+    ("normalized_tags", "movies"),
+    ("peoples", "movies")
+    ]
+
+class MovieIds(object):
+
+    def __init__(self, db_integration):
+        self.db = db_integration
+        self.load()
+
+    def load(self):
+        print("[MovieIds] Loading movie id dictionary...")
+        startTime = time.time()
+        self.titles = []
+        self.ids = {}
+        self.saved = 0
+        cursor = self.db["movie_ids"].find({}, {"id": 1, "imdbtitle": 1}).sort("id", pymongo.ASCENDING)
+        for cur_doc in cursor:
+            if cur_doc["id"] != len(self.titles):
+                raise ValueError("movie_ids is not dense at id " + str(len(self.titles)))
+            self.ids[cur_doc["imdbtitle"]] = cur_doc["id"]
+            self.titles.append(cur_doc["imdbtitle"])
+        self.saved = len(self.titles)
+        print("[MovieIds] Loaded %d movie ids (%0.2fs)" % (len(self.titles), time.time() - startTime))
+
+    # id of a title, assigning the next free one to a new title (kept until save())
+    def get_id(self, title):
+        movie_id = self.ids.get(title)
+        if movie_id is None:
+            movie_id = len(self.titles)
+            self.ids[title] = movie_id
+            self.titles.append(title)
+        return movie_id
+
+    def get_ids(self, titles):
+        return [self.get_id(title) for title in titles]
+
+    # None for unknown ids
+    def get_title(self, movie_id):
+        if 0 <= movie_id < len(self.titles):
+            return self.titles[movie_id]
+        return None
+
+    # reloads once when an id is newer than the dictionary
+    def get_titles(self, movie_ids):
+        if len(movie_ids) > 0 and max(movie_ids) >= len(self.titles) and self.saved == len(self.titles):
+            self.load()
+        return [self.get_title(movie_id) for movie_id in movie_ids]
+
+    # store the ids assigned since the last load() or save()
+    def save(self):
+        if self.saved == len(self.titles):
+            return
+        bulkSize = 5000   # How many documents should we store in memory before inserting them into the database in bulk?
+        bulkPayload = pymongo.bulk.BulkOperationBuilder(self.db["movie_ids"], ordered = False)
+        bulkCount = 0
+        skipCount = 0
+        for movie_id in range(self.saved, len(self.titles)):
+            bulkPayload.insert({"id": movie_id, "imdbtitle": self.titles[movie_id]})
+            bulkCount += 1
+            if bulkCount >= bulkSize:
+                try:
+                    bulkPayload.execute()
+                except pymongo.errors.OperationFailure as e:
+                    skipCount += len(e.details["writeErrors"])
+                bulkPayload = pymongo.bulk.BulkOperationBuilder(self.db["movie_ids"], ordered = False)
+                bulkCount = 0
+        if bulkCount > 0:
+            try:
+                bulkPayload.execute()
+            except pymongo.errors.OperationFailure as e:
+                skipCount += len(e.details["writeErrors"])
+        print("[MovieIds] Stored %d new movie ids, skipped %d." % (len(self.titles) - self.saved, skipCount))
+        self.saved = len(self.titles)
+
+    @classmethod
+    def create_indexes(cls, db_integration):
+        db_integration["movie_ids"].create_index([("id", pymongo.ASCENDING)], unique=True)
+        db_integration["movie_ids"].create_index([("imdbtitle", pymongo.ASCENDING)], unique=True)
+
+# rewrite the title lists of one collection into movie ids
+def migrate_collection(db_integration, movie_ids, collection, field):
+    progressInterval = 10000  # How often should we print a progress report to the console?
+    bulkSize = 1000           # How many documents should we store in memory before inserting them into the database in bulk?
+    bulkPayload = pymongo.bulk.BulkOperationBuilder(db_integration[collection], ordered = False)
+    bulkCount = 0
+    count = 0
+    skipCount = 0
+    startTime = time.time()
+
+    # only lists still starting with a title
+    cursor = db_integration[collection].find({field + ".0": {"$type": "string"}}, {field: 1}, no_cursor_timeout=True)
+    for cur_doc in cursor:
+        count += 1
+        if count % progressInterval == 0:
+            print("[MovieIds] %7d %s documents migrated so far. (%0.2fs)" % (count, collection, time.time() - startTime))
+
+        bulkPayload.find({"_id": cur_doc["_id"]}).update({"$set": {field: movie_ids.get_ids(cur_doc[field])}})
+        bulkCount += 1
+
+        if bulkCount >= bulkSize:
+            # the dictionary is always stored before the ids that use it
+            movie_ids.save()
+            try:
+                bulkPayload.execute()
+            except pymongo.errors.OperationFailure as e:
+                skipCount += len(e.details["writeErrors"])
+            bulkPayload = pymongo.bulk.BulkOperationBuilder(db_integration[collection], ordered = False)
+            bulkCount = 0
+    cursor.close()
+
+    if bulkCount > 0:
+        movie_ids.save()
+        try:
+            bulkPayload.execute()
+        except pymongo.errors.OperationFailure as e:
+            skipCount += len(e.details["writeErrors"])
+
+    print("[MovieIds] Migrated " + str(count) + " " + collection + " documents.")
+    print("[MovieIds] Skipped " + str(skipCount) + " updates.")
+
+# store the id of every copy_movies title
+def set_copy_movies_ids(db_integration, movie_ids):
+    cursor = db_integration["copy_movies"].find({"id": {"$exists": False}}, {"imdbtitle": 1})
+    updates = [(cur_doc["_id"], movie_ids.get_id(cur_doc["imdbtitle"])) for cur_doc in cursor]
+    movie_ids.save()
+    for doc_id, movie_id in updates:
+        db_integration["copy_movies"].update_one({"_id": doc_id}, {"$set": {"id": movie_id}})
+    print("[MovieIds] Set the movie id of " + str(len(updates)) + " copy_movies documents.")
+
+# one-shot migration of an integration database built with titles
+def migrate(mongo):
+    print("[MovieIds] Starting migration of integration titles to movie ids...")
+    startTime = time.time()
+    db_integration = mongo.client["integration"]
+    MovieIds.create_indexes(db_integration)
+    movie_ids = MovieIds(db_integration)
+    for collection, field in POSTINGS:
+        migrate_collection(db_integration, movie_ids, collection, field)
+    set_copy_movies_ids(db_integration, movie_ids)
+    recommendCache.bump_data_version()
+    print("[MovieIds] Migration Complete: %d movie ids (%0.2fs)" % (len(movie_ids.titles), time.time() - startTime))
+
+
+def main():
+    mongo = Mongo("integration")
+    migrate(mongo)
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,33 @@
 from DataService import Mongo
 import pymongo
 import time
+import os
+import titleJoin
 
 # find the full imdb title from imdb database
 # with this approach, 872 (out of 34208) movies still failed to be assigned the full imdb title
 # mainly due to french or other languages
+# The titles are matched by titleJoin.py: one pass over the imdb movies for all the MovieLens movies,
+# instead of one query per movie. The closest imdb titles of the unmatched movies are written to
+# indexdata/title_candidates.tsv (mid, title_imdb, year, candidate imdbtitle, similarity).
+
+CANDIDATES_PATH = os.path.join("indexdata", "title_candidates.tsv")
+
+def write_candidates(movies, candidates, path=CANDIDATES_PATH):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        for cur_movie in movies:
+            for imdbtitle, ratio in candidates.get(cur_movie["mid"], []):
+                f.write("%d\t%s\t%s\t%s\t%0.3f\n" % (cur_movie["mid"], cur_movie["title_imdb"], cur_movie.get("year"), imdbtitle, ratio))
 
 def retrieve(mongo):
 
-    progressInterval = 500     # How often should we print a progress report to the console?
-    progressTotal = 34208      # Approximate number of total lines in the file.
     bulkSize = 500             # How many documents should we store in memory before inserting them into the database in bulk?
     # List of documents that will be given to the database to be inserted to the collection in bulk.
     bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
-    count = 0
+    bulkCount = 0
     skipCount = 0
-    unfound = 0
 
     db_imdb = mongo.client["imdb"]
     db_movieRecommend = mongo.client["movieRecommend"]
@@ -23,56 +35,43 @@ def retrieve(mongo):
     print("[movieLensFullTitle] Starting retrieve of movie info from imdb database...")
     startTime = time.time()
 
-    cursor = db_movieRecommend["movie"].find({}, no_cursor_timeout=True)
-    for cur_movie in cursor:
-        count += 1
-        if count % progressInterval == 0:
-            print("[movieLensFullTitle] %5d lines processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
-
-        cur_mid = cur_movie["mid"]
-        cur_title_imdb = cur_movie["title_imdb"]
-        notFound = True
-        # handle the duplicated case
-        imdb_movie_cursor = db_imdb["movies"].find({"title": cur_title_imdb})
-        for imdb_movie in imdb_movie_cursor:
-            if imdb_movie["year"] == cur_movie["year"]:
-                bulkPayload.find({"mid": cur_mid}).update({"$set": {
-                    "title_full": imdb_movie["imdbtitle"]
-                    }})
-                notFound = False
-                break
+    movies = list(db_movieRecommend["movie"].find({}, {"_id": 0, "mid": 1, "title_imdb": 1, "year": 1}))
+    matches, candidates = titleJoin.match_imdb(db_imdb, movies)
 
-        if notFound:
-            unfound += 1
-
-        if count % bulkSize == 0:
+    for cur_mid, imdbtitle in matches.items():
+        bulkPayload.find({"mid": cur_mid}).update({"$set": {
+            "title_full": imdbtitle
+            }})
+        bulkCount += 1
+        if bulkCount >= bulkSize:
             try:
                 bulkPayload.execute()
             except pymongo.errors.OperationFailure as e:
                 skipCount += len(e.details["writeErrors"])
             bulkPayload = pymongo.bulk.BulkOperationBuilder(db_movieRecommend["movie"], ordered = False)
+            bulkCount = 0
 
-    if count % bulkSize > 0:
+    if bulkCount > 0:
         try:
             bulkPayload.execute()
         except pymongo.errors.OperationFailure as e:
             skipCount += len(e.details["writeErrors"])
 
+    write_candidates(movies, candidates)
+
     print("[movieLensFullTitle] Parse Complete (%0.2fs)" % (time.time() - startTime))
-    print("[movieLensFullTitle] Found " + str(count) + " movies.")
-    print("[movieLensFullTitle] Unfound " + str(unfound) + " movies.")
+    print("[movieLensFullTitle] Found " + str(len(movies)) + " movies.")
+    print("[movieLensFullTitle] Unfound " + str(len(movies) - len(matches)) + " movies.")
+    print("[movieLensFullTitle] Candidates for " + str(sum(1 for found in candidates.values() if len(found) > 0)) + " unfound movies in " + CANDIDATES_PATH)
     print("[movieLensFullTitle] Skipped " + str(skipCount) + " insertions.")
 
 
 def main():
     mongo = Mongo("movieRecommend")
-    db_imdb = mongo.client["imdb"]
-    db_imdb["movies"].create_index([("title", pymongo.ASCENDING)])
-    print("[movieLensFullTitle] Created index for title in movies")
     retrieve(mongo)
     db_movieRecommend = mongo.client["movieRecommend"]
     db_movieRecommend["movie"].create_index([("title_full", pymongo.ASCENDING)])
     print("[movieLensFullTitle] Created index for title_full in movie")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
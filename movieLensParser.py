@@ -14,7 +14,7 @@ def parse(mongo):
     print("[movieLensParser] Starting parse MovieLens database...")
     startTime = time.time()
 
-    # Add all user ratings into database.
+    # Add all user ratings into database, and write them as columnar files into indexdata/
     # runtime: (172.95s)
     movieLensRatings.parse(mongo)
     mongo.db["user_rate"].create_index([("uid", pymongo.ASCENDING)])
@@ -1,20 +1,75 @@
 from DataService import Mongo
+import userMatrix
+import recommendCache
 import pymongo
 import time
+import os
+import numpy
 
 # Parsing of MovieLens ratings.csv file.
 # db name: movieRecommend
 # collection name: user_rate
 # Adds fields to collection:
 #       -user id            (uid)
-#       -user's ratings     (ratings)
+#       -user's ratings     (rated_mids: int32 movie ids, rated_stars: uint8 half stars, see userMatrix.py)
+# Also writes the whole ratings matrix as columnar files for UserMatrix.load_columnar():
+#       -indexdata/user_ratings_uids.npy     row -> user id (int32)
+#       -indexdata/user_ratings_indptr.npy   row -> [start, end) offsets into mids/stars (int64)
+#       -indexdata/user_ratings_mids.npy     movie ids (int32)
+#       -indexdata/user_ratings_stars.npy    ratings * 2 (uint8)
+# The file is read in blocks of ~blockSize bytes and every block is parsed by numpy in one call.
+# Lines are expected grouped by user id, as in the MovieLens distribution.
 
-def parse(mongo):
-    progressInterval = 300000 # How often should we print a progress report to the console?
+blockSize = 64 * 1024 * 1024
+
+# yield blocks of whole lines, without the attribute line
+def read_blocks(path, block_size=blockSize):
+    inCSV = open(path, "rb")
+    # the first line is for attributes
+    inCSV.readline()
+    rest = b""
+    while 1:
+        data = inCSV.read(block_size)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b"\n") + 1
+        rest = data[end:]
+        if end > 0:
+            yield data[:end]
+    inCSV.close()
+    if len(rest.strip()) > 0:
+        yield rest + b"\n"
+
+# userId,movieId,rating,timestamp lines -> (uids, mids, stars) arrays
+def parse_block(block):
+    values = numpy.fromstring(block.replace(b"\n", b","), dtype=numpy.float64, sep=",")
+    # fromstring stops at the first value it cannot parse, so a short parse means a malformed line
+    if len(values) != 4 * block.count(b"\n"):
+        raise ValueError("malformed ratings block: parsed %d values for %d lines" % (len(values), block.count(b"\n")))
+    values = values.reshape(-1, 4)
+    return values[:, 0].astype(numpy.int32), values[:, 1].astype(numpy.int32), numpy.rint(values[:, 2] * 2).astype(numpy.uint8)
+
+# insert the users of one run of complete users
+def insert_users(bulkPayload, uids, mids, stars):
+    starts = numpy.flatnonzero(numpy.diff(uids)) + 1
+    starts = numpy.concatenate(([0], starts, [len(uids)]))
+    for i in range(len(starts) - 1):
+        start = starts[i]
+        end = starts[i + 1]
+        bulkPayload.insert({
+            "uid": int(uids[start]),
+            "rated_mids": userMatrix.pack_mids(mids[start:end]),
+            "rated_stars": userMatrix.pack_stars(stars[start:end])
+            })
+    return len(starts) - 1
+
+def parse(mongo, path="movielensdata/ratings.csv", index_dir=userMatrix.INDEX_DIR):
     progressTotal = 22884378  # Approximate number of total lines in the file.
     bulkSize = 2000           # How many documents should we store in memory before inserting them into the database in bulk?
     # List of documents that will be given to the database to be inserted to the collection in bulk.
     bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["user_rate"], ordered = False)
+    bulkCount = 0
     count = 0
     userCount = 0
     skipCount = 0
@@ -22,62 +77,75 @@ def parse(mongo):
     print("[movieLensRatings] Starting Parse of ratings.csv")
     startTime = time.time()
 
-    # open the ratings.csv and gather user's ratings into a list
-    inCSV = open("movielensdata/ratings.csv", "r")
-    # the first line is for attributes
-    attrLine = inCSV.readline()
+    # the last user of a block may continue in the next one, so it is carried over
+    carry = (numpy.empty(0, dtype=numpy.int32), numpy.empty(0, dtype=numpy.int32), numpy.empty(0, dtype=numpy.uint8))
+    columns = ([], [], [])
+    for block in read_blocks(path):
+        uids, mids, stars = parse_block(block)
+        count += len(uids)
+        uids = numpy.concatenate((carry[0], uids))
+        mids = numpy.concatenate((carry[1], mids))
+        stars = numpy.concatenate((carry[2], stars))
+        if len(uids) == 0:
+            continue
+        others = numpy.flatnonzero(uids != uids[-1])
+        done = others[-1] + 1 if len(others) > 0 else 0
+        carry = (uids[done:], mids[done:], stars[done:])
 
-    # save all data in dict
-    # output the data into MongoDB
-    curDict = {} # {uid : ***, ratings : {[mid, rating], ...}}
-    curList = []
-    prevId = -1
-    while 1:
-        line = inCSV.readline()
-        if not line:
-            break
+        if done > 0:
+            columns[0].append(uids[:done])
+            columns[1].append(mids[:done])
+            columns[2].append(stars[:done])
+            inserted = insert_users(bulkPayload, uids[:done], mids[:done], stars[:done])
+            userCount += inserted
+            bulkCount += inserted
+        if bulkCount >= bulkSize:
+            try:
+                bulkPayload.execute()
+            except pymongo.errors.OperationFailure as e:
+                skipCount += len(e.details["writeErrors"])
+            bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["user_rate"], ordered = False)
+            bulkCount = 0
+        print("[movieLensRatings] %8d lines processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
 
-        count += 1
-        if count % progressInterval == 0:
-            print("[movieLensRatings] %8d lines processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
-
-        curAttrs = line.split(",")
-        curId = int(curAttrs[0])
-        # store new user
-        if prevId != -1 and curId != prevId:
-            curDict["uid"] = prevId
-            curDict["ratings"] = curList
-            userCount += 1
-            bulkPayload.insert(curDict)
-            if userCount % bulkSize == 0:
-                try:
-                    bulkPayload.execute()
-                except pymongo.errors.OperationFailure as e:
-                    skipCount += len(e.details["writeErrors"])
-                bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["user_rate"], ordered = False)
-            curList = []
-            curDict = {}
-        # append new rating
-        curList.append([int(curAttrs[1]), float(curAttrs[2])])
-        prevId = curId
-    # write out the last document
-    curDict["uid"] = curId
-    curDict["ratings"] = curList
-    userCount += 1
-    bulkPayload.insert(curDict)
-    try:
-        bulkPayload.execute()
-    except pymongo.errors.OperationFailure as e:
-        skipCount += len(e.details["writeErrors"])
+    # write out the last user
+    if len(carry[0]) > 0:
+        for i in range(3):
+            columns[i].append(carry[i])
+        userCount += insert_users(bulkPayload, carry[0], carry[1], carry[2])
+        bulkCount += 1
+    if bulkCount > 0:
+        try:
+            bulkPayload.execute()
+        except pymongo.errors.OperationFailure as e:
+            skipCount += len(e.details["writeErrors"])
+
+    write_columnar(columns, index_dir)
 
     print("[movieLensRatings] Parse Complete (%0.2fs)" % (time.time() - startTime))
     print("[movieLensRatings] Found " + str(userCount) + " users.")
     print("[movieLensRatings] Skipped " + str(skipCount) + " insertions.")
 
+def write_columnar(columns, index_dir):
+    uids = numpy.concatenate(columns[0]) if len(columns[0]) > 0 else numpy.empty(0, dtype=numpy.int32)
+    starts = numpy.flatnonzero(numpy.diff(uids)) + 1
+    rows = numpy.concatenate(([0], starts)) if len(uids) > 0 else numpy.empty(0, dtype=numpy.int64)
+    indptr = numpy.append(rows, len(uids)).astype(numpy.int64)
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    numpy.save(userMatrix.index_path("uids", index_dir), uids[rows])
+    numpy.save(userMatrix.index_path("indptr", index_dir), indptr)
+    numpy.save(userMatrix.index_path("mids", index_dir), numpy.concatenate(columns[1]) if len(columns[1]) > 0 else numpy.empty(0, dtype=numpy.int32))
+    # stars last: UserMatrix.load_columnar() checks for this file
+    numpy.save(userMatrix.index_path("stars", index_dir), numpy.concatenate(columns[2]) if len(columns[2]) > 0 else numpy.empty(0, dtype=numpy.uint8))
+    recommendCache.bump_data_version()
+    print("[movieLensRatings] Wrote columnar ratings of %d users to %s" % (len(indptr) - 1, index_dir))
+
 
 def main():
     mongo = Mongo("movieRecommend")
     parse(mongo)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,17 +2,25 @@ from DataService import Mongo
 import pymongo
 import time
 import csv
+import array
+import tagRelevance
 
 # Parsing of MovieLens Genome tag_relevance.dat file.
 # db name: movieRecommend
 # collection name: tag
 # Adds fields to collection:
-#       -"movies id,relevant_score"  (relevant_movie)
+#       -movie ids          (relevant_mids, int32 binary)
+#       -relevant scores    (relevant_scores, float32 binary)
+# collection name: movie
+# Adds fields to collection:
+#       -tag ids            (tag_ids, int32 binary)
+#       -relevant scores    (tag_scores, float32 binary)
+# (see tagRelevance.py for the readers)
 
 def parse(mongo):
     progressInterval = 200000 # How often should we print a progress report to the console?
     progressTotal = 10979952  # Approximate number of total lines in the file.
-    bulkSize_tag = 2000       # How many documents should we store in memory before inserting them into the database in bulk?
+    bulkSize_tag = 200        # How many documents should we store in memory before inserting them into the database in bulk?
     bulkCount_tag = 0
     bulkPayload_tag = pymongo.bulk.BulkOperationBuilder(mongo.db["tag"], ordered = False)
     bulkSize_movie = 300      # How many documents should we store in memory before inserting them into the database in bulk?
@@ -28,8 +36,12 @@ def parse(mongo):
     # open the ratings.csv and gather user's ratings into a list
     inCSV = open("movielensdata/tag_relevance.dat", "r", encoding = "utf8")
 
+    # gather the relevant movies of every tag in memory, they are written once at the end
+    tags_mids = {}
+    tags_scores = {}
     # output the data into MongoDB
-    tags_relevance = []
+    movie_tids = array.array("i")
+    movie_scores = array.array("f")
     for line in csv.reader(inCSV, delimiter = "\t"):
         count += 1
         if count % progressInterval == 0:
@@ -41,25 +53,23 @@ def parse(mongo):
         # consider only the relevant tag
         if relevant_score >= 0.5:
             # append the new movie to tag
-            cur_movie_relevance = str(mid) + "," + str(relevant_score)
-            bulkPayload_tag.find({"tid": tid}).update({"$push": {"relevant_movie": cur_movie_relevance}})
-            bulkCount_tag += 1
+            if tid not in tags_mids:
+                tags_mids[tid] = array.array("i")
+                tags_scores[tid] = array.array("f")
+            tags_mids[tid].append(mid)
+            tags_scores[tid].append(relevant_score)
             # append the new tag to movie
-            cur_tag_relevance = str(tid) + "," + str(relevant_score)
-            tags_relevance.append(cur_tag_relevance)
+            movie_tids.append(tid)
+            movie_scores.append(relevant_score)
 
         if count % tag_num == 0:
-            bulkPayload_movie.find({"mid": mid} ).update({"$set": {"tags": tags_relevance}})
+            bulkPayload_movie.find({"mid": mid} ).update({"$set": {
+                "tag_ids": tagRelevance.pack_ids(movie_tids),
+                "tag_scores": tagRelevance.pack_scores(movie_scores)
+                }})
             bulkCount_movie += 1
-            tags_relevance = []
-
-        if bulkCount_tag >= bulkSize_tag:
-            try:
-                bulkPayload_tag.execute()
-            except pymongo.errors.OperationFailure as e:
-                skipCount += len(e.details["writeErrors"])
-            bulkPayload_tag = pymongo.bulk.BulkOperationBuilder(mongo.db["tag"], ordered = False)
-            bulkCount_tag = 0
+            movie_tids = array.array("i")
+            movie_scores = array.array("f")
 
         if bulkCount_movie >= bulkSize_movie:
             try:
@@ -68,16 +78,32 @@ def parse(mongo):
                 skipCount += len(e.details["writeErrors"])
             bulkPayload_movie = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
             bulkCount_movie = 0
+    inCSV.close()
 
-    if bulkCount_tag >= 0:
+    if bulkCount_movie > 0:
         try:
-            bulkPayload_tag.execute()
+            bulkPayload_movie.execute()
         except pymongo.errors.OperationFailure as e:
             skipCount += len(e.details["writeErrors"])
 
-    if bulkCount_movie >= 0:
+    for tid in tags_mids.keys():
+        bulkPayload_tag.find({"tid": tid}).update({"$set": {
+            "relevant_mids": tagRelevance.pack_ids(tags_mids[tid]),
+            "relevant_scores": tagRelevance.pack_scores(tags_scores[tid])
+            }})
+        bulkCount_tag += 1
+
+        if bulkCount_tag >= bulkSize_tag:
+            try:
+                bulkPayload_tag.execute()
+            except pymongo.errors.OperationFailure as e:
+                skipCount += len(e.details["writeErrors"])
+            bulkPayload_tag = pymongo.bulk.BulkOperationBuilder(mongo.db["tag"], ordered = False)
+            bulkCount_tag = 0
+
+    if bulkCount_tag > 0:
         try:
-            bulkPayload_movie.execute()
+            bulkPayload_tag.execute()
         except pymongo.errors.OperationFailure as e:
             skipCount += len(e.details["writeErrors"])
 
@@ -1,7 +1,19 @@
 from DataService import Mongo
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import urllib.request
+import urllib.parse
+import threading
+import shelve
+import random
 import pymongo
+import json
 import time
-import omdb
+import sys
+import os
+import re
+import imdbUtil
+import omdbFields
 
 # Retrieving movie infomation from imdb for each movie in MovieLens database.
 # db name: movieRecommend
@@ -23,84 +35,285 @@ import omdb
 #       - actors
 #       - writer
 #       - title_imdb
+# year, runtime, metascore, imdb_rating and imdb_votes are stored as numbers, null when missing (see omdbFields.py)
+#
+# The movies are enriched in batches of bulkSize, sorted by mid:
+#       -every OMDb response is kept in a shelve cache keyed by imdbid (indexdata/omdb_cache.*),
+#        only missing and stale (older than CACHE_TTL, ERROR_TTL for errors) entries are fetched again
+#       -the fetches of a batch run in a pool of `workers` threads, behind a shared RateLimiter
+#       -a failed fetch is retried, then skipped: the movie is left for the next run
+#       -the last mid written is checkpointed (imdbdata/checkpoints/movieLensToIMDB.json), a stopped
+#        run resumes after it
+#       -a rerun after a finished run walks all the movies again: the cache fetches the missing and stale
+#        entries only, and only the movies with a new response are written
+# OMDB_URL can point to a local stand-in server (serve(), with fake responses, latency and errors).
+# Usage: python movieLensToIMDB.py [--restart] [--url URL] [--workers N] [--rate R]
+#        python movieLensToIMDB.py serve [port]        (stand-in OMDb server)
+#        python movieLensToIMDB.py benchmark           (fetch throughput against a stand-in server)
 
-def retrieve(mongo):
+OMDB_URL = "http://www.omdbapi.com/"
+API_KEY = os.environ.get("OMDB_API_KEY", "")
+CACHE_PATH = os.path.join("indexdata", "omdb_cache")
+CACHE_TTL = 30 * 24 * 3600  # Seconds before a cached response is fetched again.
+ERROR_TTL = 24 * 3600       # Same for error responses ("Movie not found!").
+RETRIES = 3                 # Attempts of every fetch.
+TIMEOUT = 10                # Seconds before a fetch is abandoned.
+WORKERS = 8
+RATE = 10.0                 # Fetches per second over all workers.
+CHECKPOINT = "movieLensToIMDB"
+
+# thread-safe limiter spacing calls at least 1 / rate seconds apart
+class RateLimiter(object):
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next = time.time()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+# OMDb keys in the style of omdb.py: "imdbRating" -> "imdb_rating", "Year" -> "year"
+def to_fields(response):
+    fields = {}
+    for key, value in response.items():
+        fields[re.sub("([a-z0-9])([A-Z])", r"\1_\2", key).lower()] = value
+    return fields
+
+# "tt" + 7 digits imdbid of a MovieLens imdbid
+def to_imdbid(imdbid):
+    return "tt" + str(imdbid).zfill(7)
+
+# OMDb JSON response of one imdbid, None when every attempt failed
+def fetch(imdbid, limiter, url=OMDB_URL, api_key=API_KEY):
+    query = {"i": imdbid, "plot": "short", "r": "json"}
+    if len(api_key) > 0:
+        query["apikey"] = api_key
+    for attempt in range(RETRIES):
+        limiter.wait()
+        try:
+            with urllib.request.urlopen(url + "?" + urllib.parse.urlencode(query), timeout=TIMEOUT) as response:
+                return json.loads(response.read().decode("utf8"))
+        except (OSError, ValueError) as e:
+            if attempt + 1 == RETRIES:
+                print("[movieLensToIMDB] Fetch of " + imdbid + " failed: " + repr(e))
+            else:
+                time.sleep(0.5 * 2 ** attempt)
+    return None
+
+def is_fresh(entry, now):
+    ttl = CACHE_TTL if entry["response"].get("Response", "True") == "True" else ERROR_TTL
+    return now - entry["fetched"] < ttl
+
+# responses of a batch of imdbids: fresh cache entries, the others fetched by the pool and cached
+# (responses, imdbids fetched, failed fetches)
+def get_responses(imdbids, cache, pool, limiter, url):
+    now = time.time()
+    responses = {}
+    missing = []
+    for imdbid in imdbids:
+        entry = cache.get(imdbid)
+        if entry is not None and is_fresh(entry, now):
+            responses[imdbid] = entry["response"]
+        else:
+            missing.append(imdbid)
+    fetched = list(pool.map(lambda imdbid: fetch(imdbid, limiter, url), missing))
+    for imdbid, response in zip(missing, fetched):
+        if response is not None:
+            cache[imdbid] = {"fetched": now, "response": response}
+            responses[imdbid] = response
+    return responses, missing, len([response for response in fetched if response is None])
+
+# $set of a movie from its OMDb response
+def movie_update(response):
+    imdb_movie = to_fields(response)
+    cur_genres = []
+    for genre in imdb_movie["genre"].split(","):
+        cur_genres.append(genre.strip())
+    cur_actors = []
+    for actor in imdb_movie["actors"].split(","):
+        cur_actors.append(actor.strip())
+    return {
+        "year": omdbFields.parse_year(imdb_movie["year"]),
+        "country": imdb_movie["country"],
+        "language": imdb_movie["language"],
+        "poster": imdb_movie["poster"],
+        "type": imdb_movie["type"],
+        "runtime": omdbFields.parse_runtime(imdb_movie["runtime"]),
+        "plot": imdb_movie["plot"],
+        "metascore": omdbFields.parse_metascore(imdb_movie["metascore"]),
+        "rated": imdb_movie["rated"],
+        "imdb_rating": omdbFields.parse_rating(imdb_movie["imdb_rating"]),
+        "imdb_votes": omdbFields.parse_votes(imdb_movie["imdb_votes"]),
+        "genres": cur_genres,
+        "director": imdb_movie["director"],
+        "actors": cur_actors,
+        "writer": imdb_movie["writer"],
+        "title_imdb": imdb_movie["title"]
+        }
+
+def retrieve(mongo, restart=False, url=OMDB_URL, workers=WORKERS, rate=RATE, cache_path=CACHE_PATH):
 
-    progressInterval = 100     # How often should we print a progress report to the console?
     progressTotal = 34208      # Approximate number of total lines in the file.
     bulkSize = 100             # How many documents should we store in memory before inserting them into the database in bulk?
-    # List of documents that will be given to the database to be inserted to the collection in bulk.
-    bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
     count = 0
+    fetchCount = 0
+    failCount = 0
+    unknownCount = 0
     skipCount = 0
 
-    print("[movieLensToIMDB] Starting retrieve of movie info from IMDB...")
+    checkpoint = imdbUtil.Checkpoint(CHECKPOINT)
+    if restart:
+        checkpoint.clear()
+    # after a finished run, a new pass refreshes the missing and stale cache entries
+    refresh = checkpoint.done
+    if refresh:
+        checkpoint.clear()
+
+    print("[movieLensToIMDB] Starting %s of movie info from IMDB..." % ("refresh" if refresh else "retrieve"))
     startTime = time.time()
 
-    # save all data in dict
-    # output the data into MongoDB
-    cursor = mongo.db["movie"].find({}, no_cursor_timeout=True)
-    for cur_movie in cursor:
-        count += 1
-        if count % progressInterval == 0:
-            print("[movieLensToIMDB] %5d lines processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
-
-        cur_mid = cur_movie["mid"]
-        cur_imdbid_len = len(str(cur_movie["imdbid"]))
-        # Construct the real imdbid
-        cur_imdbid = "tt"
-        for i in range(7 - cur_imdbid_len):
-            cur_imdbid += "0"
-        cur_imdbid += str(cur_movie["imdbid"])
-
-        # retrieve movie info from IMDB
-        imdb_movie = omdb.imdbid(cur_imdbid)
-        cur_genres = []
-        for genre in imdb_movie["genre"].split(","):
-            cur_genres.append(genre.strip())
-        cur_actors = []
-        for actor in imdb_movie["actors"].split(","):
-            cur_actors.append(actor.strip())
-
-        bulkPayload.find({"mid": cur_mid}).update({"$set": {
-            "year": imdb_movie["year"], 
-            "country": imdb_movie["country"], 
-            "language": imdb_movie["language"], 
-            "poster": imdb_movie["poster"], 
-            "type": imdb_movie["type"], 
-            "runtime": imdb_movie["runtime"], 
-            "plot": imdb_movie["plot"], 
-            "metascore": imdb_movie["metascore"], 
-            "rated": imdb_movie["rated"], 
-            "imdb_rating": imdb_movie["imdb_rating"], 
-            "imdb_votes": imdb_movie["imdb_votes"], 
-            "genres": cur_genres, 
-            "director": imdb_movie["director"], 
-            "actors": cur_actors, 
-            "writer": imdb_movie["writer"],
-            "title_imdb": imdb_movie["title"]
-            }})
-
-        if count % bulkSize == 0:
-            try:
-                bulkPayload.execute()
-            except pymongo.errors.OperationFailure as e:
-                skipCount += len(e.details["writeErrors"])
+    # only (mid, imdbid) pairs are read up front, no cursor stays open during the fetches
+    cursor = mongo.db["movie"].find({"mid": {"$gt": checkpoint.offset}}, {"mid": 1, "imdbid": 1}).sort("mid", pymongo.ASCENDING)
+    movies = [(cur_movie["mid"], to_imdbid(cur_movie["imdbid"])) for cur_movie in cursor]
+    if checkpoint.offset > 0:
+        print("[movieLensToIMDB] Resuming after mid " + str(checkpoint.offset) + ", " + str(len(movies)) + " movies left.")
+
+    if not os.path.isdir(os.path.dirname(cache_path)):
+        os.makedirs(os.path.dirname(cache_path))
+    cache = shelve.open(cache_path)
+    limiter = RateLimiter(rate)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for start in range(0, len(movies), bulkSize):
+            batch = movies[start:start + bulkSize]
+            responses, batchFetches, batchFails = get_responses([imdbid for mid, imdbid in batch], cache, pool, limiter, url)
+            fetchCount += len(batchFetches)
+            batchFetches = set(batchFetches)
+            failCount += batchFails
+
             bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
-    if count % bulkSize > 0:
-        try:
-            bulkPayload.execute()
-        except pymongo.errors.OperationFailure as e:
-            skipCount += len(e.details["writeErrors"])
+            bulkCount = 0
+            for cur_mid, cur_imdbid in batch:
+                response = responses.get(cur_imdbid)
+                if response is None or (refresh and cur_imdbid not in batchFetches):
+                    continue
+                if response.get("Response", "True") != "True":
+                    unknownCount += 1
+                    continue
+                bulkPayload.find({"mid": cur_mid}).update({"$set": movie_update(response)})
+                bulkCount += 1
+            if bulkCount > 0:
+                try:
+                    bulkPayload.execute()
+                except pymongo.errors.OperationFailure as e:
+                    skipCount += len(e.details["writeErrors"])
+            cache.sync()
+            # the checkpoint stops before the first failed fetch, a rerun retries it (the rest is cached)
+            if failCount == 0:
+                checkpoint.save(batch[-1][0])
+
+            count += len(batch)
+            print("[movieLensToIMDB] %5d movies processed so far, %d fetched. (%d%%) (%0.2fs)" % (count, fetchCount, int(count * 100 / progressTotal), time.time() - startTime))
+    finally:
+        pool.shutdown()
+        cache.close()
+
+    if failCount == 0:
+        checkpoint.finish()
+    else:
+        print("[movieLensToIMDB] Checkpoint kept before the first failed fetch.")
+    omdbFields.create_indexes(mongo)
 
     print("[movieLensToIMDB] Parse Complete (%0.2fs)" % (time.time() - startTime))
-    print("[movieLensToIMDB] Found " + str(count) + " movies.")
+    print("[movieLensToIMDB] Found " + str(count) + " movies, fetched " + str(fetchCount) + ".")
+    print("[movieLensToIMDB] Failed " + str(failCount) + " fetches, left for the next run.")
+    print("[movieLensToIMDB] Unknown to OMDb: " + str(unknownCount) + " movies.")
     print("[movieLensToIMDB] Skipped " + str(skipCount) + " insertions.")
 
+# local stand-in of the OMDb API, with fake responses for any imdbid
+class StandInHandler(BaseHTTPRequestHandler):
+    latency = 0.05      # Seconds of every response.
+    error_rate = 0.0    # Fraction of answers with a HTTP 500.
+
+    def do_GET(self):
+        time.sleep(StandInHandler.latency)
+        if random.random() < StandInHandler.error_rate:
+            self.send_error(500)
+            return
+        imdbid = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get("i", [""])[0]
+        number = int(imdbid[2:]) if imdbid[2:].isdigit() else 0
+        response = {
+            "Title": "Movie " + str(number), "Year": str(1920 + number % 100), "Rated": "PG", "Runtime": str(80 + number % 60) + " min",
+            "Genre": "Comedy, Drama", "Director": "Director " + str(number % 97), "Writer": "Writer " + str(number % 89),
+            "Actors": "Actor " + str(number % 83) + ", Actor " + str(number % 79), "Plot": "N/A", "Language": "English",
+            "Country": "USA", "Poster": "N/A", "Metascore": "N/A" if number % 3 == 0 else str(number % 100),
+            "imdbRating": str(round(1 + number % 90 / 10.0, 1)), "imdbVotes": "{:,}".format(number * 37 % 1000000),
+            "imdbID": imdbid, "Type": "movie", "Response": "True"
+            }
+        body = json.dumps(response).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# stand-in server on localhost:port, in a background thread
+def serve(port=8765, latency=StandInHandler.latency, error_rate=StandInHandler.error_rate):
+    StandInHandler.latency = latency
+    StandInHandler.error_rate = error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandInHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print("[movieLensToIMDB] Stand-in OMDb server on http://127.0.0.1:%d/ (%0.3fs latency)" % (server.server_address[1], latency))
+    return server
+
+# fetch throughput against a stand-in server, without cache or database
+def benchmark(count=400, workers=(1, 4, 16), latency=0.05):
+    server = serve(0, latency)
+    url = "http://127.0.0.1:%d/" % server.server_address[1]
+    imdbids = [to_imdbid(number) for number in range(1, count + 1)]
+    for cur_workers in workers:
+        cache = {}
+        pool = ThreadPoolExecutor(max_workers=cur_workers)
+        startTime = time.time()
+        responses, fetches, fails = get_responses(imdbids, cache, pool, RateLimiter(0), url)
+        elapsed = time.time() - startTime
+        pool.shutdown()
+        print("[movieLensToIMDB] %2d workers: %d fetches in %0.2fs (%0.1f/s), %d failed" % (cur_workers, len(fetches), elapsed, len(fetches) / elapsed, fails))
+        startTime = time.time()
+        get_responses(imdbids, cache, pool, RateLimiter(0), url)
+        print("[movieLensToIMDB] %2d workers: cached rerun in %0.4fs" % (cur_workers, time.time() - startTime))
+    server.shutdown()
+
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        server = serve(int(sys.argv[2]) if len(sys.argv) > 2 else 8765)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        return
+    url = sys.argv[sys.argv.index("--url") + 1] if "--url" in sys.argv else OMDB_URL
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else WORKERS
+    rate = float(sys.argv[sys.argv.index("--rate") + 1]) if "--rate" in sys.argv else RATE
     mongo = Mongo("movieRecommend")
-    retrieve(mongo)
+    retrieve(mongo, "--restart" in sys.argv, url, workers, rate)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,134 @@
+from DataService import Mongo
+import pymongo
+import omdbFields
+import time
+import sys
+
+# Movie rankings computed by MongoDB aggregation pipelines, only the final mids come back.
+# db name: movieRecommend
+# collection name: genres_list
+# Sets fields of the genre documents (and of the "all" document for all movies):
+#       -top rated movies       (top_rated: mids by imdb_rating)
+#       -most popular movies    (most_popular: mids by imdb_votes)
+#       -decade windows         (decades: {"1980s": {"top_rated": [...], "most_popular": [...]}, ...})
+# imdb_rating, imdb_votes and year are ranked as the numbers stored by omdbFields.py, prepare() first
+# migrates the movies still holding raw OMDb strings. Values that are not numbers (null for "N/A") are left out.
+# Equal scores are ordered by mid, as MovieIndexBuilder in prepareDB.py orders them, so both give the same lists.
+# compare() checks the pipelines against the top_rated / most_popular lists stored by MovieIndexBuilder.
+# One $facet runs every ranking over a single read of the movie collection. Each ranking is
+# $unwind genres (per genre only), $sort, $group and $slice, or $topN on MongoDB 5.2 and later.
+
+K_ALL = 100         # Movies in the rankings among all.
+K_GENRE = 30        # Movies in the rankings of every genre.
+# ranking windows, the eras of imdbMovieLensTags.getMongoSearch()
+DECADES = [1920, 1930, 1950, 1960, 1970, 1980]
+SCORES = {"top_rated": "imdb_rating", "most_popular": "imdb_votes"}
+
+# pipeline of the k best mids by score, per genre and/or decade
+def ranking(score, k, by_genre, by_decade, decades, topn):
+    pipeline = [{"$match": {score: {"$type": "number"}}}]
+    key = {"genre": "all"}
+    if by_genre:
+        pipeline.append({"$unwind": "$genres"})
+        key["genre"] = "$genres"
+    if by_decade:
+        pipeline.append({"$match": {"year": {"$type": "number"}}})
+        pipeline.append({"$addFields": {"decade": {"$multiply": [{"$floor": {"$divide": ["$year", 10]}}, 10]}}})
+        pipeline.append({"$match": {"decade": {"$in": decades}}})
+        key["decade"] = "$decade"
+    if topn:
+        pipeline.append({"$group": {"_id": key, "mids": {"$topN": {"n": k, "sortBy": {score: -1, "mid": 1}, "output": "$mid"}}}})
+    else:
+        pipeline.append({"$sort": {score: -1, "mid": 1}})
+        pipeline.append({"$group": {"_id": key, "mids": {"$push": "$mid"}}})
+        pipeline.append({"$project": {"mids": {"$slice": ["$mids", k]}}})
+    return pipeline
+
+def supports_topn(mongo):
+    return tuple(mongo.client.server_info()["versionArray"][:2]) >= (5, 2)
+
+# run all rankings in one aggregation, {(genre, decade or None): {ranking name: mids}}
+def aggregate_rankings(mongo, k_all=K_ALL, k_genre=K_GENRE, decades=DECADES, topn=None):
+    if topn is None:
+        topn = supports_topn(mongo)
+    facets = {}
+    for name, score in SCORES.items():
+        facets[name + "_all"] = ranking(score, k_all, False, False, decades, topn)
+        facets[name + "_genres"] = ranking(score, k_genre, True, False, decades, topn)
+        if len(decades) > 0:
+            facets[name + "_all_decades"] = ranking(score, k_all, False, True, decades, topn)
+            facets[name + "_genres_decades"] = ranking(score, k_genre, True, True, decades, topn)
+    pipeline = [
+        {"$project": {"mid": 1, "genres": 1, "year": 1, "imdb_rating": 1, "imdb_votes": 1}},
+        {"$facet": facets}
+        ]
+    result = next(mongo.db["movie"].aggregate(pipeline, allowDiskUse=True))
+
+    rankings = {}
+    for facet, groups in result.items():
+        name = "top_rated" if facet.startswith("top_rated") else "most_popular"
+        for group in groups:
+            decade = group["_id"].get("decade")
+            cur_key = (group["_id"]["genre"], None if decade is None else int(decade))
+            rankings.setdefault(cur_key, {})[name] = group["mids"]
+    return rankings
+
+def prepare(mongo, k_all=K_ALL, k_genre=K_GENRE, decades=DECADES):
+    # the pipelines only rank typed numbers
+    omdbFields.migrate(mongo)
+
+    print("[movieRankings] Starting aggregation of movie rankings...")
+    startTime = time.time()
+
+    rankings = aggregate_rankings(mongo, k_all, k_genre, decades)
+    # genres without any ranked movie get empty rankings, as MovieIndexBuilder gives them
+    updates = dict((cur_genre["genre"], dict((name, []) for name in SCORES)) for cur_genre in mongo.db["genres_list"].find({}, {"genre": 1}))
+    for (genre, decade), cur_rankings in rankings.items():
+        cur_update = updates.setdefault(genre, {})
+        for name, mids in cur_rankings.items():
+            if decade is None:
+                cur_update[name] = mids
+            else:
+                cur_update["decades.%ds.%s" % (decade, name)] = mids
+
+    bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["genres_list"], ordered = False)
+    skipCount = 0
+    for genre, cur_update in updates.items():
+        bulkPayload.find({"genre": genre}).upsert().update({"$set": cur_update})
+    if len(updates) > 0:
+        try:
+            bulkPayload.execute()
+        except pymongo.errors.OperationFailure as e:
+            skipCount += len(e.details["writeErrors"])
+
+    print("[movieRankings] Ranked %d genres over %d decades, skipped %d updates." % (len(updates), len(decades), skipCount))
+    print("[movieRankings] Done (%0.2fs)." % (time.time() - startTime))
+
+# compare the aggregated rankings with the ones stored in genres_list by MovieIndexBuilder, without writing anything
+def compare(mongo, k_all=K_ALL, k_genre=K_GENRE):
+    rankings = aggregate_rankings(mongo, k_all, k_genre, [])
+    lists = 0
+    same = 0
+    for cur_genre in mongo.db["genres_list"].find({}, {"genre": 1, "top_rated": 1, "most_popular": 1}):
+        cur_rankings = rankings.get((cur_genre["genre"], None), {})
+        for name in SCORES:
+            stored = cur_genre.get(name, [])
+            aggregated = cur_rankings.get(name, [])
+            lists += 1
+            if stored == aggregated:
+                same += 1
+            else:
+                overlap = len(set(stored) & set(aggregated))
+                print("[movieRankings] %s %s: %d stored, %d aggregated, %d in common" % (cur_genre["genre"], name, len(stored), len(aggregated), overlap))
+    print("[movieRankings] %d of %d rankings identical." % (same, lists))
+
+
+def main():
+    mongo = Mongo("movieRecommend")
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare(mongo)
+        return
+    prepare(mongo)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,53 @@
 import time
 import math
-import queue
 import pymongo
 import threading
 from DataService import Mongo
 from TwitterService import Tweepy
 from TweetAnalytics import TextAnalytics
+from userMatrix import UserMatrix, HistoryNeighbours, get_user_ratings
+from userSimilarity import UserLSHIndex
+from movieSimilarity import SimilarityIndex
+from movieCooccurrence import CooccurrenceIndex
+from movieFactors import FactorModel
+from movieCatalog import MovieCatalog
+from invertedIndex import InvertedIndex
+from movieIds import MovieIds
+from vocabularyCache import VocabularyCache
+from recommendCache import RecommendCache, make_key
+import tagRelevance
+import topK
 
 # Recommender based on MovieLens/Genome database and Twitter profile
 # db name: movieRecommend
 
 class MovieRecommend(object):
 
+    # resident user x movie matrix, shared by all recommenders in the process
+    user_matrix = None
+    # MinHash-LSH index over the users' likes, False until first lookup
+    user_lsh = False
+    # "exact": score every user through the likes index, "lsh": rescore only the users sharing an
+    # LSH bucket (when the signatures were built, see userSimilarity.py for the benchmark)
+    similar_users_mode = "exact"
+    # item-item co-occurrence model over the users' likes, False until first lookup
+    cooccurrence_index = False
+    # ALS factor model of the ratings, False until first lookup
+    factor_model = False
+    # history recommendations by "users": similar users' likes, "items": co-occurring movies,
+    # "factors": folded in ALS factors (when the model was built, see movieCooccurrence.py, movieFactors.py)
+    history_engine = "users"
+    # resident mid -> imdbid/title lookup
+    movie_catalog = None
+    # memory-mapped item-item similarity index, False until first lookup
+    similarity_index = False
+    # inverted index over the integration database, False until first lookup
+    integration_index = False
+    # inverted index over the genome tags, False until first lookup
+    genome_index = False
+    # integration movie id -> imdb title dictionary
+    movie_ids = None
+
     @classmethod
     def __init__(self, mongo):
         self.mongo = mongo
@@ -21,43 +57,26 @@ class MovieRecommend(object):
 
     @classmethod
     def get_titles_by_mids(self, mids):
-        titles = []
-        for mid in mids:
-            movie = self.db["movie"].find_one({"mid": mid})
-            if "title_full" in movie:
-                titles.append(movie["title_full"])
-            # else:
-            #     titles.append(movie["title"])
-        return titles
+        return self.get_movie_catalog().get_titles_full(mids)
 
     @classmethod
     def get_imdbids_by_mids(self, mids):
-        imdbids = []
-        for mid in mids:
-            cur_movie = self.db["movie"].find_one({"mid": mid})
-            cur_imdbid_len = len(str(cur_movie["imdbid"]))
-            # Construct the real imdbid
-            cur_imdbid = "tt"
-            for i in range(7 - cur_imdbid_len):
-                cur_imdbid += "0"
-            cur_imdbid += str(cur_movie["imdbid"])
-            imdbids.append(cur_imdbid)
-        return imdbids
+        return self.get_movie_catalog().get_imdbids(mids)
+
+    # load the movie catalog on first use, then keep it resident
+    @classmethod
+    def get_movie_catalog(self):
+        if MovieRecommend.movie_catalog is None:
+            MovieRecommend.movie_catalog = MovieCatalog(self.db)
+        return MovieRecommend.movie_catalog
 
     @classmethod
     def get_actors_from_profile(self, profile, integrated=False):
-        # get all actors from database
-        actors_pool = set()
+        # get all actors from the process-wide cache (built from database once)
         if not integrated:
-            cursor = self.db["actors_list"].find({})
-            for cur_actor in cursor:
-                cur_name = cur_actor["actor"]
-                actors_pool.add(cur_name)
+            actors_pool = VocabularyCache.get(self.mongo, "actors")
         else:
-            cursor = self.db_integration["peoples_name_only"].find({})
-            for cur_doc in cursor:
-                for cur_name in cur_doc["names"]:
-                    actors_pool.add(cur_name)
+            actors_pool = VocabularyCache.get(self.mongo, "peoples")
         print("[MovieRecommend] Built up actors pool, size: " + str(len(actors_pool)))
 
         # gain all mentioned actors and the frequency
@@ -92,40 +111,26 @@ class MovieRecommend(object):
         return mentioned_tags
 
     @classmethod
-    def get_tags_from_tweets(self, profile, tags_pool):
-        # gain all mentioned tags and the frequency
+    def get_tags_from_tweets(self, profile, tags_matcher):
+        # gain all mentioned tags (1-3 words) and the frequency, one scan per tweet
         mentioned_tags = {}
         for tweet in profile["extracted_tweets"]:
             # print(tweet.encode("utf8"))
-            words = self.textAnalytics.get_words_from_tweet(tweet)
-            for word in words:
-                if word in tags_pool:
-                    if word not in mentioned_tags:
-                        mentioned_tags[word] = 1
-                    else:
-                        mentioned_tags[word] += 1
+            tags_matcher.count_tweet(tweet, mentioned_tags)
 
         print("[MovieRecommend] Found " + str(len(mentioned_tags)) + " tags from tweets.")
         return mentioned_tags
 
     @classmethod
     def get_tags_from_profile(self, profile, normalized=False):
-        # get all tags from database
-        tags_pool = set()
-        if not normalized:
-            cursor = self.db["tag"].find({})
-            for cur_tag in cursor:
-                cur_content = cur_tag["content"]
-                tags_pool.add(cur_content)
-        else:
-            cursor = self.db_integration["normalized_tags"].find({})
-            for cur_tag in cursor:
-                cur_content = cur_tag["tag"]
-                tags_pool.add(cur_content)
+        # get all tags from the process-wide cache (built from database once)
+        pool_name = "normalized_tags" if normalized else "tags"
+        tags_pool = VocabularyCache.get(self.mongo, pool_name)
+        tags_matcher = VocabularyCache.get_matcher(self.mongo, pool_name)
         print("[MovieRecommend] Built up tags pool, size: " + str(len(tags_pool)))
 
         tags_from_hashtags = self.get_tags_from_hashtags(profile, tags_pool)
-        tags_from_tweets = self.get_tags_from_tweets(profile, tags_pool)
+        tags_from_tweets = self.get_tags_from_tweets(profile, tags_matcher)
 
         # combine two tags dicts
         tags_dict = tags_from_hashtags
@@ -161,11 +166,18 @@ class MovieRecommend(object):
                 return []
 
         print("[MovieRecommend] Profile retrieved.")
+        key = make_key("twitter", [], screen_name, self.get_profile_version(profile))
+        recommends = RecommendCache.get(key)
+        if recommends is not None:
+            print("[MovieRecommend] Cached recommendations for Twitter.")
+            return recommends
+
         actors = self.get_actors_from_profile(profile)
         tags = self.get_tags_from_profile(profile)
 
         # Combine actors and tags to recommend
         recommends = self.recommend_movies_combined(actors, tags)
+        RecommendCache.put(key, recommends)
         print("[MovieRecommend] Earned recommendations for Twitter.")
         return recommends
 
@@ -182,14 +194,26 @@ class MovieRecommend(object):
                 return []
 
         print("[MovieRecommend] Profile retrieved.")
+        key = make_key("twitter_integrated", [], screen_name, self.get_profile_version(profile))
+        recommends = RecommendCache.get(key)
+        if recommends is not None:
+            print("[MovieRecommend] Cached recommendations for Twitter.")
+            return recommends
+
         actors = self.get_actors_from_profile(profile, integrated=True)
         tags = self.get_tags_from_profile(profile, normalized=True)
 
         # Combine actors and tags to recommend
         recommends = self.recommend_movies_combined_integrated(actors, tags)
+        RecommendCache.put(key, recommends)
         print("[MovieRecommend] Earned recommendations for Twitter.")
         return recommends
 
+    # a profile extracted again, or grown by new tweets, gets a new version
+    @classmethod
+    def get_profile_version(self, profile):
+        return (str(profile.get("_id")), profile.get("statuses_count"), len(profile.get("extracted_tweets", [])))
+
     @classmethod
     def recommend_movies_combined(self, actors, tags):
         movies_score = {}
@@ -198,12 +222,10 @@ class MovieRecommend(object):
         for tag in tags.keys():
             cur_tag = self.db["tag"].find_one({"content": tag})
             cur_popular = cur_tag["popular"]
-            cur_movies = cur_tag["relevant_movie"]
-            for relevance_pair in cur_movies:
-                attrs = relevance_pair.split(",")
-                mid = int(attrs[0])
+            cur_mids, cur_scores = tagRelevance.get_relevant_movies(cur_tag)
+            for mid, cur_score in zip(cur_mids.tolist(), cur_scores.tolist()):
                 # consider also the frequency
-                relevance = float(attrs[1]) * (1 + math.log(tags[tag], 3))
+                relevance = cur_score * (1 + math.log(tags[tag], 3))
                 score = self.weight_tf_idf(relevance, cur_popular, total_movies_num, 2)
                 if mid not in movies_score:
                     movies_score[mid] = score
@@ -233,52 +255,82 @@ class MovieRecommend(object):
 
     @classmethod
     def recommend_movies_combined_integrated(self, actors, tags):
-        movies_score = {}
-
         total_movies_num = 121479   # num of movies with tags (real)
+        total_actors_num = 3031430
+
+        index = self.get_integration_index()
+        if index is not None:
+            # every posting of a term gets the same tf-idf factor, so weight the terms once
+            query = []
+            for tag in tags.keys():
+                cur_popularity = index.get_popularity("tags", tag)
+                if cur_popularity is not None:
+                    query.append(("tags", tag, self.weight_tf_idf(math.sqrt(tags[tag]), cur_popularity, total_movies_num, 3)))
+            for actor in actors.keys():
+                cur_popularity = index.get_popularity("peoples", actor)
+                if cur_popularity is not None:
+                    query.append(("peoples", actor, self.weight_tf_idf(math.sqrt(actors[actor]), cur_popularity, total_actors_num, 4) * 1.3))
+            return self.gain_top_k_from_index(index, query, 20)
+
+        movies_score = {}
         for tag in tags.keys():
             cur_tag = self.db_integration["normalized_tags"].find_one({"tag": tag})
             cur_popularity = cur_tag["popularity"]
             cur_movies = cur_tag["movies"]
             cur_scores = cur_tag["scores"]
             for pos in range(len(cur_movies)):
-                cur_movie_title = cur_movies[pos]
+                cur_movie_id = cur_movies[pos]
                 cur_movie_score = cur_scores[pos]
                 # consider also the frequency
                 # relevance = cur_movie_score * (1 + math.log(tags[tag], 3))
                 relevance = cur_movie_score * math.sqrt(tags[tag])
                 score = self.weight_tf_idf(relevance, cur_popularity, total_movies_num, 3)
-                if cur_movie_title not in movies_score:
-                    movies_score[cur_movie_title] = score
+                if cur_movie_id not in movies_score:
+                    movies_score[cur_movie_id] = score
                 else:
-                    movies_score[cur_movie_title] += score
+                    movies_score[cur_movie_id] += score
 
-        total_actors_num = 3031430
         for actor in actors.keys():
             cur_actor = self.db_integration["peoples"].find_one({"people": actor})
             cur_popularity = cur_actor["popularity"]
             cur_movies = cur_actor["movies"]
-            for cur_movie in cur_movies:
-                cur_movie_title = cur_movie
+            for cur_movie_id in cur_movies:
                 # consider also the frequency
                 # relevance = 1 + math.log(actors[actor], 3)
                 relevance = math.sqrt(actors[actor])
                 score = self.weight_tf_idf(relevance, cur_popularity, total_actors_num, 4) * 1.3
-                if cur_movie_title not in movies_score:
-                    movies_score[cur_movie_title] = score
+                if cur_movie_id not in movies_score:
+                    movies_score[cur_movie_id] = score
                 else:
-                    movies_score[cur_movie_title] += score
+                    movies_score[cur_movie_id] += score
 
         print("[MovieRecommend] Found " + str(len(movies_score)) + " candidate movies.")
-        # put all candidates to compete, gain top-k
-        recommend = self.gain_top_k(movies_score, 20)
+        # put all candidates to compete, gain top-k, then resolve their titles
+        recommend = self.get_movie_ids().get_titles(self.gain_top_k(movies_score, 20))
         return recommend
 
     @classmethod
     def recommend_movies_based_on_tags_integrated(self, tags):
-        movies_score = {}
-
         total_movies_num = 121479   # num of movies with tags (real)
+
+        key = make_key("tags_integrated", tags)
+        recommend = RecommendCache.get(key)
+        if recommend is not None:
+            print("[MovieRecommend] Cached recommendations for tags.")
+            return recommend
+
+        index = self.get_integration_index()
+        if index is not None:
+            query = []
+            for tag in tags:
+                cur_popularity = index.get_popularity("tags", tag)
+                if cur_popularity is not None:
+                    query.append(("tags", tag, self.weight_tf_idf(1, cur_popularity, total_movies_num, 2)))
+            recommend = self.gain_top_k_from_index(index, query, 20)
+            RecommendCache.put(key, recommend)
+            return recommend
+
+        movies_score = {}
         for tag in tags:
             cur_tag = self.db_integration["normalized_tags"].find_one({"tag": tag})
             if cur_tag is None:
@@ -287,18 +339,19 @@ class MovieRecommend(object):
             cur_movies = cur_tag["movies"]
             cur_scores = cur_tag["scores"]
             for pos in range(len(cur_movies)):
-                cur_movie_title = cur_movies[pos]
+                cur_movie_id = cur_movies[pos]
                 cur_movie_score = cur_scores[pos]
                 relevance = cur_movie_score
                 score = self.weight_tf_idf(relevance, cur_popularity, total_movies_num, 2)
-                if cur_movie_title not in movies_score:
-                    movies_score[cur_movie_title] = score
+                if cur_movie_id not in movies_score:
+                    movies_score[cur_movie_id] = score
                 else:
-                    movies_score[cur_movie_title] += score
+                    movies_score[cur_movie_id] += score
 
         print("[MovieRecommend] Found " + str(len(movies_score)) + " candidate movies.")
-        # put all candidates to compete, gain top-k
-        recommend = self.gain_top_k(movies_score, 20)
+        # put all candidates to compete, gain top-k, then resolve their titles
+        recommend = self.get_movie_ids().get_titles(self.gain_top_k(movies_score, 20))
+        RecommendCache.put(key, recommend)
         return recommend
 
     # generate up to 10 movies recommendations given a movie id
@@ -307,6 +360,10 @@ class MovieRecommend(object):
     @classmethod
     def recommend_movies_for_movie(self, mid):
         print("[MovieRecommend] Target movie id: " + str(mid))
+        most_similar_movies = self.get_similar_movies_from_index(mid, 20)
+        if most_similar_movies is not None:
+            print("[MovieRecommend] Similar movies found in index.")
+            return most_similar_movies
         target_movie = self.db["movie"].find_one({"mid": mid})
         if "similar_movies" in target_movie:
             print("[MovieRecommend] Similar movies calculated.")
@@ -314,17 +371,13 @@ class MovieRecommend(object):
         else:
             print("[MovieRecommend] Similar movies not calculated.")
             target_mid = mid
-            if "tags" not in target_movie:
+            if not tagRelevance.has_movie_tags(target_movie):
                 print("[MovieRecommend] No tagging info found, use genres-based recommendation.")
                 target_genres = target_movie["genres"]
                 most_similar_movies = self.recommend_movies_based_on_genres(target_genres, target_mid)
             else:
                 print("[MovieRecommend] Tagging info found, now start calculating...")
-                target_tags_score = target_movie["tags"]
-                target_tags = set()
-                for tag_score in target_tags_score:
-                    attrs = tag_score.split(",")
-                    target_tags.add(int(attrs[0]))
+                target_tags = set(tagRelevance.get_movie_tags(target_movie)[0].tolist())
                 most_similar_movies = self.recommend_movies_based_on_tags(target_tags, target_mid)
 
             print("[MovieRecommend] Calculation complete.")
@@ -342,63 +395,34 @@ class MovieRecommend(object):
     @classmethod
     def recommend_movies_for_movie_cs(self, mid):
         print("[MovieRecommend] Target movie id: " + str(mid))
+        most_similar_movies = self.get_similar_movies_from_index(mid, 10)
+        if most_similar_movies is not None:
+            print("[MovieRecommend] Similar movies found in index.")
+            return most_similar_movies
         target_movie = self.db["movie"].find_one({"mid": mid})
         if "similar_movies" in target_movie:
             print("[MovieRecommend] Similar movies calculated.")
             most_similar_movies = target_movie["similar_movies"]
         else:
             print("[MovieRecommend] Similar movies not calculated.")
-            if "tags" not in target_movie:
+            if not tagRelevance.has_movie_tags(target_movie):
                 print("[MovieRecommend] No tagging info found, unable to recommend.")
                 return []
             print("[MovieRecommend] Tagging info found, now start calculating...")
             target_mid = mid
-            target_tags_score = target_movie["tags"]
-            target_tags = set()
-            for tag_score in target_tags_score:
-                attrs = tag_score.split(",")
-                target_tags.add(int(attrs[0]))
+            target_tags = set(tagRelevance.get_movie_tags(target_movie)[0].tolist())
 
             progressInterval = 2000   # How often should we print a progress report to the console?
             progressTotal = 34028     # Approximate number of total users
-            count = 0                 # Counter for progress
 
             # Scan through all movies in database and calculate similarity
             startTime = time.time()
-            # maintain a min heap for top k candidates
-            candidates = queue.PriorityQueue()
             cursor = self.db["movie"].find({})
-            for cur_movie in cursor:
-                count += 1
-                if count % progressInterval == 0:
-                    print("[MovieRecommend] %6d movies processed so far. (%d%%) (%0.2fs)" % ((count, int(count * 100 / progressTotal), time.time() - startTime)))
-
-                # skip non-tagged movie
-                if "tags" not in cur_movie:
-                    continue
-
-                cur_id = cur_movie["mid"]
-                if cur_id == target_mid:
-                    continue
-
-                cur_tags_score = cur_movie["tags"]
-                cur_tags = set()
-                for tag_score in cur_tags_score:
-                    attrs = tag_score.split(",")
-                    cur_tags.add(int(attrs[0]))
-
-                cur_similarity = self.cosine_similarity(cur_tags, target_tags)
-                candidates.put(Candidate(cur_id, cur_similarity))
-                # maintain the pool size
-                if candidates.qsize() > 10:
-                    candidates.get()
-
-            # now print out and return top 10 candidates
+            similarities = self.similarity_pairs(cursor, target_mid, target_tags, progressInterval, progressTotal, startTime)
+            # keep the top 10 candidates in a bounded heap
             most_similar_movies = []
-            while not candidates.empty():
-                cur_movie = candidates.get()
-                most_similar_movies.append(cur_movie.cid)
-                # print("[MovieRecommend] uid: " + str(cur_movie.cid) + ", score: " + str(cur_movie.score))
+            for cid, score in topK.top_k_stream(similarities, 10):
+                most_similar_movies.append(cid)
             print("[MovieRecommend] Calculation complete.")
             self.db["movie"].update_one({"mid": target_mid}, {"$set": {"similar_movies": most_similar_movies}}, True)
             print("[MovieRecommend] Stored similar movies into DB.")
@@ -406,12 +430,54 @@ class MovieRecommend(object):
         # self.print_recommend(most_similar_movies)
         return most_similar_movies
 
+    # look up the precomputed tag genome neighbours (see movieSimilarity.py)
+    # return None when the index is not built or doesn't know the movie
+    @classmethod
+    def get_similar_movies_from_index(self, mid, k):
+        if MovieRecommend.similarity_index is False:
+            MovieRecommend.similarity_index = SimilarityIndex.load()
+        if MovieRecommend.similarity_index is None:
+            return None
+        return MovieRecommend.similarity_index.get_similar_movies(mid, k)
+
+    # yield (mid, cosine similarity) of every tagged movie against the target tags
+    @classmethod
+    def similarity_pairs(self, cursor, target_mid, target_tags, progressInterval, progressTotal, startTime):
+        count = 0
+        for cur_movie in cursor:
+            count += 1
+            if count % progressInterval == 0:
+                print("[MovieRecommend] %6d movies processed so far. (%d%%) (%0.2fs)" % ((count, int(count * 100 / progressTotal), time.time() - startTime)))
+
+            # skip non-tagged movie
+            if not tagRelevance.has_movie_tags(cur_movie):
+                continue
+
+            cur_id = cur_movie["mid"]
+            if cur_id == target_mid:
+                continue
+
+            cur_tags = set(tagRelevance.get_movie_tags(cur_movie)[0].tolist())
+
+            yield cur_id, self.cosine_similarity(cur_tags, target_tags)
+
     # generate up to 20 movies recommendations given a list of tags
     # the core idea is tf.idf weight (content-based query)
     @classmethod
     def recommend_movies_based_on_tags(self, tags, target_mid=0, tagid=True):
         # print("[MovieRecommend] Target tags: " + str(tags))
         total_movies_num = 9734
+
+        index = self.get_genome_index()
+        if index is not None:
+            # tags are indexed by tid and by content
+            query = []
+            for tag in tags:
+                cur_popular = index.get_popularity("tags", tag)
+                if cur_popular is not None:
+                    query.append(("tags", tag, self.weight_tf_idf(1, cur_popular, total_movies_num, 2)))
+            return self.gain_top_k_from_index(index, query, 20, target_mid)
+
         movies_score = {}
         for tag in tags:
             if tagid:
@@ -419,13 +485,10 @@ class MovieRecommend(object):
             else:
                 cur_tag = self.db["tag"].find_one({"content": tag})
             cur_popular = cur_tag["popular"]
-            cur_movies = cur_tag["relevant_movie"]
-            for relevance_pair in cur_movies:
-                attrs = relevance_pair.split(",")
-                mid = int(attrs[0])
+            cur_mids, cur_scores = tagRelevance.get_relevant_movies(cur_tag)
+            for mid, relevance in zip(cur_mids.tolist(), cur_scores.tolist()):
                 if target_mid == mid:
                     continue
-                relevance = float(attrs[1])
                 score = self.weight_tf_idf(relevance, cur_popular, total_movies_num, 2)
                 if mid not in movies_score:
                     movies_score[mid] = score
@@ -471,46 +534,79 @@ class MovieRecommend(object):
     # gain top-k candidates given a dictionary storing their scores
     @classmethod
     def gain_top_k(self, candidates, k):
-        candidates_pool = queue.PriorityQueue()
-        for cid in candidates:
-            candidates_pool.put(Candidate(cid, candidates[cid]))
-            # maintain the size
-            if candidates_pool.qsize() > k:
-                candidates_pool.get()
+        top_k = []
+        for cid, score in topK.top_k_dict(candidates, k):
+            top_k.append(cid)
+            print("[MovieRecommend] Candidate id: " + str(cid) + ", score: " + str(score))
+        return top_k
 
+    # gain top-k movies (imdb titles or mids) for a (field, term, weight) query on an inverted index
+    @classmethod
+    def gain_top_k_from_index(self, index, query, k, target_mid=None):
+        movies, scores, stats = index.search(query, k, target_mid)
+        print("[MovieRecommend] Scored %d candidate movies, read %d of %d postings." % stats)
         top_k = []
-        while not candidates_pool.empty():
-            cur_candidate = candidates_pool.get()
-            top_k.append(cur_candidate.cid)
-            print("[MovieRecommend] Candidate id: " + str(cur_candidate.cid) + ", score: " + str(cur_candidate.score))
-        top_k.reverse()
+        for movie, score in zip(movies.tolist(), scores.tolist()):
+            top_k.append(index.get_key(movie))
+            print("[MovieRecommend] Candidate id: " + str(index.get_key(movie)) + ", score: " + str(score))
         return top_k
 
+    # load the integration inverted index on first use, None if it was never built
+    @classmethod
+    def get_integration_index(self):
+        if MovieRecommend.integration_index is False:
+            MovieRecommend.integration_index = InvertedIndex.load("integration")
+        return MovieRecommend.integration_index
+
+    # load the integration movie id dictionary on first use
+    @classmethod
+    def get_movie_ids(self):
+        if MovieRecommend.movie_ids is None:
+            MovieRecommend.movie_ids = MovieIds(self.db_integration)
+        return MovieRecommend.movie_ids
+
+    # load the genome tags inverted index on first use, None if it was never built
+    @classmethod
+    def get_genome_index(self):
+        if MovieRecommend.genome_index is False:
+            MovieRecommend.genome_index = InvertedIndex.load("genome")
+        return MovieRecommend.genome_index
+
     # given a list of recommendation movie ids, print out the movies information
     @classmethod
     def print_recommend(self, recommend):
         if len(recommend) == 0:
             return
         print("[MovieRecommend] - Recommend movies: -")
+        catalog = self.get_movie_catalog()
+        catalog.fetch_missing(recommend)
         for movie_id in recommend:
-            movie_data = self.db["movie"].find_one({"mid": movie_id})
+            movie_data = catalog.get_movie(movie_id)
             print("[MovieRecommend] imdbid: %7d, %s" % (movie_data["imdbid"],movie_data["title"].encode("utf8")))
         print("[MovieRecommend] - Recommend end. -")
 
     # generate up to 20 movies recommendations given a list of movie names
     # the core idea is collaborative filtering (comparing movie occurrences)
+    # neighbours: HistoryNeighbours kept up to date with the same history (see get_history_neighbours())
     @classmethod
-    def recommend_movies_based_on_history(self, movies):
+    def recommend_movies_based_on_history(self, movies, neighbours=None):
         # convert imdb titles into mids
-        target_history = set()
-        for movie in movies:
-            cur_movie = self.db["movie"].find_one({"title_full": movie})
-            if cur_movie is None:
-                continue
-            target_history.add(cur_movie["mid"])
+        target_history = set(self.get_movie_catalog().get_mids_by_titles(movies))
+        if MovieRecommend.history_engine == "items" and self.get_cooccurrence_index() is not None:
+            return self.recommend_movies_based_on_history_items(target_history)
+        if MovieRecommend.history_engine == "factors" and self.get_factor_model() is not None:
+            return self.recommend_movies_based_on_history_factors(target_history)
+        key = make_key("history", target_history)
+        recommend = RecommendCache.get(key)
+        if recommend is not None:
+            print("[MovieRecommend] Cached recommendations for history.")
+            return recommend
 
         print("[MovieRecommend] Start retrieve similar users...")
-        most_similar_users = self.get_similar_users_by_history(target_history)
+        if neighbours is not None and neighbours.history == target_history:
+            most_similar_users = self.get_similar_users_by_neighbours(neighbours)
+        else:
+            most_similar_users = self.get_similar_users_by_history(target_history)
         if len(most_similar_users) == 0:
             print("[MovieRecommend] Recommend failed due to insufficient history.")
             return []
@@ -518,25 +614,53 @@ class MovieRecommend(object):
         print("[MovieRecommend] Similar users retrieved.")
         print("[MovieRecommend] Start generating recommend movies...")
 
-        movies_count = {}
-        for cur_user_id in most_similar_users:
-            cur_user = self.db["user_rate"].find_one({"uid": cur_user_id})
-            for rating in cur_user["ratings"]:
-                # if user like this movie
-                if rating[1] >= 3.5:
-                    # and the movie is not in target history
-                    if rating[0] not in target_history:
-                        # count occurrences
-                        if rating[0] not in movies_count:
-                            movies_count[rating[0]] = 1
-                        else:
-                            movies_count[rating[0]] += 1
+        # count occurrences of the movies liked by similar users but not in target history
+        movies_count = self.get_user_matrix().count_likes(most_similar_users, target_history)
 
         # put all occurrences in to heap to gain top-k
         recommend = self.gain_top_k(movies_count, 20)
+        RecommendCache.put(key, recommend)
         # self.print_recommend(recommend)
         return recommend
 
+    # generate up to 20 movies recommendations given a set of mids
+    # the core idea is item-based collaborative filtering (summing co-occurrence neighbours)
+    @classmethod
+    def recommend_movies_based_on_history_items(self, target_history):
+        key = make_key("history_items", target_history)
+        recommend = RecommendCache.get(key)
+        if recommend is not None:
+            print("[MovieRecommend] Cached recommendations for history.")
+            return recommend
+        index = self.get_cooccurrence_index()
+        if index is None:
+            print("[MovieRecommend] Co-occurrence model not built, unable to recommend.")
+            return []
+        startTime = time.time()
+        recommend = index.recommend(target_history, 20)
+        print("[MovieRecommend] Summed neighbours of %d movies (%0.4fs)" % (len(target_history), time.time() - startTime))
+        RecommendCache.put(key, recommend)
+        return recommend
+
+    # generate up to 20 movies recommendations given a set of mids
+    # the core idea is matrix factorization (history folded in against the ALS movie factors)
+    @classmethod
+    def recommend_movies_based_on_history_factors(self, target_history):
+        key = make_key("history_factors", target_history)
+        recommend = RecommendCache.get(key)
+        if recommend is not None:
+            print("[MovieRecommend] Cached recommendations for history.")
+            return recommend
+        model = self.get_factor_model()
+        if model is None:
+            print("[MovieRecommend] Factor model not trained, unable to recommend.")
+            return []
+        startTime = time.time()
+        recommend = model.recommend(target_history, 20)
+        print("[MovieRecommend] Folded in %d movies (%0.4fs)" % (len(target_history), time.time() - startTime))
+        RecommendCache.put(key, recommend)
+        return recommend
+
     # generate up to 20 movies recommendations given an User ID
     # the core idea is collaborative filtering (comparing movie occurrences)
     @classmethod
@@ -558,23 +682,11 @@ class MovieRecommend(object):
         print("[MovieRecommend] Similar users retrieved.")
         print("[MovieRecommend] Start generating recommend movies...")
         # gain target user history
-        target_history = set()
-        for rating in target_user["ratings"]:
-            target_history.add(rating[0])
-
-        movies_count = {}
-        for cur_user_id in most_similar_users:
-            cur_user = self.db["user_rate"].find_one({"uid": cur_user_id})
-            for rating in cur_user["ratings"]:
-                # if user like this movie
-                if rating[1] >= 3.5:
-                    # and the movie is not rated by target user
-                    if rating[0] not in target_history:
-                        # count occurrences
-                        if rating[0] not in movies_count:
-                            movies_count[rating[0]] = 1
-                        else:
-                            movies_count[rating[0]] += 1
+        target_mids, target_ratings = get_user_ratings(target_user)
+        target_history = set(target_mids.tolist())
+
+        # count occurrences of the movies liked by similar users but not rated by target user
+        movies_count = self.get_user_matrix().count_likes(most_similar_users, target_history)
 
         # put all occurrences in to heap to gain top-k
         recommend = self.gain_top_k(movies_count, 20)
@@ -588,10 +700,8 @@ class MovieRecommend(object):
         print("[MovieRecommend] Start retrieving similar users...")
         target_user = self.db["user_rate"].find_one({"uid": userID})
         target_id = userID
-        target_like = set()
-        for rating in target_user["ratings"]:
-            if rating[1] >= 3.5:
-                target_like.add(rating[0])
+        target_mids, target_ratings = get_user_ratings(target_user)
+        target_like = set(target_mids[target_ratings >= 3.5].tolist())
 
         most_similar_users = self.get_similar_users_by_history(target_like, target_id)
         if len(most_similar_users) > 0:
@@ -609,46 +719,71 @@ class MovieRecommend(object):
             return []
         print("[MovieRecommend] Sufficient history: " + str(len(target_like))+ ", now start calculating...")
 
-        progressInterval = 10000  # How often should we print a progress report to the console?
-        progressTotal = 247753    # Approximate number of total users
-        count = 0                 # Counter for progress
-
-        # Scan through all users in database and calculate similarity
         startTime = time.time()
-        # maintain a min heap for top k candidates
-        candidates = queue.PriorityQueue()
-        cursor = self.db["user_rate"].find({})
-        for cur_user in cursor:
-            count += 1
-            if count % progressInterval == 0:
-                print("[MovieRecommend] %6d users processed so far. (%d%%) (%0.2fs)" % ((count, int(count * 100 / progressTotal), time.time() - startTime)))
+        index = self.get_user_lsh() if MovieRecommend.similar_users_mode == "lsh" else None
+        if index is not None:
+            # only the users sharing a bucket with the history are scored
+            most_similar_users = index.get_similar_users(target_like, 20, target_id)
+        else:
+            # score the history against every user in one pass over the likes matrix
+            most_similar_users = self.get_user_matrix().get_similar_users(target_like, 20, target_id)
+        print("[MovieRecommend] Calculation complete (%0.2fs)" % (time.time() - startTime))
+        return most_similar_users
 
-            cur_id = cur_user["uid"]
-            if cur_id == target_id:
-                continue
+    # incremental similar users of a history edited one movie at a time
+    # keep it updated with update_history_neighbours(), then pass it to recommend_movies_based_on_history()
+    @classmethod
+    def get_history_neighbours(self, movies=()):
+        return HistoryNeighbours(self.get_user_matrix(), self.get_movie_catalog().get_mids_by_titles(movies))
 
-            cur_like = set()
-            for rating in cur_user["ratings"]:
-                if rating[1] >= 3.5:
-                    cur_like.add(rating[0])
-            if len(cur_like) < 5:
-                continue
-            cur_similarity = self.cosine_similarity(cur_like, target_like)
-            candidates.put(Candidate(cur_id, cur_similarity))
-            # maintain the pool size
-            if candidates.qsize() > 20:
-                candidates.get()
-
-        # now print out and return top 20 candidates
-        most_similar_users = []
-        while not candidates.empty():
-            cur_user = candidates.get()
-            most_similar_users.append(cur_user.cid)
-            # print("[MovieRecommend] uid: " + str(cur_user.cid) + ", score: " + str(cur_user.score))
-        print("[MovieRecommend] Calculation complete (%0.2fs)" % (time.time() - startTime))
-        most_similar_users.reverse()
+    # apply added and removed movie names to the neighbours of a history
+    @classmethod
+    def update_history_neighbours(self, neighbours, added=(), removed=()):
+        catalog = self.get_movie_catalog()
+        for mid in catalog.get_mids_by_titles(removed):
+            neighbours.remove(mid)
+        for mid in catalog.get_mids_by_titles(added):
+            neighbours.add(mid)
+
+    # return top-20 similar users of an incrementally maintained history
+    @classmethod
+    def get_similar_users_by_neighbours(self, neighbours, target_id=0):
+        if len(neighbours.history) < 5:
+            print("[MovieRecommend] Not enough rating history: " + str(len(neighbours.history)) + ".")
+            return []
+        startTime = time.time()
+        most_similar_users = neighbours.get_similar_users(20, target_id)
+        print("[MovieRecommend] Similar users updated (%0.2fs)" % (time.time() - startTime))
         return most_similar_users
 
+    # load the user x movie matrix on first use, then keep it resident
+    @classmethod
+    def get_user_matrix(self):
+        if MovieRecommend.user_matrix is None:
+            MovieRecommend.user_matrix = UserMatrix.load(self.mongo)
+        return MovieRecommend.user_matrix
+
+    # load the co-occurrence model on first use, None if it was never built
+    @classmethod
+    def get_cooccurrence_index(self):
+        if MovieRecommend.cooccurrence_index is False:
+            MovieRecommend.cooccurrence_index = CooccurrenceIndex.load()
+        return MovieRecommend.cooccurrence_index
+
+    # load the ALS factor model on first use, None if it was never trained
+    @classmethod
+    def get_factor_model(self):
+        if MovieRecommend.factor_model is False:
+            MovieRecommend.factor_model = FactorModel.load()
+        return MovieRecommend.factor_model
+
+    # load the user LSH index on first use, None if the signatures were never built
+    @classmethod
+    def get_user_lsh(self):
+        if MovieRecommend.user_lsh is False:
+            MovieRecommend.user_lsh = UserLSHIndex.load(self.get_user_matrix())
+        return MovieRecommend.user_lsh
+
     @classmethod
     def cosine_similarity(self, set1, set2):
         match_count = self.count_match(set1, set2)
@@ -662,15 +797,6 @@ class MovieRecommend(object):
                 count += 1
         return count
 
-class Candidate(object):
-    def __init__(self, cid, score):
-        self.cid = cid
-        self.score = score
-
-    # less than interface, __cmp__ is gone in Python 3.4?
-    def __lt__(self, other):
-        return self.score < other.score
-
 
 def main():
     recommender = MovieRecommend(Mongo("movieRecommend"))
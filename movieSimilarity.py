@@ -0,0 +1,143 @@
+import os
+import time
+import csv
+import numpy
+import recommendCache
+
+# Offline item-item similarity index over the MovieLens tag genome.
+# Every genome movie is a vector of its 1128 tag relevance scores (tag_relevance.dat),
+# and similarity is the cosine between these vectors, computed as a blocked matrix product.
+# Only the top-N neighbours per movie are kept, in indexdata/:
+#       -similar_movies_mids.npy        genome movie ids, sorted (int32)
+#       -similar_movies_rows.npy        mid -> row in the index, -1 if absent (int32)
+#       -similar_movies_neighbours.npy  row -> top-N neighbour mids, most similar first (int32)
+#       -similar_movies_scores.npy      row -> top-N cosine similarities (float32)
+# The recommender memory-maps these files, a lookup is two array reads.
+
+INDEX_DIR = "indexdata"
+INDEX_NAME = "similar_movies"
+NEIGHBOURS = 50
+BLOCK_SIZE = 1024
+
+# read the dense movie x tag relevance matrix from the genome file
+def load_genome(path="movielensdata/tag_relevance.dat"):
+    progressInterval = 1000000 # How often should we print a progress report to the console?
+    progressTotal = 10979952   # Approximate number of total lines in the file.
+    count = 0
+
+    print("[movieSimilarity] Loading genome from " + path)
+    startTime = time.time()
+
+    mids = []
+    tid_columns = {}
+    rows = []
+    cur_row = None
+    prev_mid = -1
+    inCSV = open(path, "r", encoding = "utf8")
+    for line in csv.reader(inCSV, delimiter = "\t"):
+        count += 1
+        if count % progressInterval == 0:
+            print("[movieSimilarity] %8d lines processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
+
+        mid = int(line[0])
+        tid = int(line[1])
+        if mid != prev_mid:
+            cur_row = {}
+            rows.append(cur_row)
+            mids.append(mid)
+            prev_mid = mid
+        if tid not in tid_columns:
+            tid_columns[tid] = len(tid_columns)
+        cur_row[tid_columns[tid]] = float(line[2])
+    inCSV.close()
+
+    genome = numpy.zeros((len(mids), len(tid_columns)), dtype=numpy.float32)
+    for i in range(len(rows)):
+        columns = numpy.fromiter(rows[i].keys(), dtype=numpy.int64)
+        genome[i, columns] = numpy.fromiter(rows[i].values(), dtype=numpy.float32)
+
+    print("[movieSimilarity] Loaded %d movies x %d tags (%0.2fs)" % (genome.shape[0], genome.shape[1], time.time() - startTime))
+    return numpy.asarray(mids, dtype=numpy.int32), genome
+
+# top-n cosine neighbours of every row, one block of rows at a time
+def compute_neighbours(genome, n=NEIGHBOURS, block_size=BLOCK_SIZE):
+    norms = numpy.linalg.norm(genome, axis=1)
+    norms[norms == 0] = 1
+    unit = genome / norms[:, None]
+
+    total = unit.shape[0]
+    n = min(n, total - 1)
+    neighbours = numpy.zeros((total, n), dtype=numpy.int32)
+    scores = numpy.zeros((total, n), dtype=numpy.float32)
+    startTime = time.time()
+    for start in range(0, total, block_size):
+        end = min(start + block_size, total)
+        block = unit[start:end].dot(unit.T)
+        # a movie is never its own neighbour
+        block[numpy.arange(end - start), numpy.arange(start, end)] = -numpy.inf
+        top = numpy.argpartition(-block, n - 1, axis=1)[:, :n]
+        top_scores = numpy.take_along_axis(block, top, axis=1)
+        order = numpy.argsort(-top_scores, axis=1, kind="stable")
+        neighbours[start:end] = numpy.take_along_axis(top, order, axis=1)
+        scores[start:end] = numpy.take_along_axis(top_scores, order, axis=1)
+        print("[movieSimilarity] %5d movies processed so far. (%d%%) (%0.2fs)" % (end, int(end * 100 / total), time.time() - startTime))
+    return neighbours, scores
+
+def index_path(name, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, INDEX_NAME + "_" + name + ".npy")
+
+# compute and store the whole similarity index
+def build(genome_path="movielensdata/tag_relevance.dat", index_dir=INDEX_DIR, n=NEIGHBOURS):
+    print("[movieSimilarity] Starting build of item-item similarity index...")
+    startTime = time.time()
+
+    mids, genome = load_genome(genome_path)
+    order = numpy.argsort(mids)
+    mids = mids[order]
+    genome = genome[order]
+    neighbours, scores = compute_neighbours(genome, n)
+
+    rows = numpy.full(int(mids.max()) + 1, -1, dtype=numpy.int32)
+    rows[mids] = numpy.arange(len(mids), dtype=numpy.int32)
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    numpy.save(index_path("mids", index_dir), mids)
+    numpy.save(index_path("rows", index_dir), rows)
+    numpy.save(index_path("neighbours", index_dir), mids[neighbours])
+    numpy.save(index_path("scores", index_dir), scores)
+    recommendCache.bump_data_version()
+    print("[movieSimilarity] Build Complete (%0.2fs)" % (time.time() - startTime))
+
+class SimilarityIndex(object):
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.rows = numpy.load(index_path("rows", index_dir), mmap_mode="r")
+        self.neighbours = numpy.load(index_path("neighbours", index_dir), mmap_mode="r")
+        self.scores = numpy.load(index_path("scores", index_dir), mmap_mode="r")
+
+    # None if the index was never built
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        if not os.path.isfile(index_path("neighbours", index_dir)):
+            return None
+        return cls(index_dir)
+
+    def __contains__(self, mid):
+        return 0 <= mid < len(self.rows) and self.rows[mid] >= 0
+
+    # up to k most similar movie ids, most similar first
+    def get_similar_movies(self, mid, k):
+        if mid not in self:
+            return None
+        return self.neighbours[self.rows[mid], :k].tolist()
+
+
+def main():
+    build()
+    index = SimilarityIndex.load()
+    # Toy Story (1995)
+    print(index.get_similar_movies(1, 10))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+from DataService import Mongo
+import pymongo
+import time
+import re
+
+# Typed numeric OMDb fields of the movie collection.
+# db name: movieRecommend
+# collection name: movie
+# OMDb returns every field as a string, with "N/A" for missing values. These ones are stored as numbers:
+#       -year           int     "1995", "2005–2010" (first year)
+#       -runtime        int     "81 min" (minutes)
+#       -metascore      int     "92"
+#       -imdb_rating    float   "8.3"
+#       -imdb_votes     int     "599,356"
+# and as null when OMDb has no value, so that a missing value is never compared with a number.
+# normalize() is applied by movieLensToIMDB when a movie is retrieved, and migrate() converts
+# the documents stored before. The parse functions also accept values that are already typed.
+
+NUMBER = re.compile(r"\d+(\.\d+)?")
+INDEXES = [
+    [("genres", pymongo.ASCENDING), ("imdb_rating", pymongo.DESCENDING)],
+    [("genres", pymongo.ASCENDING), ("imdb_votes", pymongo.DESCENDING)],
+    [("year", pymongo.ASCENDING), ("imdb_rating", pymongo.DESCENDING)],
+    [("year", pymongo.ASCENDING), ("imdb_votes", pymongo.DESCENDING)]
+    ]
+
+# first number of a raw OMDb value (commas removed), None for "N/A" and other non numbers
+def parse_number(value, number_type):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return number_type(value)
+    match = NUMBER.search(str(value).replace(",", ""))
+    if match is None:
+        return None
+    return number_type(float(match.group(0)))
+
+def parse_year(value):
+    return parse_number(value, int)
+
+def parse_runtime(value):
+    return parse_number(value, int)
+
+def parse_metascore(value):
+    return parse_number(value, int)
+
+def parse_rating(value):
+    return parse_number(value, float)
+
+def parse_votes(value):
+    return parse_number(value, int)
+
+PARSERS = {
+    "year": parse_year,
+    "runtime": parse_runtime,
+    "metascore": parse_metascore,
+    "imdb_rating": parse_rating,
+    "imdb_votes": parse_votes
+    }
+
+# typed values of the numeric fields of a movie document
+def normalize(movie):
+    typed = {}
+    for field, parser in PARSERS.items():
+        if field in movie:
+            typed[field] = parser(movie[field])
+    return typed
+
+def create_indexes(mongo):
+    for keys in INDEXES:
+        mongo.db["movie"].create_index(keys)
+    print("[omdbFields] Created %d compound indexes in movie" % len(INDEXES))
+
+# one-shot conversion of the movies stored with raw OMDb strings
+def migrate(mongo):
+    progressInterval = 5000    # How often should we print a progress report to the console?
+    progressTotal = 34208      # Approximate number of total movies.
+    bulkSize = 1000            # How many documents should we store in memory before inserting them into the database in bulk?
+    bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
+    bulkCount = 0
+    count = 0
+    updateCount = 0
+    skipCount = 0
+
+    print("[omdbFields] Starting migration of OMDb fields to numbers...")
+    startTime = time.time()
+
+    # only the movies with a field still stored as a string
+    query = {"$or": [{field: {"$type": "string"}} for field in PARSERS]}
+    cursor = mongo.db["movie"].find(query, dict((field, 1) for field in PARSERS), no_cursor_timeout=True)
+    for cur_movie in cursor:
+        count += 1
+        if count % progressInterval == 0:
+            print("[omdbFields] %5d movies processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
+
+        bulkPayload.find({"_id": cur_movie["_id"]}).update({"$set": normalize(cur_movie)})
+        bulkCount += 1
+        updateCount += 1
+        if bulkCount >= bulkSize:
+            try:
+                bulkPayload.execute()
+            except pymongo.errors.OperationFailure as e:
+                skipCount += len(e.details["writeErrors"])
+            bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
+            bulkCount = 0
+    cursor.close()
+    if bulkCount > 0:
+        try:
+            bulkPayload.execute()
+        except pymongo.errors.OperationFailure as e:
+            skipCount += len(e.details["writeErrors"])
+
+    create_indexes(mongo)
+    print("[omdbFields] Migration Complete (%0.2fs)" % (time.time() - startTime))
+    print("[omdbFields] Converted " + str(updateCount) + " movies.")
+    print("[omdbFields] Skipped " + str(skipCount) + " updates.")
+
+
+def main():
+    mongo = Mongo("movieRecommend")
+    migrate(mongo)
+
+if __name__ == "__main__":
+    main()
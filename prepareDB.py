@@ -1,319 +1,216 @@
-import queue
 import pymongo
-import threading
+import multiprocessing
 import time
+import sys
+import os
 from DataService import Mongo
 from movieRecommend import MovieRecommend
-from movieRecommend import Candidate
+import topK
 import movieLensParser
+import movieSimilarity
+import invertedIndex
+import userSimilarity
+import movieCooccurrence
+import movieFactors
+import movieRankings
+import omdbFields
+from userMatrix import UserMatrix
+import recommendCache
 import anewParser
 
-# create genres to movies index
-def prepare_genres(mongo):
-    print("[prepare_genres] Starting pepare genres list...")
-    startTime = time.time()
-
-    genres_dict = {}
-    cursor = mongo.db["movie"].find({})
-    for cur_movie in cursor:
-        cur_mid = cur_movie["mid"]
-        cur_genres = cur_movie["genres"]
+RANKINGS_MODE = "aggregate"  # "python": movie rankings by MovieIndexBuilder, "aggregate": by movieRankings.py in MongoDB, also by decade
+
+# Streaming builder of the movie-derived indexes and rankings, in one read of the movie collection.
+# Every movie document is fanned out to all accumulators:
+#       -genres_list    genre -> relevant movies, popularity, per-genre top rated / most popular (top 30)
+#       -genres_list    "all" -> top rated / most popular movies among all (top 100)
+#       -actors_list    actor -> relevant movies, popularity
+#       -actors_list    "all" -> most popular actors (top 100)
+# and every output is bulk written at the end. Without rankings, only the lists are built
+# (the movie rankings are then left to the aggregation pipelines of movieRankings.py).
+class MovieIndexBuilder(object):
+
+    def __init__(self, rankings=True):
+        self.rankings = rankings
+        self.genres = {}
+        self.actors = {}
+        self.genre_rated = {}
+        self.genre_popular = {}
+        self.top_rated = topK.TopKHeap(100)
+        self.most_popular = topK.TopKHeap(100)
+
+    def add(self, cur_movie):
         copy_movie = {}
         copy_movie["mid"] = cur_movie["mid"]
         copy_movie["imdb_rating"] = cur_movie["imdb_rating"]
         copy_movie["imdb_votes"] = cur_movie["imdb_votes"]
-        for genre in cur_genres:
-            if genre not in genres_dict:
-                cur_list = []
-            else:
-                cur_list = genres_dict[genre]
-            cur_list.append(copy_movie)
-            genres_dict[genre] = cur_list
-
-    for genre, movies in genres_dict.items():
-        mongo.db["genres_list"].update_one({"genre": genre}, {"$set": {
-            "relevant_movie": movies,
-            "popular": len(movies)
-            }}, True)
-        # print(genre + " " + str(len(movies)))
-
-    mongo.db["genres_list"].create_index([("genre", pymongo.ASCENDING)])
-    print("[prepare_genres] Created index for genre in genres_list")
-    print("[prepare_genres] Done (%0.2fs)." % (time.time() - startTime))
-
-# create actors to movies index
-def prepare_actors(mongo):
-    print("[prepare_actors] Starting pepare actors list...")
-    startTime = time.time()
 
-    actors_dict = {}
-    cursor = mongo.db["movie"].find({})
-    for cur_movie in cursor:
-        cur_mid = cur_movie["mid"]
-        cur_actors = cur_movie["actors"]
-        copy_movie = {}
-        copy_movie["mid"] = cur_movie["mid"]
-        copy_movie["imdb_rating"] = cur_movie["imdb_rating"]
-        copy_movie["imdb_votes"] = cur_movie["imdb_votes"]
-        for actor in cur_actors:
-            if actor not in actors_dict:
-                cur_list = []
-            else:
-                cur_list = actors_dict[actor]
-            cur_list.append(copy_movie)
-            actors_dict[actor] = cur_list
-
-    progressInterval = 3000    # How often should we print a progress report to the console?
-    progressTotal = 55740      # Approximate number of total actors.
-    bulkSize = 500             # How many documents should we store in memory before inserting them into the database in bulk?
-    bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["actors_list"], ordered = False)
-    count = 0
-    skipCount = 0
-    for actor, movies in actors_dict.items():
-        count += 1
-        if count % progressInterval == 0:
-            print("[prepare_actors] %5d actors processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
-
-        cur_doc = {}
-        cur_doc["actor"] = actor
-        cur_doc["relevant_movie"] = movies
-        cur_doc["popular"] = len(movies)
-        bulkPayload.insert(cur_doc)
-
-        if count % bulkSize == 0:
-            try:
-                bulkPayload.execute()
-            except pymongo.errors.OperationFailure as e:
-                skipCount += len(e.details["writeErrors"])
-            bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["actors_list"], ordered = False)
-
-    if count % bulkSize > 0:
+        # numbers once typed by omdbFields, raw OMDb strings before
+        # (ranked with -mid so that equal scores keep the lowest mids, in the order of movieRankings.py)
+        cur_rating = omdbFields.parse_rating(cur_movie["imdb_rating"])
+        cur_votes = omdbFields.parse_votes(cur_movie["imdb_votes"])
+        if cur_rating is not None:
+            cur_rating = (cur_rating, -cur_movie["mid"])
+        if cur_votes is not None:
+            cur_votes = (cur_votes, -cur_movie["mid"])
+        if self.rankings and cur_rating is not None:
+            self.top_rated.push(cur_movie["mid"], cur_rating)
+        if self.rankings and cur_votes is not None:
+            self.most_popular.push(cur_movie["mid"], cur_votes)
+
+        for genre in cur_movie["genres"]:
+            if genre not in self.genres:
+                self.genres[genre] = []
+                self.genre_rated[genre] = topK.TopKHeap(30)
+                self.genre_popular[genre] = topK.TopKHeap(30)
+            self.genres[genre].append(copy_movie)
+            if self.rankings and cur_rating is not None:
+                self.genre_rated[genre].push(cur_movie["mid"], cur_rating)
+            if self.rankings and cur_votes is not None:
+                self.genre_popular[genre].push(cur_movie["mid"], cur_votes)
+
+        for actor in cur_movie["actors"]:
+            if actor not in self.actors:
+                self.actors[actor] = []
+            self.actors[actor].append(copy_movie)
+
+    def write_genres(self, mongo):
+        bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["genres_list"], ordered = False)
+        for genre, movies in self.genres.items():
+            cur_update = {
+                "relevant_movie": movies,
+                "popular": len(movies)
+                }
+            if self.rankings:
+                cur_update["top_rated"] = self.genre_rated[genre].cids()
+                cur_update["most_popular"] = self.genre_popular[genre].cids()
+            bulkPayload.find({"genre": genre}).upsert().update({"$set": cur_update})
+        if self.rankings:
+            bulkPayload.find({"genre": "all"}).upsert().update({"$set": {
+                "top_rated": self.top_rated.cids(),
+                "most_popular": self.most_popular.cids()
+                }})
+        skipCount = 0
         try:
             bulkPayload.execute()
         except pymongo.errors.OperationFailure as e:
             skipCount += len(e.details["writeErrors"])
+        mongo.db["genres_list"].create_index([("genre", pymongo.ASCENDING)])
+        print("[MovieIndexBuilder] Stored %d genres, skipped %d." % (len(self.genres), skipCount))
+
+    def write_actors(self, mongo):
+        progressInterval = 3000    # How often should we print a progress report to the console?
+        progressTotal = 55740      # Approximate number of total actors.
+        bulkSize = 500             # How many documents should we store in memory before inserting them into the database in bulk?
+        bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["actors_list"], ordered = False)
+        count = 0
+        skipCount = 0
+        startTime = time.time()
+        most_popular = topK.TopKHeap(100)
+        for actor, movies in self.actors.items():
+            count += 1
+            if count % progressInterval == 0:
+                print("[MovieIndexBuilder] %5d actors stored so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
+            if actor != "N/A":
+                most_popular.push(actor, len(movies))
+
+            cur_doc = {}
+            cur_doc["actor"] = actor
+            cur_doc["relevant_movie"] = movies
+            cur_doc["popular"] = len(movies)
+            bulkPayload.insert(cur_doc)
+
+            if count % bulkSize == 0:
+                try:
+                    bulkPayload.execute()
+                except pymongo.errors.OperationFailure as e:
+                    skipCount += len(e.details["writeErrors"])
+                bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["actors_list"], ordered = False)
+
+        bulkPayload.find({"actor": "all"}).upsert().update({"$set": {
+            "most_popular": most_popular.cids()
+            }})
+        try:
+            bulkPayload.execute()
+        except pymongo.errors.OperationFailure as e:
+            skipCount += len(e.details["writeErrors"])
+        mongo.db["actors_list"].create_index([("actor", pymongo.ASCENDING)])
+        print("[MovieIndexBuilder] Stored %d actors, skipped %d." % (count, skipCount))
 
-    mongo.db["actors_list"].create_index([("actor", pymongo.ASCENDING)])
-    print("[prepare_actors] Created index for actor in actors_list")
-    print("[prepare_actors] Skipped " + str(skipCount) + " insertions.")
-    print("[prepare_actors] Done (%0.2fs)." % (time.time() - startTime))
-
-# rank movies by rating and popularity among all
-def prepare_rankings_movies_all(mongo):
-    # top rated movies among all
-    # most popular movies among all
-    print("[prepare_rankings_movies_all] Starting pepare ranking...")
-
-    top_rated_heap = queue.PriorityQueue()
-    most_popular_heap = queue.PriorityQueue()
-    cursor = mongo.db["movie"].find({})
-    for cur_movie in cursor:
-        cur_rating = cur_movie["imdb_rating"]
-        if cur_rating != "N/A":
-            top_rated_heap.put(Candidate(cur_movie["mid"], cur_rating))
-            # maintain the size
-            if top_rated_heap.qsize() > 100:
-                top_rated_heap.get()
-        cur_votes_string = cur_movie["imdb_votes"]
-        if cur_votes_string != "N/A":
-            cur_votes = int(cur_votes_string.replace(',', ''))
-            most_popular_heap.put(Candidate(cur_movie["mid"], cur_votes))
-            # maintain the size
-            if most_popular_heap.qsize() > 100:
-                most_popular_heap.get()
-
-    top_rated = []
-    while not top_rated_heap.empty():
-        cur_candidate = top_rated_heap.get()
-        top_rated.append(cur_candidate.cid)
-    top_rated.reverse()
-
-    most_popular = []
-    while not most_popular_heap.empty():
-        cur_candidate = most_popular_heap.get()
-        most_popular.append(cur_candidate.cid)
-    most_popular.reverse()
-
-    mongo.db["genres_list"].update_one({"genre": "all"}, {"$set": {
-        "top_rated": top_rated,
-        "most_popular": most_popular
-        }}, True)
-
-    print("[prepare_rankings_movies_all] Done.")
-
-# rank movies by rating and popularity among each genre
-def prepare_rankings_movies_genres(mongo):
-    # top rated movies for each genres
-    # most popular movies for each genres
-    print("[prepare_rankings_movies_genres] Starting pepare ranking...")
-
-    cursor = mongo.db["genres_list"].find({})
-    for cur_genre in cursor:
-        # skip the "all" genre
-        if "relevant_movie" not in cur_genre:
-            continue
-        relevant_movies = cur_genre["relevant_movie"]
-        top_rated_heap = queue.PriorityQueue()
-        most_popular_heap = queue.PriorityQueue()
-        for cur_movie in relevant_movies:
-            cur_rating = cur_movie["imdb_rating"]
-            if cur_rating != "N/A":
-                top_rated_heap.put(Candidate(cur_movie["mid"], cur_rating))
-                # maintain the size
-                if top_rated_heap.qsize() > 30:
-                    top_rated_heap.get()
-            cur_votes_string = cur_movie["imdb_votes"]
-            if cur_votes_string != "N/A":
-                cur_votes = int(cur_votes_string.replace(',', ''))
-                most_popular_heap.put(Candidate(cur_movie["mid"], cur_votes))
-                # maintain the size
-                if most_popular_heap.qsize() > 30:
-                    most_popular_heap.get()
-
-        top_rated = []
-        while not top_rated_heap.empty():
-            cur_candidate = top_rated_heap.get()
-            top_rated.append(cur_candidate.cid)
-        top_rated.reverse()
-
-        most_popular = []
-        while not most_popular_heap.empty():
-            cur_candidate = most_popular_heap.get()
-            most_popular.append(cur_candidate.cid)
-        most_popular.reverse()
-
-        mongo.db["genres_list"].update_one({"genre": cur_genre["genre"]}, {"$set": {
-            "top_rated": top_rated,
-            "most_popular": most_popular
-            }}, True)
-
-    print("[prepare_rankings_movies_genres] Done.")
-
-# rank actors by popularity among all
-def prepare_rankings_actor(mongo):
-    # most popular actors
-    print("[prepare_rankings_actor] Starting pepare ranking...")
-
-    most_popular_heap = queue.PriorityQueue()
-    cursor = mongo.db["actors_list"].find({})
-    for cur_actor in cursor:
-        if "popular" not in cur_actor or cur_actor["actor"] == "N/A":
-            continue
-        cur_popular = cur_actor["popular"]
-        most_popular_heap.put(Candidate(cur_actor["actor"], cur_popular))
-        # maintain the size
-        if most_popular_heap.qsize() > 100:
-            most_popular_heap.get()
-
-    most_popular = []
-    while not most_popular_heap.empty():
-        cur_candidate = most_popular_heap.get()
-        most_popular.append(cur_candidate.cid)
-    most_popular.reverse()
-
-    mongo.db["actors_list"].update_one({"actor": "all"}, {"$set": {
-        "most_popular": most_popular
-        }}, True)
-
-    print("[prepare_rankings_actor] Done.")
-
-# prepare all kinds of rankings
-def prepare_rankings(mongo):
-    print("[prepare_rankings] Starting pepare ranking...")
+# genre and actor lists with all their rankings, from a single pass over movie
+# rankings: also rank the movies in Python, instead of movieRankings.prepare()
+def prepare_movie_indexes(mongo, rankings=True):
+    print("[prepare_movie_indexes] Starting prepare genres, actors and rankings...")
     startTime = time.time()
 
-    # top rated movies among all
-    # most popular movies among all
-    # runtime: 6~7s
-    prepare_rankings_movies_all(mongo)
-
-    # top rated movies for each genres
-    # most popular movies for each genres
-    # runtime: 2~3s
-    prepare_rankings_movies_genres(mongo)
-
-    # most popular actors
-    # runtime: 1s
-    prepare_rankings_actor(mongo)
-
-    print("[prepare_rankings] Done (%0.2fs)." % (time.time() - startTime))
+    builder = MovieIndexBuilder(rankings)
+    cursor = mongo.db["movie"].find({}, {"mid": 1, "genres": 1, "actors": 1, "imdb_rating": 1, "imdb_votes": 1})
+    count = 0
+    for cur_movie in cursor:
+        count += 1
+        builder.add(cur_movie)
+    print("[prepare_movie_indexes] Read %d movies (%0.2fs)." % (count, time.time() - startTime))
 
-class recommend_thread(threading.Thread):
-    def __init__(self, threadID, name, mid_list, thread_num, mongo):
-        threading.Thread.__init__(self)
-        self.threadID = threadID
-        self.mongo = mongo
-        self.mid_list = mid_list
-        self.thread_num = thread_num
+    builder.write_genres(mongo)
+    builder.write_actors(mongo)
+    print("[prepare_movie_indexes] Done (%0.2fs)." % (time.time() - startTime))
 
-    def run(self):
-        prepare_recommend_thread(self.mongo, self.mid_list, self.thread_num)
+workerRecommend = None     # Recommender of the current worker process.
 
-def prepare_recommend_thread(mongo, mid_list, thread_num):
-    print("[prepare_recommend_thread] Starting prepare recommendations...")
-    startTime = time.time()
+def init_recommend_worker():
+    global workerRecommend
+    # the per-movie logs of MovieRecommend would drown the progress report of the parent
+    sys.stdout = open(os.devnull, "w")
+    workerRecommend = MovieRecommend(Mongo("movieRecommend"))
 
-    recommend = MovieRecommend(mongo)
-    progressTotal = int(34208 / thread_num) + 1
-    count = 0
-    bulkSize = 100             # How many documents should we store in memory before inserting them into the database in bulk?
-    # List of documents that will be given to the database to be inserted to the collection in bulk.
-    bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
+# similar movies of one chunk of mids, buffered and bulk written by the worker
+def prepare_recommend_chunk(mid_list, recommend=None):
+    recommend = workerRecommend if recommend is None else recommend
+    bulkPayload = pymongo.bulk.BulkOperationBuilder(recommend.db["movie"], ordered = False)
     skipCount = 0
-
     for cur_mid in mid_list:
-        count += 1
-        print("[prepare_recommend_thread] %5d movies processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
         similar_movies = recommend.recommend_movies_for_movie(cur_mid)
         bulkPayload.find({"mid": cur_mid}).update({"$set": {
             "similar_movies": similar_movies
             }})
-
-        if count % bulkSize == 0:
-            try:
-                bulkPayload.execute()
-            except pymongo.errors.OperationFailure as e:
-                skipCount += len(e.details["writeErrors"])
-            bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["movie"], ordered = False)
-    if count % bulkSize > 0:
+    if len(mid_list) > 0:
         try:
             bulkPayload.execute()
         except pymongo.errors.OperationFailure as e:
             skipCount += len(e.details["writeErrors"])
-
-    print("[prepare_recommend_thread] Done.")
+    return len(mid_list), skipCount
 
 # pre-calculate the recommendations for all movies
-def prepare_recommend(mongo, thread_num=2):
+# mids are handed out in chunks to a process pool, the parent only reports the progress
+def prepare_recommend(mongo, workers=4, chunkSize=100):
     print("[prepare_recommend] Starting prepare recommendations...")
     startTime = time.time()
 
-    mid_pool = []
-    for i in range(thread_num):
-        mid_pool.append([])
+    mid_list = [cur_movie["mid"] for cur_movie in mongo.db["movie"].find({}, {"mid": 1})]
+    chunks = [mid_list[start:start + chunkSize] for start in range(0, len(mid_list), chunkSize)]
+    print("[prepare_recommend] %d movies in %d chunks for %d workers." % (len(mid_list), len(chunks), workers))
+
+    if workers <= 1:
+        recommend = MovieRecommend(mongo)
+        results = (prepare_recommend_chunk(chunk, recommend) for chunk in chunks)
+    else:
+        # spawn, so that no worker inherits the MongoClient of the parent process
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=init_recommend_worker)
+        results = pool.imap_unordered(prepare_recommend_chunk, chunks)
 
     count = 0
-    cursor = mongo.db["movie"].find({})
-    for cur_movie in cursor:
-        cur_mid = cur_movie["mid"]
-        mid_pool[count].append(cur_mid)
-        count += 1
-        if count == thread_num:
-            count = 0
-
-    # allocate mids to all threads
-    print("[prepare_recommend] Allocating mids to all threads...")
-    thread_poll = []
-    for i in range(thread_num):
-        thread_poll.append(recommend_thread(i, str(i), mid_pool[i], thread_num, mongo))
-
-    print("[prepare_recommend] Starting all threads...")
-    for i in range(thread_num):
-        thread_poll[i].start()
-
-    # Wait for all threads to complete
-    for thread in thread_poll:
-        thread.join()
+    skipCount = 0
+    for chunkCount, chunkSkips in results:
+        count += chunkCount
+        skipCount += chunkSkips
+        elapsed = time.time() - startTime
+        eta = elapsed / count * (len(mid_list) - count) if count > 0 else 0
+        print("[prepare_recommend] %5d movies processed so far. (%d%%) (%0.2fs, ETA %0.0fs)" % (count, int(count * 100 / max(1, len(mid_list))), elapsed, eta))
+
+    if workers > 1:
+        pool.close()
+        pool.join()
+    print("[prepare_recommend] Skipped " + str(skipCount) + " updates.")
     print("[prepare_recommend] Done (%0.2fs)." % (time.time() - startTime))
 
 def prepare():
@@ -325,24 +222,46 @@ def prepare():
     # Store MovieLens data into database.
     # runtime: (1~2hours)
     movieLensParser.parse(mongo)
+
+    # top-20 similar users of every user (user_rate.similar_users), from scratch since the ratings changed
+    # a stopped run is resumed by: python userSimilarity.py precompute
+    # runtime: (few hours)
+    userSimilarity.precompute(mongo, restart=True)
+
+    # item-item co-occurrence model of the likes (indexdata/cooccurrence_*.npy)
+    # runtime: (few minutes)
+    movieCooccurrence.build(UserMatrix.load(mongo))
+
+    # ALS factors of the ratings (indexdata/als_*)
+    # runtime: (few minutes)
+    movieFactors.train(mongo)
     
     # Add ANEW all list into database.
     # runtime: (0.05s)
     anewParser.parse(mongo)
 
-    # Pre-computation
+    # genre and actor lists, with all kinds of ranking, in one pass over movie
     # runtime: (few seconds)
-    prepare_genres(mongo)
-    prepare_actors(mongo)
+    prepare_movie_indexes(mongo, rankings=(RANKINGS_MODE == "python"))
+    if RANKINGS_MODE == "aggregate":
+        # movie rankings, also by decade, by aggregation pipelines in MongoDB
+        movieRankings.prepare(mongo)
 
-    # all kinds of ranking
+    # item-item similarity index over the tag genome (indexdata/similar_movies_*.npy)
+    # runtime: (few minutes)
+    movieSimilarity.build()
+
+    # inverted index over the genome tags, for recommend_movies_based_on_tags (indexdata/genome_*)
     # runtime: (few seconds)
-    prepare_rankings(mongo)
+    invertedIndex.build_genome(mongo)
 
     # recommendations for all movies
     # runtime: (1~2hours)
     prepare_recommend(mongo)
 
+    # cached recommendations were computed from the old data
+    recommendCache.bump_data_version()
+
     print("[prepareDB] Done (%0.2fs)." % (time.time() - startTime))
 
 
@@ -0,0 +1,185 @@
+import os
+import time
+import shelve
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Process-wide cache of finished recommendation lists.
+# Keys are canonical: (kind, sorted tuple of the input set, extra parts), so the same tag set or
+# watch history hits whatever the order it was entered in (see make_key()).
+# Entries are evicted least recently used first beyond MAX_ENTRIES, and expire after TTL seconds.
+# enable_disk() adds a second tier in a shelve file (indexdata/recommend_cache.*), so results
+# survive a restart. Memory misses fall back to it, and every put is written through.
+# Every entry is tagged with the data-build version: the stamp the offline builders write to
+# indexdata/data_version.txt through bump_data_version(). The stamp is checked at most every
+# CHECK_INTERVAL seconds, a new stamp drops the memory tier and turns the disk entries stale.
+
+INDEX_DIR = "indexdata"
+VERSION_PATH = os.path.join(INDEX_DIR, "data_version.txt")
+DISK_PATH = os.path.join(INDEX_DIR, "recommend_cache")
+MAX_ENTRIES = 512           # Recommendation lists kept in memory.
+MAX_DISK_ENTRIES = 20000    # Recommendation lists kept on disk.
+TTL = 6 * 3600              # Seconds before an entry is recomputed.
+CHECK_INTERVAL = 60         # Seconds between two reads of the data-build version.
+
+# canonical cache key: kind, the input set in a stable order, then any extra parts
+def make_key(kind, items, *extra):
+    return (kind, tuple(sorted(set(items), key=repr))) + tuple(extra)
+
+def get_data_version(path=VERSION_PATH):
+    if not os.path.isfile(path):
+        return ""
+    with open(path, "r") as f:
+        return f.read().strip()
+
+# called by the offline builders after they changed data used by the recommenders
+def bump_data_version(path=VERSION_PATH):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + ".tmp", "w") as f:
+        f.write(str(time.time_ns()))
+    os.replace(path + ".tmp", path)
+
+class RecommendCache(object):
+
+    lock = threading.Lock()
+    entries = OrderedDict()     # key -> (expiry time, recommendation list), least recently used first
+    version = None              # data-build version of the memory entries
+    checked = 0                 # last time the data-build version was read
+    disk = None                 # shelve of the disk tier, None when disabled
+    disk_puts = 0
+    counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    # recommendation list cached for a key, None on a miss
+    @classmethod
+    def get(cls, key):
+        with cls.lock:
+            cls.check_version()
+            now = time.time()
+            if key in cls.entries:
+                expires, value = cls.entries[key]
+                if expires > now:
+                    cls.entries.move_to_end(key)
+                    cls.counters["hits"] += 1
+                    return list(value)
+                del cls.entries[key]
+                cls.counters["expirations"] += 1
+
+            if cls.disk is not None:
+                disk_key = cls.disk_key(key)
+                entry = cls.disk.get(disk_key)
+                if entry is not None:
+                    if entry["version"] == cls.version and entry["expires"] > now:
+                        cls.store(key, entry["expires"], entry["value"])
+                        cls.counters["disk_hits"] += 1
+                        return list(entry["value"])
+                    del cls.disk[disk_key]
+                    cls.counters["expirations"] += 1
+
+            cls.counters["misses"] += 1
+            return None
+
+    @classmethod
+    def put(cls, key, value):
+        with cls.lock:
+            cls.check_version()
+            expires = time.time() + TTL
+            value = list(value)
+            cls.store(key, expires, value)
+            if cls.disk is not None:
+                cls.disk[cls.disk_key(key)] = {"version": cls.version, "expires": expires, "value": value}
+                cls.disk_puts += 1
+                if cls.disk_puts % 100 == 0:
+                    cls.prune_disk()
+                    cls.disk.sync()
+
+    # memory tier insert, evicting the least recently used entries
+    @classmethod
+    def store(cls, key, expires, value):
+        cls.entries[key] = (expires, value)
+        cls.entries.move_to_end(key)
+        while len(cls.entries) > MAX_ENTRIES:
+            cls.entries.popitem(last=False)
+            cls.counters["evictions"] += 1
+
+    @classmethod
+    def check_version(cls):
+        if cls.version is not None and time.time() - cls.checked < CHECK_INTERVAL:
+            return
+        cls.checked = time.time()
+        version = get_data_version()
+        if version != cls.version:
+            if cls.version is not None:
+                print("[RecommendCache] Data-build version changed, dropping %d cached recommendations." % len(cls.entries))
+                cls.counters["invalidations"] += 1
+            cls.entries.clear()
+            cls.version = version
+
+    @classmethod
+    def disk_key(cls, key):
+        return hashlib.sha1(repr(key).encode("utf8")).hexdigest()
+
+    @classmethod
+    def enable_disk(cls, path=DISK_PATH):
+        with cls.lock:
+            if cls.disk is not None:
+                return
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            cls.disk = shelve.open(path)
+            cls.check_version()
+            cls.prune_disk()
+            print("[RecommendCache] Disk tier enabled: %d entries in %s" % (len(cls.disk), path))
+
+    # drop stale and expired disk entries, then the ones closest to expiry beyond MAX_DISK_ENTRIES
+    @classmethod
+    def prune_disk(cls):
+        now = time.time()
+        alive = []
+        for disk_key in list(cls.disk.keys()):
+            entry = cls.disk[disk_key]
+            if entry["version"] != cls.version or entry["expires"] <= now:
+                del cls.disk[disk_key]
+            else:
+                alive.append((entry["expires"], disk_key))
+        if len(alive) > MAX_DISK_ENTRIES:
+            alive.sort()
+            for expires, disk_key in alive[:len(alive) - MAX_DISK_ENTRIES]:
+                del cls.disk[disk_key]
+
+    @classmethod
+    def disable_disk(cls):
+        with cls.lock:
+            if cls.disk is not None:
+                cls.disk.close()
+                cls.disk = None
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.entries.clear()
+            if cls.disk is not None:
+                cls.disk.clear()
+
+    # counters and sizes, for logging
+    @classmethod
+    def stats(cls):
+        with cls.lock:
+            stats = dict(cls.counters)
+            stats["entries"] = len(cls.entries)
+            stats["disk_entries"] = len(cls.disk) if cls.disk is not None else 0
+            return stats
+
+
+def main():
+    RecommendCache.enable_disk()
+    key = make_key("tags_integrated", ["comedy", "zombies"])
+    print(RecommendCache.get(key))
+    RecommendCache.put(key, ["Shaun of the Dead (2004)", "Zombieland (2009)"])
+    print(RecommendCache.get(make_key("tags_integrated", ["zombies", "comedy"])))
+    print(RecommendCache.stats())
+    RecommendCache.disable_disk()
+
+if __name__ == "__main__":
+    main()
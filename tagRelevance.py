@@ -0,0 +1,119 @@
+from DataService import Mongo
+from bson.binary import Binary
+import pymongo
+import time
+import numpy
+import recommendCache
+
+# Typed storage of MovieLens Genome tag relevance.
+# db name: movieRecommend
+# Relevance pairs are kept as parallel little-endian arrays stored as BSON binary:
+#       tag:    relevant_mids (int32),  relevant_scores (float32)
+#       movie:  tag_ids (int32),        tag_scores (float32)
+# The reader helpers still understand the old "id,score" string lists
+# (tag.relevant_movie, movie.tags) for databases that were not migrated yet.
+
+ID_TYPE = numpy.dtype("<i4")
+SCORE_TYPE = numpy.dtype("<f4")
+
+def pack_ids(ids):
+    return Binary(numpy.asarray(ids, dtype=ID_TYPE).tobytes())
+
+def pack_scores(scores):
+    return Binary(numpy.asarray(scores, dtype=SCORE_TYPE).tobytes())
+
+def unpack_ids(blob):
+    return numpy.frombuffer(blob, dtype=ID_TYPE)
+
+def unpack_scores(blob):
+    return numpy.frombuffer(blob, dtype=SCORE_TYPE)
+
+# parse the old ["id,score", ...] representation
+def parse_pairs(pairs):
+    ids = numpy.empty(len(pairs), dtype=ID_TYPE)
+    scores = numpy.empty(len(pairs), dtype=SCORE_TYPE)
+    for i in range(len(pairs)):
+        attrs = pairs[i].split(",")
+        ids[i] = int(attrs[0])
+        scores[i] = float(attrs[1])
+    return ids, scores
+
+# (mids, scores) arrays of the movies relevant to a tag document
+def get_relevant_movies(tag_doc):
+    if "relevant_mids" in tag_doc:
+        return unpack_ids(tag_doc["relevant_mids"]), unpack_scores(tag_doc["relevant_scores"])
+    if "relevant_movie" in tag_doc:
+        return parse_pairs(tag_doc["relevant_movie"])
+    return numpy.empty(0, dtype=ID_TYPE), numpy.empty(0, dtype=SCORE_TYPE)
+
+def has_relevant_movies(tag_doc):
+    return "relevant_mids" in tag_doc or "relevant_movie" in tag_doc
+
+# (tids, scores) arrays of the tags relevant to a movie document
+def get_movie_tags(movie_doc):
+    if "tag_ids" in movie_doc:
+        return unpack_ids(movie_doc["tag_ids"]), unpack_scores(movie_doc["tag_scores"])
+    if "tags" in movie_doc:
+        return parse_pairs(movie_doc["tags"])
+    return numpy.empty(0, dtype=ID_TYPE), numpy.empty(0, dtype=SCORE_TYPE)
+
+def has_movie_tags(movie_doc):
+    return "tag_ids" in movie_doc or "tags" in movie_doc
+
+# rewrite the string relevance lists of one collection into binary arrays
+def migrate_collection(mongo, collection, old_field, ids_field, scores_field):
+    progressInterval = 1000   # How often should we print a progress report to the console?
+    bulkSize = 500            # How many documents should we store in memory before inserting them into the database in bulk?
+    bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db[collection], ordered = False)
+    bulkCount = 0
+    count = 0
+    skipCount = 0
+    startTime = time.time()
+
+    cursor = mongo.db[collection].find({old_field: {"$exists": True}}, {old_field: 1}, no_cursor_timeout=True)
+    for cur_doc in cursor:
+        count += 1
+        if count % progressInterval == 0:
+            print("[tagRelevance] %6d %s documents migrated so far. (%0.2fs)" % (count, collection, time.time() - startTime))
+
+        ids, scores = parse_pairs(cur_doc[old_field])
+        bulkPayload.find({"_id": cur_doc["_id"]}).update({
+            "$set": {ids_field: pack_ids(ids), scores_field: pack_scores(scores)},
+            "$unset": {old_field: ""}
+            })
+        bulkCount += 1
+
+        if bulkCount >= bulkSize:
+            try:
+                bulkPayload.execute()
+            except pymongo.errors.OperationFailure as e:
+                skipCount += len(e.details["writeErrors"])
+            bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db[collection], ordered = False)
+            bulkCount = 0
+    cursor.close()
+
+    if bulkCount > 0:
+        try:
+            bulkPayload.execute()
+        except pymongo.errors.OperationFailure as e:
+            skipCount += len(e.details["writeErrors"])
+
+    print("[tagRelevance] Migrated " + str(count) + " " + collection + " documents.")
+    print("[tagRelevance] Skipped " + str(skipCount) + " updates.")
+
+# one-shot migration of an existing database
+def migrate(mongo):
+    print("[tagRelevance] Starting migration of tag relevance to binary arrays...")
+    startTime = time.time()
+    migrate_collection(mongo, "tag", "relevant_movie", "relevant_mids", "relevant_scores")
+    migrate_collection(mongo, "movie", "tags", "tag_ids", "tag_scores")
+    recommendCache.bump_data_version()
+    print("[tagRelevance] Migration Complete (%0.2fs)" % (time.time() - startTime))
+
+
+def main():
+    mongo = Mongo("movieRecommend")
+    migrate(mongo)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import invertedIndex
+from invertedIndex import InvertedIndex
+
+# MaxScore search() against the exhaustive scorer, on random integration indexes.
+# Posting lists are Zipf-sized, broad terms weigh little, and movies repeat inside a list (merged by pack_field).
+
+MOVIES = 5000
+
+def random_field(rng, num_terms):
+    lengths = numpy.minimum(MOVIES, (rng.zipf(1.3, num_terms) * 20)).astype(numpy.int64)
+    postings = numpy.concatenate([rng.randint(0, MOVIES, length) for length in lengths])
+    weights = numpy.concatenate([rng.random_sample(length) * (1.0 / numpy.log2(2 + length)) for length in lengths])
+    return lengths, postings, weights
+
+class InvertedIndexSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.rng = numpy.random.RandomState(12)
+        strings = {"titles": ["Movie %d" % movie for movie in range(MOVIES)], "size": MOVIES, "terms": {}, "aliases": {}}
+        for field in invertedIndex.INDEXES["integration"]:
+            lengths, postings, weights = random_field(self.rng, 300)
+            strings["terms"][field] = ["%s %d" % (field, term) for term in range(len(lengths))]
+            invertedIndex.save_field("integration", field, invertedIndex.pack_field(lengths, postings, weights), lengths, self.index_dir)
+        with mock.patch("recommendCache.bump_data_version"):
+            invertedIndex.save_strings("integration", strings, self.index_dir)
+        self.index = InvertedIndex("integration", self.index_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def random_query(self, negative):
+        query = []
+        for field in invertedIndex.INDEXES["integration"]:
+            for term in self.rng.choice(300, self.rng.randint(1, 12), replace=False):
+                weight = self.rng.random_sample() * 2
+                if negative and self.rng.random_sample() < 0.2:
+                    weight = -weight / 4
+                query.append((field, "%s %d" % (field, term), weight))
+        # unknown terms are ignored by both
+        query.append(("tags", "unknown tag", 1.0))
+        return query
+
+    def assert_same_top(self, query, k, exclude):
+        ids, scores, stats = self.index.search(query, k, exclude)
+        expected_ids, expected_scores, expected_stats = self.index.search_exhaustive(query, k, exclude)
+        numpy.testing.assert_allclose(scores, expected_scores, rtol=1e-9, atol=1e-9)
+        # ties may be broken differently, but every movie returned has its exhaustive score
+        exhaustive, touched = self.index.score(query)
+        numpy.testing.assert_allclose(scores, exhaustive[ids], rtol=1e-9, atol=1e-9)
+        self.assertEqual(len(set(ids.tolist())), len(ids))
+        if exclude is not None:
+            self.assertNotIn(exclude, ids.tolist())
+        self.assertLessEqual(stats[1], stats[2])
+
+    def test_maxscore_matches_exhaustive(self):
+        with mock.patch("invertedIndex.MIN_POSTINGS", 0):
+            for trial in range(200):
+                k = int(self.rng.choice([1, 5, 10, 30]))
+                exclude = int(self.rng.randint(MOVIES)) if trial % 3 == 0 else None
+                self.assert_same_top(self.random_query(negative=trial % 2 == 1), k, exclude)
+
+    def test_small_queries_are_exhaustive(self):
+        query = self.random_query(negative=False)
+        ids, scores, stats = self.index.search(query, 10)
+        self.assertEqual(stats[1], stats[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import movieCooccurrence
+from movieCooccurrence import CooccurrenceIndex
+from userMatrix import UserMatrix, LIKE_THRESHOLD
+
+# Blocked item-item co-occurrence against the dense product of the likes matrix with itself.
+
+def random_matrix(rng, users=500, movies=300):
+    indptr = [0]
+    mids = []
+    ratings = []
+    for user in range(users):
+        cur_mids = numpy.unique((rng.zipf(1.3, rng.randint(1, 50)) % movies) * 3 + 1)
+        mids.append(cur_mids)
+        ratings.append(rng.randint(1, 11, len(cur_mids)) / 2.0)
+        indptr.append(indptr[-1] + len(cur_mids))
+    return UserMatrix(list(range(1, users + 1)), indptr, numpy.concatenate(mids).astype(numpy.int32), numpy.concatenate(ratings))
+
+# dense cosine of every pair of liked movies, as rows/columns of matrix.like_movies
+def dense_similarity(matrix):
+    likes = numpy.zeros((len(matrix.uids), len(matrix.like_movies)))
+    rows = numpy.repeat(numpy.arange(len(matrix.uids)), numpy.diff(matrix.indptr))
+    liked = matrix.ratings >= LIKE_THRESHOLD
+    likes[rows[liked], numpy.searchsorted(matrix.like_movies, matrix.mids[liked])] = 1
+    counts = likes.T.dot(likes)
+    numpy.fill_diagonal(counts, 0)
+    popularity = likes.sum(axis=0)
+    similarity = counts / numpy.sqrt(popularity[:, None] * popularity[None, :])
+    similarity[counts < movieCooccurrence.MIN_COUNT] = 0
+    return similarity
+
+class CooccurrenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(18)
+        self.matrix = random_matrix(self.rng)
+        self.similarity = dense_similarity(self.matrix)
+
+    def assert_neighbours(self, neighbours, scores, n):
+        for row in range(len(self.matrix.like_movies)):
+            expected = numpy.sort(self.similarity[row])[::-1][:n]
+            numpy.testing.assert_allclose(scores[row], expected, rtol=1e-6, atol=1e-7)
+            found = neighbours[row][neighbours[row] >= 0]
+            self.assertEqual(len(found), numpy.count_nonzero(expected > 0))
+            numpy.testing.assert_allclose(self.similarity[row, found], scores[row][:len(found)], rtol=1e-6)
+
+    def test_blocks_match_dense_product(self):
+        n = 10
+        for block_size in (1, 7, 256):
+            neighbours, scores = movieCooccurrence.compute_neighbours(self.matrix, n, block_size)
+            self.assert_neighbours(neighbours, scores, n)
+
+    def test_pair_slices(self):
+        expected = movieCooccurrence.compute_neighbours(self.matrix, 10, 16)
+        with mock.patch("movieCooccurrence.MAX_PAIRS", 53):
+            found = movieCooccurrence.compute_neighbours(self.matrix, 10, 16)
+        numpy.testing.assert_array_equal(found[0], expected[0])
+        numpy.testing.assert_array_equal(found[1], expected[1])
+
+    def test_history_scores(self):
+        index_dir = tempfile.mkdtemp()
+        try:
+            with mock.patch("recommendCache.bump_data_version"):
+                movieCooccurrence.build(self.matrix, index_dir, 10)
+            index = CooccurrenceIndex.load(index_dir)
+            neighbours, scores = movieCooccurrence.compute_neighbours(self.matrix, 10)
+            mids = self.matrix.like_movies
+            for trial in range(50):
+                history = set(self.rng.choice(mids, self.rng.randint(1, 8)).tolist()) | set([2, 100000])
+                expected = {}
+                for mid in history:
+                    if mid not in mids:
+                        continue
+                    row = int(numpy.searchsorted(mids, mid))
+                    for neighbour, score in zip(neighbours[row], scores[row]):
+                        if neighbour >= 0 and int(mids[neighbour]) not in history:
+                            expected[int(mids[neighbour])] = expected.get(int(mids[neighbour]), 0) + float(score)
+                found = index.score_history(history)
+                self.assertEqual(sorted(found), sorted(expected))
+                for mid in expected:
+                    self.assertAlmostEqual(found[mid], expected[mid], places=5)
+        finally:
+            shutil.rmtree(index_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import unittest
+from unittest import mock
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import movieFactors
+from userMatrix import LIKE_THRESHOLD
+
+# Batched and long-row ALS solves against one direct least squares solve per row.
+
+FACTORS = 8
+ITEMS = 400
+
+def random_rows(rng, lengths):
+    ptr = numpy.concatenate(([0], numpy.cumsum(lengths))).astype(numpy.int64)
+    indices = numpy.concatenate([rng.choice(ITEMS, length, replace=False) for length in lengths]).astype(numpy.int32)
+    ratings = rng.randint(1, 11, ptr[-1]) / 2.0
+    return ptr, indices, ratings
+
+# the regularised normal equations of every row written out in full
+def direct_solve(ptr, indices, ratings, fixed, params):
+    fixed = fixed.astype(numpy.float64)
+    solved = numpy.zeros((len(ptr) - 1, fixed.shape[1]))
+    for row in range(len(ptr) - 1):
+        entries = slice(ptr[row], ptr[row + 1])
+        if ptr[row] == ptr[row + 1]:
+            continue
+        Y = fixed[indices[entries]]
+        values = ratings[entries]
+        if params["explicit"]:
+            A = Y.T.dot(Y) + params["reg"] * len(values) * numpy.eye(fixed.shape[1])
+            b = Y.T.dot(values - params["mean"])
+        else:
+            # confidence 1 + alpha * rating on the rated items, 1 with a preference of 0 everywhere else
+            confidence = numpy.ones(len(fixed))
+            preference = numpy.zeros(len(fixed))
+            confidence[indices[entries]] = 1 + params["alpha"] * values
+            preference[indices[entries]] = values >= LIKE_THRESHOLD
+            A = (fixed * confidence[:, None]).T.dot(fixed) + params["reg"] * numpy.eye(fixed.shape[1])
+            b = fixed.T.dot(confidence * preference)
+        solved[row] = numpy.linalg.solve(A, b)
+    return solved
+
+class SolveRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(19)
+        self.fixed = self.rng.normal(0, 0.3, (ITEMS, FACTORS)).astype(numpy.float32)
+        self.gram = self.fixed.astype(numpy.float64).T.dot(self.fixed)
+        # short rows, empty rows and rows longer than the patched block
+        lengths = self.rng.randint(0, 12, 120)
+        lengths[[3, 40, 41, 119]] = [90, 300, 0, 150]
+        self.rows = random_rows(self.rng, lengths)
+
+    def assert_solves(self, params, start=0, end=None):
+        ptr, indices, ratings = self.rows
+        end = len(ptr) - 1 if end is None else end
+        expected = direct_solve(ptr, indices, ratings, self.fixed, params)[start:end]
+        with mock.patch("movieFactors.BLOCK_ENTRIES", 64):
+            solved = movieFactors.solve_rows(ptr, indices, ratings, self.fixed, self.gram, start, end, params)
+        numpy.testing.assert_allclose(solved, expected, rtol=1e-4, atol=1e-5)
+
+    def test_implicit(self):
+        params = {"factors": FACTORS, "reg": 0.1, "alpha": 2.0, "explicit": False, "mean": 0.0}
+        self.assert_solves(params)
+        self.assert_solves(params, 35, 45)
+
+    def test_explicit(self):
+        params = {"factors": FACTORS, "reg": 0.1, "alpha": 2.0, "explicit": True, "mean": 3.4}
+        self.assert_solves(params)
+        self.assert_solves(params, 3, 4)
+
+    def test_long_row_chunks(self):
+        ptr, indices, ratings = self.rows
+        for explicit in (False, True):
+            params = {"factors": FACTORS, "reg": 0.1, "alpha": 2.0, "explicit": explicit, "mean": 3.4}
+            whole = movieFactors.long_row_system(indices, ratings, self.fixed, ptr[40], ptr[41], params)
+            with mock.patch("movieFactors.BLOCK_ENTRIES", 7):
+                chunked = movieFactors.long_row_system(indices, ratings, self.fixed, ptr[40], ptr[41], params)
+            numpy.testing.assert_allclose(chunked[0], whole[0], rtol=1e-10)
+            numpy.testing.assert_allclose(chunked[1], whole[1], rtol=1e-10, atol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+from unittest import mock
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import userSimilarity
+from userMatrix import UserMatrix
+
+# Blocked similar_users precomputation against the exact per-user scan of UserMatrix.
+
+def random_matrix(rng, users=600, movies=400):
+    indptr = [0]
+    mids = []
+    ratings = []
+    for user in range(users):
+        cur_mids = numpy.unique((rng.zipf(1.4, rng.randint(1, 60)) % movies) + 1)
+        mids.append(cur_mids)
+        ratings.append(rng.randint(1, 11, len(cur_mids)) / 2.0)
+        indptr.append(indptr[-1] + len(cur_mids))
+    # sparse, unordered user ids, as in user_rate
+    uids = rng.choice(users * 10, users, replace=False) + 1
+    return UserMatrix(uids.tolist(), indptr, numpy.concatenate(mids).astype(numpy.int32), numpy.concatenate(ratings))
+
+class BlockNeighboursTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(16)
+        self.matrix = random_matrix(self.rng)
+
+    def assert_same_neighbours(self, rows, neighbours):
+        self.assertEqual(len(neighbours), len(rows))
+        for row, found in zip(rows, neighbours):
+            uid = int(self.matrix.uids[row])
+            like = set(self.matrix.get_liked(uid).tolist())
+            expected = self.matrix.get_similar_users(like, userSimilarity.NEIGHBOURS, uid)
+            scores = self.matrix.score_history(like, uid)
+            # equal scores may come in another order, the scores themselves may not differ
+            numpy.testing.assert_allclose([scores[self.matrix.get_row(other)] for other in found],
+                                          [scores[self.matrix.get_row(other)] for other in expected], rtol=1e-12)
+            self.assertEqual(len(set(found)), len(found))
+            self.assertNotIn(uid, found)
+
+    def test_block_matches_exact_scan(self):
+        rows = numpy.arange(len(self.matrix.uids))
+        for start in range(0, len(rows), userSimilarity.BLOCK_SIZE):
+            block = rows[start:start + userSimilarity.BLOCK_SIZE]
+            self.assert_same_neighbours(block, userSimilarity.block_neighbours(self.matrix, block))
+
+    def test_pair_slices(self):
+        rows = self.rng.choice(len(self.matrix.uids), 40, replace=False)
+        expected = userSimilarity.block_neighbours(self.matrix, rows)
+        with mock.patch("userSimilarity.MAX_PAIRS", 97):
+            self.assertEqual(userSimilarity.block_neighbours(self.matrix, rows), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import time
+
+# Multi-phrase matcher for extracting known tags/names from tweets.
+# Phrases are compiled into a word-level Aho-Corasick automaton, so a tweet is
+# tokenized once and scanned once, whatever the number of phrases, and every
+# occurrence of every phrase (up to max_words words long) is counted.
+# Tokenization is the one of TextAnalytics.get_words_from_tweet():
+#       -signs [-!?,(){}|+_$~*%;><.] become spaces, & becomes "and"
+#       -words starting with @, # or http, or containing =, are dropped
+#       -words are lowercased
+# so the counts are the same as probing every 1-3 gram of the tweet against the pool.
+
+SIGNS = str.maketrans(dict([(sign, " ") for sign in "-!?,(){}|+_$~*%;><."] + [("&", "and")]))
+
+def tokenize(tweet):
+    words = []
+    for word in tweet.translate(SIGNS).split(" "):
+        if len(word) == 0 or word.startswith("@") or word.startswith("#") or word.startswith("http") or "=" in word:
+            continue
+        words.append(word.lower())
+    return words
+
+class PhraseMatcher(object):
+
+    def __init__(self, phrases, max_words=3):
+        startTime = time.time()
+        # node i: goto[i] word -> node, fail[i] node, output[i] phrases ending here
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for phrase in phrases:
+            words = phrase.split(" ")
+            if len(words) > max_words or "" in words:
+                continue
+            node = 0
+            for word in words:
+                if word not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][word] = len(self.goto) - 1
+                node = self.goto[node][word]
+            self.output[node].append(phrase)
+        self.build_failure_links()
+        print("[PhraseMatcher] Compiled %d phrases into %d states (%0.2fs)" % (len(phrases), len(self.goto), time.time() - startTime))
+
+    # breadth-first, so the failure target of a node is always finished before the node
+    def build_failure_links(self):
+        pending = list(self.goto[0].values())
+        pos = 0
+        while pos < len(pending):
+            node = pending[pos]
+            pos += 1
+            for word, child in self.goto[node].items():
+                pending.append(child)
+                state = self.fail[node]
+                while state != 0 and word not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(word, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    # add the occurrences of every phrase found in the words to counts
+    def count_words(self, words, counts):
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        node = 0
+        for word in words:
+            while node != 0 and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            for phrase in output[node]:
+                if phrase not in counts:
+                    counts[phrase] = 1
+                else:
+                    counts[phrase] += 1
+        return counts
+
+    def count_tweet(self, tweet, counts):
+        return self.count_words(tokenize(tweet), counts)
+
+
+def main():
+    matcher = PhraseMatcher(["new york city", "new york", "york", "comedy", "police", "feel good"])
+    tweet = "DAMN! Feel good comedy in New York City... the NYPD (police) in new-york & http://x.co #police"
+    print(tokenize(tweet))
+    print(matcher.count_tweet(tweet, {}))
+
+if __name__ == "__main__":
+    main()
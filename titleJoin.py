@@ -0,0 +1,134 @@
+from DataService import Mongo
+import difflib
+import time
+import re
+import omdbFields
+
+# Hash join of movies with the imdb database, by title and year.
+# db name: imdb
+# collection name: movies
+# The movies to match (a few thousands) are put in a hash table keyed by (normalized title, year), and the
+# imdb movies (millions) are streamed once and probed against it with every title of their title list
+# (the simple title first, then the aka titles). A movie matched by several imdb movies keeps the one
+# matched by the earliest title of its list, the first one streamed among equals.
+# Titles are normalized so that "The Matrix", "Matrix, The" and "the matrix" share a key:
+#       -non ascii characters are dropped, as imdbUtil.formatTitle() does for the imdb titles
+#       -lowercased, everything but letters and digits becomes a single space
+#       -a trailing article (", the", ", a", ", an") is moved to the front
+# For the movies left unmatched, a second pass over the imdb movies of their years (+/- 1) reports the
+# closest titles as candidates. Only imdb titles sharing a word with the unmatched title are compared.
+# Used by movieLensFullTitle.retrieve() and keywordsCombine.copy_movies().
+
+CANDIDATES = 3          # Fuzzy-match candidates reported per unmatched movie.
+MIN_RATIO = 0.6         # Similarity (difflib ratio of the normalized titles) of a candidate.
+YEAR_SLACK = 1          # Candidates may be released this many years apart.
+STOPWORDS = set(["the", "a", "an", "of", "and", "in", "on", "to", "de", "la", "le", "les", "el", "der", "die", "das"])
+ARTICLE = re.compile(r"^(.*), (the|a|an)$")
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+def normalize_title(title):
+    title = str(title).encode("ascii", "ignore").decode("ascii").lower().strip()
+    match = ARTICLE.match(title)
+    if match is not None:
+        title = match.group(2) + " " + match.group(1)
+    return NON_WORD.sub(" ", title.replace("'", "")).strip()
+
+def title_key(title, year):
+    return (normalize_title(title), omdbFields.parse_year(year))
+
+class TitleJoin(object):
+
+    # movies: (key, title, year) to match, the key being what the matches are reported by (e.g. the mid)
+    def __init__(self, movies):
+        self.table = {}         # (normalized title, year) -> keys
+        self.keys = {}          # key -> (normalized title, year)
+        self.matches = {}       # key -> (imdbtitle, position of the matched title in the title list)
+        for key, title, year in movies:
+            cur_key = title_key(title, year)
+            if len(cur_key[0]) == 0 or cur_key[1] is None:
+                continue
+            self.keys[key] = cur_key
+            self.table.setdefault(cur_key, []).append(key)
+
+    def probe(self, imdb_movie):
+        year = omdbFields.parse_year(imdb_movie.get("year"))
+        for pos, title in enumerate(imdb_movie.get("title") or []):
+            for key in self.table.get((normalize_title(title), year), ()):
+                if key not in self.matches or pos < self.matches[key][1]:
+                    self.matches[key] = (imdb_movie["imdbtitle"], pos)
+
+    # stream the imdb movies once, {key: imdbtitle} of the matched movies
+    def join(self, cursor):
+        for imdb_movie in cursor:
+            self.probe(imdb_movie)
+        return dict((key, match[0]) for key, match in self.matches.items())
+
+    def unmatched(self):
+        return [key for key in self.keys if key not in self.matches]
+
+    # imdb years to read for the candidates of the unmatched movies
+    def candidate_years(self):
+        years = set()
+        for key in self.unmatched():
+            year = self.keys[key][1]
+            years.update(range(year - YEAR_SLACK, year + YEAR_SLACK + 1))
+        return sorted(years)
+
+    # stream the imdb movies of candidate_years(), {key: [(imdbtitle, ratio)]} best first
+    def find_candidates(self, cursor, n=CANDIDATES, min_ratio=MIN_RATIO):
+        # unmatched keys by (word, year), so that an imdb title is only compared with the ones sharing a word
+        blocks = {}
+        matchers = {}
+        for key in self.unmatched():
+            title, year = self.keys[key]
+            matchers[key] = difflib.SequenceMatcher(None, b=title, autojunk=False)
+            for word in set(title.split(" ")) - STOPWORDS:
+                for cur_year in range(year - YEAR_SLACK, year + YEAR_SLACK + 1):
+                    blocks.setdefault((word, cur_year), set()).add(key)
+
+        candidates = dict((key, {}) for key in matchers)
+        for imdb_movie in cursor:
+            year = omdbFields.parse_year(imdb_movie.get("year"))
+            for title in imdb_movie.get("title") or []:
+                title = normalize_title(title)
+                keys = set()
+                for word in set(title.split(" ")) - STOPWORDS:
+                    keys.update(blocks.get((word, year), ()))
+                for key in keys:
+                    matchers[key].set_seq1(title)
+                    ratio = matchers[key].ratio()
+                    cur_candidates = candidates[key]
+                    if ratio >= min_ratio and ratio > cur_candidates.get(imdb_movie["imdbtitle"], 0):
+                        cur_candidates[imdb_movie["imdbtitle"]] = ratio
+        return dict((key, sorted(found.items(), key=lambda item: (-item[1], item[0]))[:n]) for key, found in candidates.items())
+
+# match MovieLens movies (mid, title_imdb, year) with the imdb movies:
+# ({mid: imdbtitle}, {mid: [(imdbtitle, ratio)]} of the unmatched ones, empty without fuzzy)
+def match_imdb(db_imdb, movies, fuzzy=True):
+    startTime = time.time()
+    join = TitleJoin((cur_movie["mid"], cur_movie["title_imdb"], cur_movie.get("year")) for cur_movie in movies if cur_movie.get("title_imdb") is not None)
+    print("[titleJoin] Hashed %d movies into %d title keys, streaming imdb movies..." % (len(join.keys), len(join.table)))
+
+    projection = {"_id": 0, "imdbtitle": 1, "title": 1, "year": 1}
+    matches = join.join(db_imdb["movies"].find({}, projection, no_cursor_timeout=True))
+    print("[titleJoin] Matched %d movies, %d unmatched (%0.2fs)" % (len(matches), len(join.unmatched()), time.time() - startTime))
+
+    candidates = {}
+    if fuzzy and len(join.unmatched()) > 0:
+        # imdbUtil.parseYear() stores the year as a string, or as the current year for unknown ones
+        years = join.candidate_years()
+        query = {"year": {"$in": [str(year) for year in years] + years}}
+        candidates = join.find_candidates(db_imdb["movies"].find(query, projection, no_cursor_timeout=True))
+        print("[titleJoin] Found candidates for %d unmatched movies (%0.2fs)" % (sum(1 for found in candidates.values() if len(found) > 0), time.time() - startTime))
+    return matches, candidates
+
+
+def main():
+    mongo = Mongo("movieRecommend")
+    movies = list(mongo.db["movie"].find({}, {"mid": 1, "title_imdb": 1, "year": 1}))
+    matches, candidates = match_imdb(mongo.client["imdb"], movies)
+    for mid, found in sorted(candidates.items())[:20]:
+        print(mid, found)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import time
+import heapq
+import queue
+import random
+import numpy
+from operator import itemgetter
+
+# Shared top-k selection for all recommenders and ranking passes.
+# Two modes:
+#       -streaming  (TopKHeap, top_k_stream)  bounded min heap over (cid, score) pairs
+#       -bulk       (top_k_array)               argpartition over a score array
+# top_k_dict picks the cheaper one for a {cid: score} candidates dict.
+# All functions return the winners ordered by descending score.
+
+BULK_THRESHOLD = 50000  # dicts larger than this go through the array mode
+
+# bounded min heap keeping the k best candidates pushed so far
+class TopKHeap(object):
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.count = 0  # tie breaker, cids are never compared
+
+    def push(self, cid, score):
+        self.count += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (score, self.count, cid))
+        elif score > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (score, self.count, cid))
+
+    # (cid, score) pairs, best first
+    def result(self):
+        return [(entry[2], entry[0]) for entry in sorted(self.heap, reverse=True)]
+
+    def cids(self):
+        return [cid for cid, score in self.result()]
+
+# keep the k best (cid, score) pairs of an iterable
+def top_k_stream(pairs, k):
+    if k <= 0:
+        return []
+    heap = TopKHeap(k)
+    for cid, score in pairs:
+        heap.push(cid, score)
+    return heap.result()
+
+# indices of the k highest scores in a numpy array, best first
+def top_k_array(scores, k):
+    scores = numpy.asarray(scores)
+    k = min(k, len(scores))
+    if k <= 0:
+        return numpy.empty(0, dtype=numpy.int64)
+    if k < len(scores):
+        top = numpy.argpartition(-scores, k - 1)[:k]
+    else:
+        top = numpy.arange(len(scores))
+    return top[numpy.argsort(-scores[top], kind="stable")]
+
+# top-k (cid, score) pairs given a dictionary storing candidates' scores
+def top_k_dict(candidates, k):
+    if len(candidates) <= BULK_THRESHOLD:
+        return heapq.nlargest(k, candidates.items(), key=itemgetter(1))
+    cids = list(candidates.keys())
+    scores = numpy.fromiter(candidates.values(), dtype=numpy.float64, count=len(cids))
+    return [(cids[i], float(scores[i])) for i in top_k_array(scores, k)]
+
+# the old selection, kept here only as the benchmark baseline
+def top_k_priority_queue(candidates, k):
+    pool = queue.PriorityQueue()
+    for cid in candidates:
+        pool.put((candidates[cid], cid))
+        if pool.qsize() > k:
+            pool.get()
+    top_k = []
+    while not pool.empty():
+        score, cid = pool.get()
+        top_k.append((cid, score))
+    top_k.reverse()
+    return top_k
+
+
+def main():
+    # micro-benchmark over candidate dicts of the size recommend_movies_combined_integrated produces
+    k = 20
+    for size in [100000, 1000000, 3000000]:
+        random.seed(size)
+        candidates = {}
+        for i in range(size):
+            candidates["Movie %d (%d)" % (i, 1900 + i % 120)] = random.random()
+        print("[topK] ***** %d candidates, k = %d *****" % (size, k))
+
+        startTime = time.time()
+        expected = top_k_priority_queue(candidates, k)
+        baseline = time.time() - startTime
+        print("[topK] PriorityQueue: %0.3fs" % baseline)
+
+        startTime = time.time()
+        result = top_k_stream(candidates.items(), k)
+        elapsed = time.time() - startTime
+        print("[topK] Stream heap:   %0.3fs (%0.1fx)%s" % (elapsed, baseline / elapsed, "" if result == expected else " MISMATCH"))
+
+        startTime = time.time()
+        result = heapq.nlargest(k, candidates.items(), key=itemgetter(1))
+        elapsed = time.time() - startTime
+        print("[topK] heapq.nlargest: %0.3fs (%0.1fx)%s" % (elapsed, baseline / elapsed, "" if result == expected else " MISMATCH"))
+
+        startTime = time.time()
+        cids = list(candidates.keys())
+        scores = numpy.fromiter(candidates.values(), dtype=numpy.float64, count=len(cids))
+        result = [(cids[i], float(scores[i])) for i in top_k_array(scores, k)]
+        elapsed = time.time() - startTime
+        print("[topK] Argpartition:  %0.3fs (%0.1fx)%s" % (elapsed, baseline / elapsed, "" if result == expected else " MISMATCH"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+from DataService import Mongo
+from bson.binary import Binary
+import os
+import time
+import array
+import numpy
+import topK
+
+# Resident sparse user x movie matrix built from MovieLens ratings.
+# db name: movieRecommend
+# collection name: user_rate
+# Rows are users, stored CSR-style:
+#       -uids       row -> MovieLens user id
+#       -indptr     row -> [start, end) offsets into mids/ratings
+#       -mids       rated movie ids (int32)
+#       -ratings    ratings (float32)
+# On top of the rows we keep an inverted "likes" index (movie -> users who rated
+# it >= 3.5), so that scoring a history only touches the users sharing a movie.
+# The matrix is loaded from the columnar files written by movieLensRatings when they exist
+# (indexdata/user_ratings_*.npy), and from the user_rate collection otherwise.
+# user_rate documents store their ratings as little-endian binary arrays:
+#       -rated_mids     movie ids (int32)
+#       -rated_stars    ratings in half stars, rating * 2 (uint8)
+# get_user_ratings() still understands the old "ratings": [[mid, rating], ...] lists.
+# HistoryNeighbours keeps the overlap of an edited history with every user: adding or removing
+# a movie only updates the users who liked it, instead of rescoring the whole history.
+
+LIKE_THRESHOLD = 3.5
+MIN_LIKES = 5
+
+INDEX_DIR = "indexdata"
+INDEX_NAME = "user_ratings"
+MID_TYPE = numpy.dtype("<i4")
+STAR_TYPE = numpy.dtype("u1")
+
+def pack_mids(mids):
+    return Binary(numpy.asarray(mids, dtype=MID_TYPE).tobytes())
+
+def pack_stars(stars):
+    return Binary(numpy.asarray(stars, dtype=STAR_TYPE).tobytes())
+
+# (mids int32, ratings float32) arrays of a user_rate document
+def get_user_ratings(user_doc):
+    if "rated_mids" in user_doc:
+        mids = numpy.frombuffer(user_doc["rated_mids"], dtype=MID_TYPE)
+        stars = numpy.frombuffer(user_doc["rated_stars"], dtype=STAR_TYPE)
+        return mids, stars.astype(numpy.float32) / 2
+    mids = numpy.asarray([rating[0] for rating in user_doc.get("ratings", [])], dtype=numpy.int32)
+    ratings = numpy.asarray([rating[1] for rating in user_doc.get("ratings", [])], dtype=numpy.float32)
+    return mids, ratings
+
+def index_path(name, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, INDEX_NAME + "_" + name + ".npy")
+
+class UserMatrix(object):
+
+    def __init__(self, uids, indptr, mids, ratings):
+        self.uids = numpy.asarray(uids, dtype=numpy.int32)
+        self.indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        self.mids = numpy.asarray(mids, dtype=numpy.int32)
+        self.ratings = numpy.asarray(ratings, dtype=numpy.float32)
+        self.max_mid = int(self.mids.max()) if len(self.mids) > 0 else 0
+        self.rows = {}
+        for row in range(len(self.uids)):
+            self.rows[int(self.uids[row])] = row
+        self.build_like_index()
+
+    # load every user's ratings from user_rate into flat arrays
+    @classmethod
+    def build(cls, mongo):
+        print("[UserMatrix] Starting build of user matrix from user_rate...")
+        startTime = time.time()
+
+        progressInterval = 25000  # How often should we print a progress report to the console?
+        progressTotal = 247753    # Approximate number of total users
+        count = 0
+
+        uids = array.array("i")
+        indptr = array.array("q", [0])
+        mids = array.array("i")
+        ratings = array.array("f")
+        cursor = mongo.client["movieRecommend"]["user_rate"].find({}, {"uid": 1, "ratings": 1, "rated_mids": 1, "rated_stars": 1})
+        for cur_user in cursor:
+            count += 1
+            if count % progressInterval == 0:
+                print("[UserMatrix] %6d users loaded so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / progressTotal), time.time() - startTime))
+            uids.append(cur_user["uid"])
+            cur_mids, cur_ratings = get_user_ratings(cur_user)
+            mids.frombytes(cur_mids.tobytes())
+            ratings.frombytes(cur_ratings.tobytes())
+            indptr.append(len(mids))
+
+        matrix = cls(numpy.frombuffer(uids, dtype=numpy.int32),
+                     numpy.frombuffer(indptr, dtype=numpy.int64),
+                     numpy.frombuffer(mids, dtype=numpy.int32),
+                     numpy.frombuffer(ratings, dtype=numpy.float32))
+        print("[UserMatrix] Built matrix: %d users, %d ratings (%0.2fs)" % (len(matrix.uids), len(matrix.mids), time.time() - startTime))
+        return matrix
+
+    # load the columnar ratings written by movieLensRatings, None if they were never written
+    @classmethod
+    def load_columnar(cls, index_dir=INDEX_DIR):
+        if not os.path.isfile(index_path("stars", index_dir)):
+            return None
+        print("[UserMatrix] Loading user matrix from " + index_path("*", index_dir))
+        startTime = time.time()
+        stars = numpy.load(index_path("stars", index_dir))
+        matrix = cls(numpy.load(index_path("uids", index_dir)),
+                     numpy.load(index_path("indptr", index_dir)),
+                     numpy.load(index_path("mids", index_dir)),
+                     stars.astype(numpy.float32) / 2)
+        print("[UserMatrix] Loaded matrix: %d users, %d ratings (%0.2fs)" % (len(matrix.uids), len(matrix.mids), time.time() - startTime))
+        return matrix
+
+    # columnar files if present, user_rate otherwise
+    @classmethod
+    def load(cls, mongo, index_dir=INDEX_DIR):
+        matrix = cls.load_columnar(index_dir)
+        if matrix is None:
+            matrix = cls.build(mongo)
+        return matrix
+
+    # write the columnar files read by load_columnar(), for a matrix built from user_rate
+    def save_columnar(self, index_dir=INDEX_DIR):
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        numpy.save(index_path("uids", index_dir), self.uids)
+        numpy.save(index_path("indptr", index_dir), self.indptr)
+        numpy.save(index_path("mids", index_dir), self.mids)
+        # stars last: load_columnar() checks for this file
+        numpy.save(index_path("stars", index_dir), numpy.rint(self.ratings * 2).astype(STAR_TYPE))
+        print("[UserMatrix] Wrote columnar ratings of %d users to %s" % (len(self.uids), index_dir))
+
+    # build the movie -> liking users index (CSC view of the likes matrix)
+    def build_like_index(self):
+        row_of_entry = numpy.repeat(numpy.arange(len(self.uids), dtype=numpy.int32), numpy.diff(self.indptr))
+        liked = self.ratings >= LIKE_THRESHOLD
+        like_rows = row_of_entry[liked]
+        like_mids = self.mids[liked]
+        self.like_counts = numpy.bincount(like_rows, minlength=len(self.uids))
+
+        order = numpy.argsort(like_mids, kind="stable")
+        sorted_mids = like_mids[order]
+        self.like_users = like_rows[order]
+        self.like_movies, starts = numpy.unique(sorted_mids, return_index=True)
+        self.like_ptr = numpy.append(starts, len(sorted_mids)).astype(numpy.int64)
+
+    def get_row(self, uid):
+        return self.rows.get(uid, -1)
+
+    def get_rated(self, uid):
+        row = self.get_row(uid)
+        if row < 0:
+            return numpy.empty(0, dtype=numpy.int32)
+        return self.mids[self.indptr[row]:self.indptr[row + 1]]
+
+    def get_liked(self, uid):
+        row = self.get_row(uid)
+        if row < 0:
+            return numpy.empty(0, dtype=numpy.int32)
+        start = self.indptr[row]
+        end = self.indptr[row + 1]
+        return self.mids[start:end][self.ratings[start:end] >= LIKE_THRESHOLD]
+
+    # rows of all users who liked at least one of the given movies (with repeats)
+    def get_users_liking(self, mids):
+        targets = numpy.unique(numpy.asarray(list(mids), dtype=numpy.int32))
+        pos = numpy.searchsorted(self.like_movies, targets)
+        inside = pos < len(self.like_movies)
+        pos = pos[inside]
+        pos = pos[self.like_movies[pos] == targets[inside]]
+        if len(pos) == 0:
+            return numpy.empty(0, dtype=numpy.int32)
+        return numpy.concatenate([self.like_users[self.like_ptr[p]:self.like_ptr[p + 1]] for p in pos])
+
+    # cosine similarity between the target like set and every user, in one pass
+    # users with less than MIN_LIKES liked movies score -1 so they never get picked
+    def score_history(self, target_like, target_id=0):
+        overlap = numpy.bincount(self.get_users_liking(target_like), minlength=len(self.uids))
+        norms = numpy.sqrt(self.like_counts.astype(numpy.float64) * len(target_like))
+        scores = numpy.divide(overlap, norms, out=numpy.zeros(len(self.uids)), where=norms > 0)
+        scores[self.like_counts < MIN_LIKES] = -1
+        target_row = self.get_row(target_id)
+        if target_row >= 0:
+            scores[target_row] = -1
+        return scores
+
+    # same cosine similarity as score_history(), for the given rows only
+    def score_rows(self, target_like, rows):
+        targets = numpy.asarray(list(target_like), dtype=numpy.int64)
+        targets = targets[targets <= self.max_mid]
+        wanted = numpy.zeros(self.max_mid + 1, dtype=bool)
+        wanted[targets] = True
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        owner = numpy.repeat(numpy.arange(len(rows)), lengths)
+        entries = numpy.arange(lengths.sum()) + numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+        hit = (self.ratings[entries] >= LIKE_THRESHOLD) & wanted[self.mids[entries]]
+        overlap = numpy.bincount(owner[hit], minlength=len(rows))
+        like_counts = self.like_counts[rows]
+        norms = numpy.sqrt(like_counts.astype(numpy.float64) * len(target_like))
+        scores = numpy.divide(overlap, norms, out=numpy.zeros(len(rows)), where=norms > 0)
+        scores[like_counts < MIN_LIKES] = -1
+        return scores
+
+    # return the uids of the k most similar users, most similar first
+    def get_similar_users(self, target_like, k, target_id=0):
+        scores = self.score_history(target_like, target_id)
+        top = topK.top_k_array(scores, k)
+        top = top[scores[top] >= 0]
+        return [int(uid) for uid in self.uids[top]]
+
+    # count how many of the given users like each movie, skipping excluded movies
+    def count_likes(self, uids, exclude=()):
+        liked = [self.get_liked(uid) for uid in uids]
+        if len(liked) == 0:
+            return {}
+        mids, counts = numpy.unique(numpy.concatenate(liked), return_counts=True)
+        movies_count = {}
+        for mid, cnt in zip(mids.tolist(), counts.tolist()):
+            if mid not in exclude:
+                movies_count[mid] = cnt
+        return movies_count
+
+class HistoryNeighbours(object):
+
+    def __init__(self, matrix, history=()):
+        self.matrix = matrix
+        # number of history movies every user liked
+        self.overlap = numpy.zeros(len(matrix.uids), dtype=numpy.int32)
+        self.history = set()
+        for mid in history:
+            self.add(mid)
+
+    # returns False when the movie already was in the history
+    def add(self, mid):
+        if mid in self.history:
+            return False
+        self.history.add(mid)
+        self.overlap[self.matrix.get_users_liking([mid])] += 1
+        return True
+
+    # returns False when the movie was not in the history
+    def remove(self, mid):
+        if mid not in self.history:
+            return False
+        self.history.remove(mid)
+        self.overlap[self.matrix.get_users_liking([mid])] -= 1
+        return True
+
+    # same scores as UserMatrix.score_history() on the current history
+    def score_history(self, target_id=0):
+        norms = numpy.sqrt(self.matrix.like_counts.astype(numpy.float64) * len(self.history))
+        scores = numpy.divide(self.overlap, norms, out=numpy.zeros(len(self.overlap)), where=norms > 0)
+        scores[self.matrix.like_counts < MIN_LIKES] = -1
+        target_row = self.matrix.get_row(target_id)
+        if target_row >= 0:
+            scores[target_row] = -1
+        return scores
+
+    # return the uids of the k most similar users, most similar first
+    def get_similar_users(self, k, target_id=0):
+        scores = self.score_history(target_id)
+        top = topK.top_k_array(scores, k)
+        top = top[scores[top] >= 0]
+        return [int(uid) for uid in self.matrix.uids[top]]
+
+
+def main():
+    matrix = UserMatrix.load(Mongo("movieRecommend"))
+    startTime = time.time()
+    target_like = set(matrix.get_liked(4).tolist())
+    print(matrix.get_similar_users(target_like, 20, 4))
+    print("[UserMatrix] Query done (%0.4fs)" % (time.time() - startTime))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+from DataService import Mongo
+import multiprocessing
+import pymongo
+import os
+import sys
+import time
+import numpy
+import topK
+import imdbUtil
+import recommendCache
+from userMatrix import UserMatrix, LIKE_THRESHOLD, MIN_LIKES
+
+# MinHash-LSH index over the users' liked sets (ratings >= 3.5), for approximate similar users.
+# Offline, every user with at least MIN_LIKES likes gets a signature of NUM_HASHES minhashes,
+# with universal hashes (a * mid + b) mod PRIME, stored in indexdata/:
+#       -user_lsh_uids.npy          signature row -> user id (int32)
+#       -user_lsh_signatures.npy    row -> NUM_HASHES minhashes (uint32)
+#       -user_lsh_params.npy        a and b of every hash function (uint64, 2 x NUM_HASHES)
+# When loaded, the signatures are cut into BANDS bands of ROWS minhashes, every band is hashed into
+# a 64 bit bucket key and each band is sorted by key, so finding a bucket is a binary search.
+# A query rescores exactly (same cosine as UserMatrix.score_history()) only the users sharing at
+# least one bucket with it. Two like sets of Jaccard similarity s share a bucket with probability
+# 1 - (1 - s^ROWS)^BANDS. The exact scan stays available (MovieRecommend.similar_users_mode),
+# and main() benchmarks the latency/recall trade-off of a few band shapes against it.
+# Like sets are far apart (Jaccard mostly below 0.3), so only short bands find k candidates: 64 x 2 is
+# the longest shape that fills k for nearly every query; 128 x 1 rescores a large part of all users.
+#
+# precompute() fills user_rate.similar_users (top NEIGHBOURS exact neighbours) for every user with at
+# least MIN_LIKES likes, the same list MovieRecommend.get_similar_users() would store lazily.
+# It is a blocked sparse product of the likes matrix with its transpose: BLOCK_SIZE users at a
+# time are expanded through the movie -> liking users index into (user, co-liking user) pairs, and
+# their overlaps are counted in one bincount. The users are split into shards of SHARD_SIZE rows
+# handed to a pool of worker processes, each loading the columnar ratings and bulk writing its shard.
+# A checkpoint (imdbdata/checkpoints/similar_users.json) records the finished shards, so a stopped
+# run resumes with the others. Finished runs are skipped unless restarted.
+# Usage: python userSimilarity.py [build]                   (builds the signatures when missing, then benchmarks)
+#        python userSimilarity.py precompute [--restart]    (fills similar_users, resuming from the checkpoint)
+
+INDEX_DIR = "indexdata"
+INDEX_NAME = "user_lsh"
+NUM_HASHES = 128
+BANDS = 64
+ROWS = 2
+PRIME = (1 << 31) - 1
+MIX = numpy.uint64(0x9E3779B97F4A7C15)
+SEED = 1
+NEIGHBOURS = 20
+SHARD_SIZE = 2048           # Users per worker task (and per checkpoint entry).
+BLOCK_SIZE = 32             # Users multiplied against the likes matrix at once.
+MAX_PAIRS = 1 << 23         # Co-liking pairs expanded at once.
+CHECKPOINT = "similar_users"
+workerMatrix = None         # User matrix of the current worker process.
+workerMongo = None          # Database connection of the current worker process.
+
+def index_path(name, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, INDEX_NAME + "_" + name + ".npy")
+
+def make_params(num_hashes=NUM_HASHES, seed=SEED):
+    rng = numpy.random.RandomState(seed)
+    a = rng.randint(1, PRIME, num_hashes).astype(numpy.uint64)
+    b = rng.randint(0, PRIME, num_hashes).astype(numpy.uint64)
+    return numpy.vstack((a, b))
+
+# signature of one like set
+def minhash(mids, params):
+    mids = numpy.asarray(mids, dtype=numpy.uint64)
+    if len(mids) == 0:
+        return numpy.full(params.shape[1], PRIME, dtype=numpy.uint32)
+    values = (params[0][:, None] * mids[None, :] + params[1][:, None]) % numpy.uint64(PRIME)
+    return values.min(axis=1).astype(numpy.uint32)
+
+# signatures of every user with at least MIN_LIKES likes, one hash function at a time over all likes
+def compute_signatures(matrix, params):
+    startTime = time.time()
+    row_of_entry = numpy.repeat(numpy.arange(len(matrix.uids), dtype=numpy.int32), numpy.diff(matrix.indptr))
+    liked = matrix.ratings >= LIKE_THRESHOLD
+    like_rows = row_of_entry[liked]
+    like_mids = matrix.mids[liked].astype(numpy.uint64)
+    keep = matrix.like_counts[like_rows] >= MIN_LIKES
+    like_rows = like_rows[keep]
+    like_mids = like_mids[keep]
+
+    starts = numpy.flatnonzero(numpy.diff(like_rows, prepend=-1) != 0)
+    rows = like_rows[starts]
+    signatures = numpy.empty((len(rows), params.shape[1]), dtype=numpy.uint32)
+    for h in range(params.shape[1]):
+        values = (params[0, h] * like_mids + params[1, h]) % numpy.uint64(PRIME)
+        signatures[:, h] = numpy.minimum.reduceat(values, starts)
+        if (h + 1) % 16 == 0:
+            print("[userSimilarity] %3d/%d hash functions computed. (%0.2fs)" % (h + 1, params.shape[1], time.time() - startTime))
+    return matrix.uids[rows], signatures
+
+# one 64 bit bucket key per band (wrapping multiply-add of the band's minhashes)
+def band_keys(signatures, bands=BANDS, rows=ROWS):
+    bands = min(bands, signatures.shape[1] // rows)
+    sig = signatures[:, :bands * rows].astype(numpy.uint64).reshape(len(signatures), bands, rows)
+    keys = numpy.zeros((len(signatures), bands), dtype=numpy.uint64)
+    for j in range(rows):
+        keys = keys * MIX + sig[:, :, j]
+    return keys
+
+def build(matrix, index_dir=INDEX_DIR, num_hashes=NUM_HASHES):
+    print("[userSimilarity] Starting build of user MinHash signatures...")
+    startTime = time.time()
+    params = make_params(num_hashes)
+    uids, signatures = compute_signatures(matrix, params)
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    numpy.save(index_path("uids", index_dir), uids)
+    numpy.save(index_path("params", index_dir), params)
+    # written last: UserLSHIndex.load() checks for this file
+    numpy.save(index_path("signatures", index_dir), signatures)
+    recommendCache.bump_data_version()
+    print("[userSimilarity] Build Complete: %d users (%0.2fs)" % (len(uids), time.time() - startTime))
+
+class UserLSHIndex(object):
+
+    def __init__(self, matrix, index_dir=INDEX_DIR, bands=BANDS, rows=ROWS):
+        print("[userSimilarity] Loading user LSH index (%d bands x %d rows)..." % (bands, rows))
+        startTime = time.time()
+        self.matrix = matrix
+        self.bands = bands
+        self.rows = rows
+        self.params = numpy.load(index_path("params", index_dir))
+        uids = numpy.load(index_path("uids", index_dir))
+        signatures = numpy.load(index_path("signatures", index_dir))
+        # signature row -> matrix row, users missing from the matrix are left out
+        matrix_rows = numpy.asarray([matrix.get_row(int(uid)) for uid in uids], dtype=numpy.int64)
+        known = matrix_rows >= 0
+        self.matrix_rows = matrix_rows[known]
+
+        keys = band_keys(signatures[known], bands, rows)
+        order = numpy.argsort(keys, axis=0, kind="stable")
+        self.order = numpy.ascontiguousarray(order.T.astype(numpy.int32))
+        self.keys = numpy.ascontiguousarray(numpy.take_along_axis(keys, order, axis=0).T)
+        print("[userSimilarity] Loaded %d users (%0.2fs)" % (len(self.matrix_rows), time.time() - startTime))
+
+    # None if the signatures were never built
+    @classmethod
+    def load(cls, matrix, index_dir=INDEX_DIR, bands=BANDS, rows=ROWS):
+        if not os.path.isfile(index_path("signatures", index_dir)):
+            return None
+        return cls(matrix, index_dir, bands, rows)
+
+    # matrix rows of the users sharing a bucket with the like set
+    def get_candidates(self, target_like):
+        signature = minhash(numpy.asarray(sorted(target_like), dtype=numpy.int64), self.params)
+        query = band_keys(signature[None, :], self.bands, self.rows)[0]
+        found = []
+        for band in range(len(query)):
+            start = numpy.searchsorted(self.keys[band], query[band], "left")
+            end = numpy.searchsorted(self.keys[band], query[band], "right")
+            if end > start:
+                found.append(self.order[band][start:end])
+        if len(found) == 0:
+            return numpy.empty(0, dtype=numpy.int64)
+        return self.matrix_rows[numpy.unique(numpy.concatenate(found))]
+
+    # return the uids of the k most similar users among the candidates only, most similar first
+    # (less than k when the buckets hold less than k users)
+    def get_similar_candidates(self, target_like, k, target_id=0):
+        rows = self.get_candidates(target_like)
+        rows = rows[rows != self.matrix.get_row(target_id)]
+        if len(rows) == 0:
+            return []
+        scores = self.matrix.score_rows(target_like, rows)
+        top = topK.top_k_array(scores, k)
+        top = top[scores[top] >= 0]
+        return [int(uid) for uid in self.matrix.uids[rows[top]]]
+
+    # return the uids of the k most similar users among the candidates, most similar first
+    # (exact scan when the buckets hold less than k users)
+    def get_similar_users(self, target_like, k, target_id=0):
+        similar = self.get_similar_candidates(target_like, k, target_id)
+        if len(similar) < k:
+            return self.matrix.get_similar_users(target_like, k, target_id)
+        return similar
+
+
+# latency and recall@k of the LSH path alone (candidates rescored, no exact fallback) against the
+# exact scan, on a sample of users. "short" counts the queries that would fall back in get_similar_users().
+def benchmark(matrix, index_dir=INDEX_DIR, shapes=((128, 1), (64, 2), (42, 3), (32, 4)), samples=200, k=20):
+    rng = numpy.random.RandomState(SEED)
+    eligible = numpy.flatnonzero(matrix.like_counts >= MIN_LIKES)
+    users = [int(matrix.uids[row]) for row in rng.choice(eligible, min(samples, len(eligible)), replace=False)]
+    targets = [set(matrix.get_liked(uid).tolist()) for uid in users]
+
+    startTime = time.time()
+    exact = [matrix.get_similar_users(target, k, uid) for uid, target in zip(users, targets)]
+    exactTime = (time.time() - startTime) / len(users)
+    print("[userSimilarity] exact scan: %0.2fms per query" % (exactTime * 1000))
+
+    for bands, rows in shapes:
+        index = UserLSHIndex(matrix, index_dir, bands, rows)
+        startTime = time.time()
+        approximate = [index.get_similar_candidates(target, k, uid) for uid, target in zip(users, targets)]
+        lshTime = (time.time() - startTime) / len(users)
+        found = sum([len(set(result) & set(expected)) for result, expected in zip(approximate, exact)])
+        candidates = [len(index.get_candidates(target)) for target in targets]
+        short = len([result for result in approximate if len(result) < k])
+        recall = found / float(max(1, sum([len(expected) for expected in exact])))
+        print("[userSimilarity] %2d bands x %d rows: %0.2fms per query (x%0.1f), recall@%d %0.3f, %d candidates per query, %d short of k"
+              % (bands, rows, lshTime * 1000, exactTime / max(lshTime, 1e-9), k, recall, sum(candidates) // len(users), short))
+
+
+# top-k neighbours of a block of matrix rows: overlaps of their likes with every user, counted over
+# the (block row, co-liking user) pairs, scored with the same cosine as UserMatrix.score_history()
+def block_neighbours(matrix, rows, k=NEIGHBOURS):
+    total = len(matrix.uids)
+    starts = matrix.indptr[rows]
+    lengths = matrix.indptr[rows + 1] - starts
+    local = numpy.repeat(numpy.arange(len(rows), dtype=numpy.int64), lengths)
+    entries = numpy.arange(lengths.sum()) + numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+    liked = matrix.ratings[entries] >= LIKE_THRESHOLD
+    local = local[liked]
+    # every liked movie is in the likes index
+    pos = numpy.searchsorted(matrix.like_movies, matrix.mids[entries[liked]])
+    begin = matrix.like_ptr[pos]
+    counts = matrix.like_ptr[pos + 1] - begin
+    ends = numpy.cumsum(counts)
+
+    overlap = numpy.zeros(len(rows) * total, dtype=numpy.int64)
+    first = 0
+    while first < len(counts):
+        done = ends[first - 1] if first > 0 else 0
+        last = max(first + 1, int(numpy.searchsorted(ends, done + MAX_PAIRS, "right")))
+        cur_counts = counts[first:last]
+        offsets = numpy.cumsum(cur_counts) - cur_counts
+        pairs = numpy.arange(cur_counts.sum()) + numpy.repeat(begin[first:last] - offsets, cur_counts)
+        keys = numpy.repeat(local[first:last] * total, cur_counts) + matrix.like_users[pairs]
+        overlap += numpy.bincount(keys, minlength=len(rows) * total)
+        first = last
+    overlap = overlap.reshape(len(rows), total)
+
+    like_counts = matrix.like_counts.astype(numpy.float64)
+    norms = numpy.sqrt(like_counts[rows][:, None] * like_counts[None, :])
+    scores = numpy.divide(overlap, norms, out=numpy.zeros(overlap.shape), where=norms > 0)
+    scores[:, matrix.like_counts < MIN_LIKES] = -1
+    scores[numpy.arange(len(rows)), rows] = -1
+
+    neighbours = []
+    for i in range(len(rows)):
+        top = topK.top_k_array(scores[i], k)
+        top = top[scores[i][top] >= 0]
+        neighbours.append([int(uid) for uid in matrix.uids[top]])
+    return neighbours
+
+def init_worker(index_dir):
+    global workerMatrix, workerMongo
+    workerMatrix = UserMatrix.load_columnar(index_dir)
+    workerMongo = Mongo("movieRecommend")
+
+# compute and store the neighbours of the users in matrix rows [start, end)
+def precompute_shard(task, matrix=None, mongo=None):
+    start, end = task
+    matrix = workerMatrix if matrix is None else matrix
+    mongo = workerMongo if mongo is None else mongo
+    bulkPayload = pymongo.bulk.BulkOperationBuilder(mongo.db["user_rate"], ordered = False)
+    bulkCount = 0
+    skipCount = 0
+    rows = numpy.arange(start, end)
+    # users with too short a history get no neighbours, as in MovieRecommend.get_similar_users_by_history()
+    rows = rows[matrix.like_counts[rows] >= MIN_LIKES]
+    for first in range(0, len(rows), BLOCK_SIZE):
+        block = rows[first:first + BLOCK_SIZE]
+        for row, most_similar_users in zip(block.tolist(), block_neighbours(matrix, block)):
+            if len(most_similar_users) > 0:
+                bulkPayload.find({"uid": int(matrix.uids[row])}).update({"$set": {"similar_users": most_similar_users}})
+                bulkCount += 1
+    if bulkCount > 0:
+        try:
+            bulkPayload.execute()
+        except pymongo.errors.OperationFailure as e:
+            skipCount += len(e.details["writeErrors"])
+    return start, end - start, bulkCount, skipCount
+
+# fill similar_users for all users, resuming from the checkpoint unless restart is set
+def precompute(mongo, workers=4, restart=False, index_dir=INDEX_DIR):
+    print("[userSimilarity] Starting precomputation of similar users...")
+    startTime = time.time()
+    checkpoint = imdbUtil.Checkpoint(CHECKPOINT)
+    if restart:
+        checkpoint.clear()
+    if checkpoint.done:
+        print("[userSimilarity] Similar users already precomputed, skipped.")
+        return
+
+    matrix = UserMatrix.load_columnar(index_dir)
+    if matrix is None:
+        # the workers load the matrix from the columnar ratings
+        matrix = UserMatrix.build(mongo)
+        matrix.save_columnar(index_dir)
+    total = len(matrix.uids)
+    tasks = [(start, min(start + SHARD_SIZE, total)) for start in range(0, total, SHARD_SIZE) if start not in checkpoint.chunks]
+    if len(checkpoint.chunks) > 0:
+        print("[userSimilarity] Resuming, %d shards left." % len(tasks))
+
+    if workers <= 1:
+        results = (precompute_shard(task, matrix, mongo) for task in tasks)
+    else:
+        matrix = None
+        # spawn, so that no worker inherits the MongoClient of the parent process
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(index_dir,))
+        results = pool.imap_unordered(precompute_shard, tasks)
+
+    count = total - sum([end - start for start, end in tasks])
+    userCount = 0
+    skipCount = 0
+    for start, shardUsers, shardUpdates, shardSkips in results:
+        count += shardUsers
+        userCount += shardUpdates
+        skipCount += shardSkips
+        checkpoint.finishChunk(start)
+        print("[userSimilarity] %6d users processed so far. (%d%%) (%0.2fs)" % (count, int(count * 100 / max(1, total)), time.time() - startTime))
+
+    if workers > 1:
+        pool.close()
+        pool.join()
+    checkpoint.finish()
+    print("[userSimilarity] Precomputation Complete (%0.2fs)" % (time.time() - startTime))
+    print("[userSimilarity] Stored similar users of " + str(userCount) + " users.")
+    print("[userSimilarity] Skipped " + str(skipCount) + " updates.")
+
+
+def main():
+    mongo = Mongo("movieRecommend")
+    if len(sys.argv) > 1 and sys.argv[1] == "precompute":
+        precompute(mongo, restart="--restart" in sys.argv)
+        return
+    matrix = UserMatrix.load(mongo)
+    if (len(sys.argv) > 1 and sys.argv[1] == "build") or not os.path.isfile(index_path("signatures")):
+        build(matrix)
+    benchmark(matrix)
+
+if __name__ == "__main__":
+    main()
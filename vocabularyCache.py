@@ -0,0 +1,151 @@
+from DataService import Mongo
+import os
+import time
+import pickle
+import threading
+from textMatcher import PhraseMatcher
+
+# Process-wide cache of the name pools used to match Twitter profiles.
+# Pools (pool name: db.collection -> field):
+#       -actors:            movieRecommend.actors_list -> actor
+#       -peoples:           integration.peoples_name_only -> names (lists of names)
+#       -tags:              movieRecommend.tag -> content
+#       -normalized_tags:   integration.normalized_tags -> tag
+# A pool is built once per process and reused until its backing collection changes.
+# The collection signature is (document count, newest _id), checked at most every
+# CHECK_INTERVAL seconds. Pools are also snapshotted to indexdata/vocabulary_<pool>.pickle
+# so that a new process starts from the snapshot when the signature still matches.
+# Call invalidate() after rewriting a collection in place (same count and _ids).
+# get_matcher() compiles a pool into a PhraseMatcher, recompiled only when the pool is rebuilt.
+
+SNAPSHOT_DIR = "indexdata"
+CHECK_INTERVAL = 60
+
+POOLS = {
+    "actors": ("movieRecommend", "actors_list", "actor", False),
+    "peoples": ("integration", "peoples_name_only", "names", True),
+    "tags": ("movieRecommend", "tag", "content", False),
+    "normalized_tags": ("integration", "normalized_tags", "tag", False)
+    }
+
+class VocabularyCache(object):
+
+    lock = threading.Lock()
+    pools = {}          # pool name -> set of names
+    signatures = {}     # pool name -> signature the pool was built from
+    checked = {}        # pool name -> last time the signature was checked
+    matchers = {}       # (pool name, max words) -> (pool, PhraseMatcher compiled from it)
+
+    @classmethod
+    def get(cls, mongo, name):
+        with cls.lock:
+            if name in cls.pools and time.time() - cls.checked[name] < CHECK_INTERVAL:
+                return cls.pools[name]
+
+            signature = cls.get_signature(mongo, name)
+            cls.checked[name] = time.time()
+            if name in cls.pools and cls.signatures[name] == signature:
+                return cls.pools[name]
+
+            pool = cls.load_snapshot(name, signature)
+            if pool is None:
+                pool = cls.build(mongo, name)
+                cls.save_snapshot(name, signature, pool)
+            cls.pools[name] = pool
+            cls.signatures[name] = signature
+            return pool
+
+    # tweet matcher over a pool, compiled on first use and whenever the pool was rebuilt
+    @classmethod
+    def get_matcher(cls, mongo, name, max_words=3):
+        pool = cls.get(mongo, name)
+        with cls.lock:
+            key = (name, max_words)
+            if key not in cls.matchers or cls.matchers[key][0] is not pool:
+                cls.matchers[key] = (pool, PhraseMatcher(pool, max_words))
+            return cls.matchers[key][1]
+
+    # drop one pool (or all of them) so that the next get() rebuilds it
+    @classmethod
+    def invalidate(cls, name=None):
+        with cls.lock:
+            names = list(POOLS.keys()) if name is None else [name]
+            for cur_name in names:
+                cls.pools.pop(cur_name, None)
+                cls.signatures.pop(cur_name, None)
+                cls.checked.pop(cur_name, None)
+                for key in [key for key in cls.matchers.keys() if key[0] == cur_name]:
+                    del cls.matchers[key]
+                path = cls.snapshot_path(cur_name)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    @classmethod
+    def get_collection(cls, mongo, name):
+        db_name, collection, field, nested = POOLS[name]
+        return mongo.client[db_name][collection]
+
+    @classmethod
+    def get_signature(cls, mongo, name):
+        collection = cls.get_collection(mongo, name)
+        newest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        newest_id = None if newest is None else str(newest["_id"])
+        return (collection.estimated_document_count(), newest_id)
+
+    @classmethod
+    def build(cls, mongo, name):
+        print("[VocabularyCache] Building " + name + " pool...")
+        startTime = time.time()
+        db_name, collection, field, nested = POOLS[name]
+        pool = set()
+        cursor = cls.get_collection(mongo, name).find({}, {field: 1})
+        for cur_doc in cursor:
+            if field not in cur_doc:
+                continue
+            if nested:
+                pool.update(cur_doc[field])
+            else:
+                pool.add(cur_doc[field])
+        print("[VocabularyCache] Built " + name + " pool, size: %d (%0.2fs)" % (len(pool), time.time() - startTime))
+        return pool
+
+    @classmethod
+    def snapshot_path(cls, name):
+        return os.path.join(SNAPSHOT_DIR, "vocabulary_" + name + ".pickle")
+
+    @classmethod
+    def load_snapshot(cls, name, signature):
+        path = cls.snapshot_path(name)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print("[VocabularyCache] Unreadable snapshot " + path + ": " + str(e))
+            return None
+        if snapshot["signature"] != signature:
+            return None
+        print("[VocabularyCache] Loaded " + name + " pool from snapshot, size: " + str(len(snapshot["pool"])))
+        return snapshot["pool"]
+
+    @classmethod
+    def save_snapshot(cls, name, signature, pool):
+        if not os.path.isdir(SNAPSHOT_DIR):
+            os.makedirs(SNAPSHOT_DIR)
+        path = cls.snapshot_path(name)
+        # write aside and rename, so that a concurrent reader never sees half a file
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump({"signature": signature, "pool": pool}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+
+def main():
+    mongo = Mongo()
+    for name in POOLS.keys():
+        startTime = time.time()
+        pool = VocabularyCache.get(mongo, name)
+        print("[VocabularyCache] %s: %d names (%0.2fs)" % (name, len(pool), time.time() - startTime))
+
+if __name__ == "__main__":
+    main()